@@ -0,0 +1,6 @@
+"""
+Benchmarks of the editor's hot paths on a synthetic dataset:
+
+    python -m benchmarks -n 500 -o before.json
+    python -m benchmarks -n 500 -o after.json --compare before.json
+"""
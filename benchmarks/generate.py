@@ -0,0 +1,84 @@
+import argparse
+import random
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+IMAGE_SIZE = 2400
+# the left channel image is x < SPLIT, the right channel image x >= SPLIT
+SPLIT = 1200
+LEFT_NAMES = ["0001", "0002", "0003", "0101", "0102", "0103", "0104", "0201", "0203", "0204"]
+RIGHT_NAMES = ["1101", "1102", "2103", "2201", "3102", "4112"]
+
+XML = """<annotation>
+<folder>xml</folder>
+<filename>{stem}.jpeg</filename>
+<size><width>{size}</width><height>{size}</height><depth>3</depth></size>
+{objects}</annotation>
+"""
+OBJECT = """<object><name>{}</name><pose>Unspecified</pose><truncated>0</truncated><difficult>0</difficult>\
+<bndbox><xmin>{}</xmin><ymin>{}</ymin><xmax>{}</xmax><ymax>{}</ymax></bndbox></object>
+"""
+
+
+def lens_records(rng: random.Random, per_lens: int):
+    """
+    (name, xmin, ymin, xmax, ymax) of one lens: mostly small left channel
+    defects, and right channel defects of which some have a left channel
+    defect on the same line, as the count export looks them up.
+    """
+    records = []
+    for _ in range(rng.randint(per_lens // 2, per_lens * 3 // 2)):
+        w, h = int(rng.expovariate(1 / 12)) + 2, int(rng.expovariate(1 / 12)) + 2
+        y = rng.randrange(100, IMAGE_SIZE - 100 - h)
+        if rng.random() < 0.7:
+            x = rng.randrange(100, SPLIT - w)
+            records.append((rng.choice(LEFT_NAMES), x, y, x + w, y + h))
+            continue
+        x = rng.randrange(SPLIT, IMAGE_SIZE - 100 - w)
+        records.append((rng.choice(RIGHT_NAMES), x, y, x + w, y + h))
+        if rng.random() < 0.5:
+            lx = x - SPLIT
+            records.append((rng.choice(LEFT_NAMES), lx, y, lx + w, y + h))
+    return records
+
+
+def generate(root, n_lens: int, per_lens: int = 40, seed: int = 0, image_size: int = IMAGE_SIZE):
+    """
+    Write n_lens synthetic lenses to root/xml/<i>.xml and root/img/<i>.jpeg,
+    the layout the editor loads. Every lens shares one noise image encoded
+    once. Returns the number of defects written.
+    """
+    root = Path(root)
+    (root / "xml").mkdir(parents=True, exist_ok=True)
+    (root / "img").mkdir(parents=True, exist_ok=True)
+    noise = np.random.default_rng(seed).integers(80, 120, (image_size, image_size, 3), np.uint8)
+    ok, jpeg = cv2.imencode(".jpeg", noise)
+    assert ok
+    jpeg = jpeg.tobytes()
+    rng = random.Random(seed)
+    total = 0
+    for i in range(n_lens):
+        records = lens_records(rng, per_lens)
+        total += len(records)
+        objects = "".join(OBJECT.format(*r) for r in records)
+        text = XML.format(stem=i, size=image_size, objects=objects)
+        (root / "xml" / f"{i}.xml").write_text(text, encoding="utf-8")
+        (root / "img" / f"{i}.jpeg").write_bytes(jpeg)
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="write a synthetic lens dataset")
+    parser.add_argument("root")
+    parser.add_argument("-n", "--lenses", type=int, default=200)
+    parser.add_argument("--per-lens", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    total = generate(args.root, args.lenses, args.per_lens, args.seed)
+    print(f"{args.lenses} lenses, {total} defects in {args.root}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# before anything imports Qt, so the window benchmarks run headless
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from .generate import generate  # noqa: E402
+
+QUERIES = ["A", "72B", "name=0101", "name=0101-B", "x>1200", "w>=20 h<30", "name=01* or mark"]
+RULES = """\
+0101 w>5 h>5
+0102 @A w>10
+0002 x>300 x<900 w>8
+2103 -01
+2103 w>20
+4112 -02 h>10
+1101 @B
+"""
+UN_RULES = """\
+0001 w>5
+0203 h>8
+3102 w>5
+"""
+COUNT_NAMES = ["2103", "4112"]
+
+
+def measure(fn, repeat):
+    "seconds of every run of fn"
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def summary(runs):
+    return {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+
+
+def git_revision():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def wait_for(app, predicate, timeout=600):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError("benchmark step did not finish")
+        app.processEvents()
+        time.sleep(0.001)
+
+
+def run(data, repeat, work_dir):
+    """
+    Time the editor's hot paths on the dataset at data, each `repeat`
+    times, and return {benchmark name: summary}.
+    """
+    from PySide6.QtWidgets import QApplication
+
+    from lens_editor.config import root_config
+
+    config = work_dir / "config"
+    # no catalog, every load parses the xml
+    config.write_text("[catalog]\nenabled = no\n")
+    root_config(config)
+
+    from lens_editor.app import MainWindow
+    from lens_editor.catalog import find_jpeg
+    from lens_editor.defect import Lens
+    from lens_editor.export import export_count
+    from lens_editor.region import RegionProfiles
+    from lens_editor.rule import Ruleset, classify_lenses
+    from lens_editor.search import FilterParser
+    from lens_editor.table import DefectTable
+
+    app = QApplication.instance() or QApplication([])
+    results = {}
+    xml_files = sorted(x for x in Path(data).glob("**/*.xml") if x.is_file())
+    parms = [(x, find_jpeg(x)) for x in xml_files]
+    profiles = RegionProfiles()
+
+    def load_lenses():
+        table = DefectTable()
+        table.label_regions(profiles.default)
+        return [Lens(x, j, table, lazy_image=True) for x, j in parms]
+
+    results["lens_load"] = summary(measure(load_lenses, repeat))
+
+    windows = []
+
+    def load_window():
+        w = MainWindow(str(data))
+        w.resize(1280, 960)
+        w.show()
+        wait_for(app, lambda: hasattr(w, "defects"))
+        windows.append(w)
+
+    results["window_load"] = summary(measure(load_window, repeat))
+    w = windows.pop()
+    for other in windows:
+        other.hide()
+        other.deleteLater()
+    app.processEvents()
+    defects, lenses = w.defects, w.lens
+
+    def build_index():
+        FilterParser(profiles).build_index(defects)
+
+    results["filter_index"] = summary(measure(build_index, repeat))
+    for q in QUERIES:
+        # a fresh parser per run, so neither the query nor the result is cached
+        def parse():
+            parser = FilterParser(profiles)
+            parser.index = w.filter_parser.index
+            parser.parse(q, defects)
+
+        results[f"filter_parse:{q}"] = summary(measure(parse, repeat))
+
+    ruleset, un_ruleset = Ruleset(RULES), Ruleset(UN_RULES)
+    results["rule_compile"] = summary(measure(lambda: Ruleset(RULES), repeat))
+    results["rule_evaluate"] = summary(
+        measure(lambda: ruleset.evaluate_batch(defects), repeat)
+    )
+    results["rule_classify"] = summary(
+        measure(lambda: classify_lenses(lenses, ruleset, un_ruleset), repeat)
+    )
+
+    for suffix in (".xlsx", ".csv"):
+        path = work_dir / f"count{suffix}"
+        results[f"export_count{suffix}"] = summary(
+            measure(lambda: export_count(defects, COUNT_NAMES, path), repeat)
+        )
+
+    subsets = {"all": defects, "name=0101": w.filter_parser.parse("name=0101", defects)}
+    for label, d_list in subsets.items():
+        def update():
+            w.view_update(d_list)
+            app.processEvents()
+
+        results[f"view_update:{label}"] = summary(measure(update, repeat))
+
+    w.hide()
+    w.deleteLater()
+    app.processEvents()
+    return results
+
+
+def compare(base, current):
+    "lines of median ratios of current over base, slowest first"
+    rows = []
+    for name, r in current["results"].items():
+        if (b := base["results"].get(name)) is not None and b["median"] > 0:
+            rows.append((r["median"] / b["median"], name, b["median"], r["median"]))
+    rows.sort(reverse=True)
+    return [f"{n:<28} {b * 1000:10.2f}ms {c * 1000:10.2f}ms {ratio:6.2f}x" for ratio, n, b, c in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks", description="time lens_editor hot paths")
+    parser.add_argument("--data", help="existing dataset, generated into a temp dir otherwise")
+    parser.add_argument("-n", "--lenses", type=int, default=200)
+    parser.add_argument("--per-lens", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-o", "--output", help="json results, printed when omitted")
+    parser.add_argument("--compare", help="earlier json results to compare against")
+    args = parser.parse_args(argv)
+
+    import lens_editor
+
+    with tempfile.TemporaryDirectory(prefix="lens_bench_") as tmp:
+        work_dir = Path(tmp)
+        data = args.data
+        dataset = {"path": data}
+        if data is None:
+            data = work_dir / "data"
+            n = generate(data, args.lenses, args.per_lens, args.seed)
+            dataset = {"lenses": args.lenses, "per_lens": args.per_lens, "seed": args.seed, "defects": n}
+        results = run(data, args.repeat, work_dir)
+        from lens_editor.config import Config
+
+        # the config lives in tmp, write it before tmp is removed rather than at exit
+        Config().flush()
+
+    from PySide6 import __version__ as pyside_version
+
+    report = {
+        "lens_editor": lens_editor.VERSION,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "pyside": pyside_version,
+        "platform": platform.platform(),
+        "dataset": dataset,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    if args.compare:
+        base = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print(f"{'benchmark':<28} {'base':>12} {'current':>12}  ratio", file=sys.stderr)
+        for line in compare(base, report):
+            print(line, file=sys.stderr)
@@ -1,4 +1,11 @@
+import sys
+
 from .app import main
+from .cli import COMMANDS
+from .cli import main as cli_main
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        cli_main(sys.argv[1:])
+    else:
+        main()
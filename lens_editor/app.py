@@ -3,23 +3,33 @@ from functools import partial
 from itertools import chain
 from pathlib import Path
 
-from openpyxl import Workbook
+import numpy as np
 from PySide6.QtCore import QMutex, QThreadPool
-from PySide6.QtGui import QKeySequence, QPixmapCache, QShortcut
-from PySide6.QtWidgets import (QApplication, QCompleter, QFileDialog,
+from PySide6.QtGui import QFontDatabase, QKeySequence, QPixmapCache, QShortcut
+from PySide6.QtWidgets import (QApplication, QCompleter, QDialog,
+                               QDialogButtonBox, QFileDialog,
                                QGraphicsGridLayout, QGraphicsScene,
                                QGraphicsWidget, QHBoxLayout,
-                               QInputDialog, QLineEdit, QMainWindow,
-                               QMessageBox, QPushButton, QStatusBar,
-                               QVBoxLayout, QWidget)
+                               QInputDialog, QLabel, QLineEdit, QMainWindow,
+                               QMessageBox, QPlainTextEdit, QPushButton,
+                               QStatusBar, QVBoxLayout, QWidget)
 
-from .config import root_config
+from . import perf
+from .catalog import Catalog, find_jpeg
+from .config import Config, cache_dir, root_config
 from .defect import DefectItem, Lens
-from .rule import linemapping, xymapping
+from .export import export_count
+from .grid import VirtualGrid
+from .loader import ProcessLoader
+from .region import RegionProfiles
+from .rule import RuleCache
 from .rule_edit import RuleEditWindow
 from .search import FilterParser, QuickSearchSlot
+from .table import DefectTable, table_rows
 from .thread import Worker
+from .thumbstore import ThumbnailStore, root_thumbnails
 from .view import View
+from .writer import xml_writer
 import logging
 
 
@@ -27,6 +37,9 @@ level = logging.ERROR if sys.argv[-1] != "-d" else logging.INFO
 logging.basicConfig(level=level, format="%(levelname)s:%(message)s")
 logger = logging.getLogger(__name__)
 
+# spans summarized in the status bar when instrumentation is on
+STATUS_SPANS = ["load", "load.sort", "filter", "view_update", "rule.run"]
+
 
 class MainWindow(QMainWindow):
     def __init__(self, initial_path=""):
@@ -39,11 +52,19 @@ class MainWindow(QMainWindow):
 
         self.scene.setItemIndexMethod(QGraphicsScene.NoIndex)
         main_layout.addWidget(self.main_view)
+        # only materialize the items in view, for large result sets
+        self.grid = None
+        if Config().setup_bool("view", "virtual", True):
+            self.grid = VirtualGrid(self.main_view, self.scene, parent=self)
 
         bottom_layout = QHBoxLayout()
         main_layout.addLayout(bottom_layout)
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
+        self.perf_label = None
+        if perf.enabled():
+            self.perf_label = QLabel()
+            self.status_bar.addPermanentWidget(self.perf_label)
 
         self.search_bar = QLineEdit()
         self.search_bar.returnPressed.connect(
@@ -91,8 +112,18 @@ class MainWindow(QMainWindow):
         self.setCentralWidget(widget)
 
         self.thread_pool = QThreadPool()
+        self.loader = None
+        self.count_job = None
+        self.catalog = None
+        if Config().setup_bool("catalog", "enabled", True):
+            self.catalog = Catalog(cache_dir() / "catalog.sqlite")
         self.mutex = QMutex()
-        self.filter_parser = FilterParser()
+        self.profiles = RegionProfiles.from_config()
+        self.filter_parser = FilterParser(self.profiles)
+        # results of the rules and the uncertain rules between Run clicks
+        self.rule_caches = (RuleCache(), RuleCache())
+        # the background Run filling the scene, see RuleEditWindow.run_rule
+        self.rule_job = None
 
         self.shortcuts()
 
@@ -105,6 +136,7 @@ class MainWindow(QMainWindow):
         QShortcut(QKeySequence("a"), self, self.mark_btn_clicked)
         QShortcut(QKeySequence("r"), self, self.rename_btn_clicked)
         QShortcut(QKeySequence("c"), self, self.count_btn_clicked)
+        QShortcut(QKeySequence("F12"), self, self.perf_report)
 
         self.search_slot = QuickSearchSlot()
 
@@ -116,16 +148,22 @@ class MainWindow(QMainWindow):
 
 
 
+    def selection(self):
+        "(defect, item) pairs, the grid keeps rows scrolled out of view without an item"
+        if self.grid is not None and self.grid.active:
+            return self.grid.selection()
+        return [(i.defect, i) for i in self.scene.selectedItems()]
+
     def delete(self):
         if not hasattr(self, "scene"):
             return
-        items = self.scene.selectedItems()
+        items = self.selection()
         if len(items) == 0:
             self.status_bar.showMessage("No item selected")
             return
         else:
-            for i in items:
-                i.delete_xml()
+            for d, _ in items:
+                d.remove()
             self.status_bar.showMessage(" Delete succeeded  ")
             
 
@@ -139,7 +177,7 @@ class MainWindow(QMainWindow):
     def rename_btn_clicked(self):
         if not hasattr(self, "scene"):
             return
-        items = self.scene.selectedItems()
+        items = self.selection()
         if len(items) == 0:
             self.status_bar.showMessage("No item selected")
             return
@@ -147,20 +185,39 @@ class MainWindow(QMainWindow):
         if not ok:
             return
 
-        for i in items:
-            i.rename(new_label)
+        for d, i in items:
+            if i is not None:
+                i.rename(new_label)
+            else:
+                d.name = new_label
 
     def save_btn_clicked(self):
-        mod_files_num = len([i for i in self.lens if i.modified])
+        failed = []
+        saved = 0
         for i in self.lens:
-            i.save()
-        self.status_bar.showMessage(f"Saved {mod_files_num} changes")
+            if not i.modified:
+                continue
+            try:
+                i.save()
+                saved += 1
+            except Exception as e:
+                # still modified, the next Save tries again
+                logger.error(f"cannot write {i.xml_path}: {e}")
+                failed.append(i)
+        # deletions and box edits queued since the last write, failures stay queued
+        failed += [l for l in xml_writer.flush() if l not in failed]
+        if not failed:
+            self.status_bar.showMessage(f"Saved {saved} changes")
+            return
+        self.status_bar.showMessage(f"Saved {saved} changes, {len(failed)} files failed")
+        paths = "\n".join(str(l.xml_path) for l in failed)
+        QMessageBox.warning(self, "Save", f"Cannot write {len(failed)} files:\n{paths}")
 
     def mark_btn_clicked(self):
         if not hasattr(self, "scene"):
             return
-        items = self.scene.selectedItems()
-        mark_state = [i.mark_toggle() for i in items]
+        items = self.selection()
+        mark_state = [i.mark_toggle() if i is not None else d.mark_toggle() for d, i in items]
         marked = len([x for x in mark_state if x])
         unmarked = len([x for x in mark_state if not x])
         message = ""
@@ -177,39 +234,60 @@ class MainWindow(QMainWindow):
             print("1")
         # elif query[-1] == "A":
         #     pass
-        d_list = self.filter_parser.parse(query, self.defects)
+        with perf.span("filter", query=query):
+            d_list = self.filter_parser.parse(query, self.defects)
         self.view_update(d_list)
-        self.status_bar.showMessage(
-            f"Filter: {self.search_bar.text()}, Total: {len(d_list)}"
-        )
+        self.show_timings()
+        if self.filter_parser.error is not None:
+            self.status_bar.showMessage(f"Invalid filter: {self.filter_parser.error}")
+        else:
+            self.status_bar.showMessage(
+                f"Filter: {self.search_bar.text()}, Total: {len(d_list)}"
+            )
         if search_bar_update:
             self.search_bar.setText(query)
 
     def _load_files(self, path: str) -> None:
         xml_files = [x for x in Path(path).glob("**/*.xml") if x.is_file()]
+        parms = [(x, j) for x in xml_files if (j := find_jpeg(x))]
 
-        def find_jpeg(xml_file):
-            if (jpeg_file := xml_file.with_suffix(".jpeg")).is_file():
-                return jpeg_file
-            if (
-                jpeg_file := xml_file.parents[1] / "img" / f"{xml_file.stem}.jpeg"
-            ).is_file():
-                return jpeg_file
-            if (jpeg_file := xml_file.with_suffix(".jpg")).is_file():
-                return jpeg_file
-            logger.error(f"Cannot find jpeg for {xml_file}")
-            return None
-
-        parms = [(x, find_jpeg(x)) for x in xml_files if find_jpeg(x)]
-
+        self.load_span = perf.span("load", path=str(path)).start()
         self.lens = []
+        self.table = DefectTable()
+        # every defect gets its region label as it is loaded
+        self.table.label_regions(self.profiles.default)
         self.total_file = len(parms)
         self.processed_file = 0
+        if self.catalog is not None:
+            self.catalog.prune(path, xml_files)
+        # parse only the xml up front, images are decoded when a crop is shown
+        lazy_image = Config().setup_bool("load", "lazy_image", True)
+        process = Config().setup("load", "backend", "thread") == "process"
+        if process and self.loader is None:
+            self.loader = ProcessLoader()
         for f, j in parms:
-            w = Worker(Lens, f, j)
+            w = Worker(self._load_lens, f, j, lazy_image, process)
             w.signals.result.connect(self.worker_done)
             self.thread_pool.start(w)
 
+    @perf.timed("load.lens")
+    def _load_lens(self, xml_path, img_path, lazy_image, process):
+        # runs in a pool thread, files unchanged since the last visit come
+        # straight from the catalog without parsing
+        records = self.catalog.lookup(xml_path) if self.catalog else None
+        if records is not None:
+            return Lens(xml_path, img_path, self.table, lazy_image, records)
+        if process:
+            # the pool thread only waits for the worker process
+            records, thumbnails = self.loader.load(xml_path, img_path)
+            lens = Lens(xml_path, img_path, self.table, lazy_image, records)
+            lens.set_thumbnails(thumbnails)
+        else:
+            lens = Lens(xml_path, img_path, self.table, lazy_image)
+        if self.catalog is not None:
+            self.catalog.store(xml_path, img_path, lens.records())
+        return lens
+
     def btn_openfile(self):
         file_path = QFileDialog.getExistingDirectory()
         self._load_files(file_path)
@@ -225,27 +303,67 @@ class MainWindow(QMainWindow):
         self.mutex.unlock()
 
         if self.processed_file == self.total_file:
-            self.defects = sorted(
-                chain(*[l.defects for l in self.lens]),
-                key=lambda x: (x.name, x.width, x.height),
+            sort_span = perf.span("load.sort").start()
+            defects = list(chain(*[l.defects for l in self.lens]))
+            rows = np.array([d.row for d in defects], dtype=np.intp)
+            name_id = self.table.column("name_id", rows)
+            order = np.lexsort(
+                (
+                    self.table.column("height", rows),
+                    self.table.column("width", rows),
+                    self.table.name_rank()[name_id],
+                )
             )
+            self.defects = [defects[i] for i in order]
+            sort_span.stop()
+            with perf.span("load.index"):
+                self.filter_parser.build_index(self.defects)
             self.view_update(self.defects)
-            complete_candidates = list(set([d.name for d in self.defects]))
+            if ThumbnailStore._instance is not None:
+                ThumbnailStore._instance.flush()
+            if self.catalog is not None:
+                self.catalog.commit()
+            complete_candidates = [self.table.names[i] for i in np.unique(name_id)]
             completer = QCompleter(complete_candidates)
             self.search_bar.setCompleter(completer)
             self.status_bar.showMessage(
                 f"No Filter, Category: {len(complete_candidates)},Total: {len(self.defects)}"
             )
+            self.load_span.stop()
+            self.show_timings()
+
+    def clear_scene(self):
+        if self.rule_job is not None:
+            # its results would land in the cleared scene
+            self.rule_job.cancel()
+            self.rule_job = None
+        if self.grid is not None:
+            self.grid.reset()
+        self.scene.clear()
 
+    @perf.timed("view_update")
     def view_update(self, d_list):
+        self.clear_scene()
+        # dynamic column size, dependents on window width
+        col_size = int(self.frameGeometry().width() / 80)
+        if self.grid is not None:
+            self.grid.set_defects(d_list, col_size)
+            return
         g_layout = QGraphicsGridLayout()
         g_layout.setContentsMargins(10, 10, 10, 10)
         g_layout.setSpacing(25)
         g_widget = QGraphicsWidget()
-        self.scene.clear()
-        # dynamic column size, dependents on window width
-        col_size = int(self.frameGeometry().width() / 80)
-        for i, di in enumerate([DefectItem(d).get_layout_item() for d in d_list]):
+        # create items lens by lens so each lazily decoded image is read once
+        table, rows = table_rows(d_list)
+        if table is not None:
+            lens_ids = table.column("lens_id", rows)
+        else:
+            lens_ids = np.zeros(len(d_list))
+        items = [None] * len(d_list)
+        for i in np.argsort(lens_ids, kind="stable"):
+            items[i] = DefectItem(d_list[i]).get_layout_item()
+        perf.count("items.created", len(items))
+        for i, di in enumerate(items):
             r = int(i / col_size)
             c = i % col_size
             g_layout.addItem(di, r, c)
@@ -254,81 +372,71 @@ class MainWindow(QMainWindow):
         self.main_view.centerOn(self.scene.itemsBoundingRect().center())
 
     def count_btn_clicked(self):
-        text = self.count_bar.text()
-        li = ["0", "1", "2", "3", "4"]
-        nums = []
-        names = []
-        w = []
-        h = []
-        regions = []
-        recs = []
-        lnames = []
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "sheet"
-        ws.append(["编号", "类名", "宽度", "高度", "区域", "是否可收", "左通道对应"])
-        for d in self.defects:
-            if d.name == text:
-                receive = str(d.lens.xml_path)
-                r = receive.split("/")
-                if "unq" in r or "UNQ" in r:
-                    rec = "UNQ"
-                elif "h1" in r or "H1" in r:
-                    rec = "H1"
-                elif "h2" in r or "H2" in r:
-                    rec = "H2"
-                else:
-                    rec = ""
-                recs.append(rec)
-                img_number = d.lens.xml_path.stem
-                nums.append(img_number)
-                names.append(d.name)
-                w.append(d.width)
-                h.append(d.height)
-                x = d.xmin
-                if x > 1329 and x < 1711:
-                    region = "A"
-                elif x > 1710 and x < 1961:
-                    region = "B"
-                elif x > 1960 and x < 2210:
-                    region = "C"
-                else:
-                    region = "D"
-                regions.append(region)
-                ln = []
-                for i in li:
-                    if d.name[0] == "0" or d.name[0] == "1":
-                        a = self.left_check(d, i)
-                    else:
-                        a = self.line_check(d, i)
-                        if a:
-                            ln.append(a)
-                lnames.append(str(ln))
-        for i in range(len(nums)):
-            ws.cell(i + 2, 1, nums[i])
-            ws.cell(i + 2, 2, names[i])
-            ws.cell(i + 2, 3, w[i])
-            ws.cell(i + 2, 4, h[i])
-            ws.cell(i + 2, 5, regions[i])
-            ws.cell(i + 2, 6, recs[i])
-            ws.cell(i + 2, 7, lnames[i])
-        wb.save(f"{text}.xlsx")
-
-    def left_check(self, d, sexp):
-        fn = xymapping(d.x, d.y)
-        mappings = [d_.name for d_ in d.lens.left if fn(d_.x, d_.y)]
-        for name in mappings:
-            if name.endswith(sexp):
-                return name
-        return False
-
-    def line_check(self, d, sexp):
-        fn = linemapping(d.x, d.y, d.x_, d.y_)
-        mappings = [d_.name for d_ in d.lens.left if fn(d_.x, d_.y, d_.x_, d_.y_)]
-        for name in mappings:
-            if name.endswith(sexp):
-                return name
-        return False
+        if self.count_job is not None:
+            self.count_job.cancel()
+            return
+        names = self.count_bar.text().replace(",", " ").split()
+        if not names or not hasattr(self, "defects"):
+            return
+        suffix = ".csv" if Config().setup("export", "format", "xlsx") == "csv" else ".xlsx"
+        path = "_".join(names) + suffix
+        # one pass over the defects for every name, written on a pool thread
+        self.count_job = w = Worker(export_count, list(self.defects), names, path)
+        w.kwargs.update(progress=w.signals.progress.emit, cancelled=w.is_cancelled)
+        w.signals.progress.connect(
+            lambda done, total: self.status_bar.showMessage(f"Counting {done}/{total}")
+        )
+        w.signals.result.connect(partial(self.count_done, path))
+        w.signals.error.connect(
+            lambda e: self.status_bar.showMessage(f"Count export failed: {e[1]}")
+        )
+        w.signals.finished.connect(self.count_finished)
+        self.count_btn.setText("Cancel(c)")
+        self.thread_pool.start(w)
+
+    def count_done(self, path, rows):
+        if rows is None:
+            self.status_bar.showMessage("Count export cancelled")
+        else:
+            self.status_bar.showMessage(f"Exported {rows} rows to {path}")
+
+    def count_finished(self):
+        self.count_job = None
+        self.count_btn.setText("Count(c)")
+
+    def show_timings(self):
+        "latest timings of the main steps in the status bar and the log"
+        if self.perf_label is None:
+            return
+        text = perf.status(STATUS_SPANS)
+        self.perf_label.setText(text)
+        logger.info(f"timings: {text}")
+
+    def perf_report(self):
+        if not perf.enabled():
+            self.status_bar.showMessage("Timing is off, start with -d or set [perf] enabled")
+            return
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Timings")
+        layout = QVBoxLayout(dialog)
+        text = QPlainTextEdit(perf.report())
+        text.setReadOnly(True)
+        text.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        layout.addWidget(text)
+        buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        trace_btn = buttons.addButton("Export trace", QDialogButtonBox.ActionRole)
+        trace_btn.clicked.connect(self.export_trace)
+        buttons.rejected.connect(dialog.reject)
+        layout.addWidget(buttons)
+        dialog.resize(720, 480)
+        dialog.exec()
+
+    def export_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export trace", "trace.json", "JSON (*.json)")
+        if not path:
+            return
+        n = perf.export_trace(path)
+        self.status_bar.showMessage(f"Exported {n} trace events to {path}")
 
     def closeEvent(self, event) -> None:
         reply = QMessageBox.question(
@@ -336,6 +444,18 @@ class MainWindow(QMainWindow):
         )
         if reply == QMessageBox.Yes:
             event.accept()
+            if self.rule_job is not None:
+                self.rule_job.cancel()
+            xml_writer.flush()
+            Config().flush()
+            if perf.enabled():
+                logger.info(f"timings:\n{perf.report()}")
+            if self.loader is not None:
+                self.loader.shutdown()
+            if ThumbnailStore._instance is not None:
+                ThumbnailStore._instance.flush()
+            if self.catalog is not None:
+                self.catalog.close()
             sys.exit(0)
         else:
             event.ignore()
@@ -343,6 +463,10 @@ class MainWindow(QMainWindow):
 
 def main():
     root_config("~/.lens_editor")
+    max_mb = int(Config().setup("thumbnails", "max_mb", "256"))
+    root_thumbnails(cache_dir(), max_mb * 1024 * 1024)
+    if "-d" in sys.argv or Config().setup_bool("perf", "enabled", False):
+        perf.enable()
     app = QApplication(sys.argv)
     initial_path = sys.argv[1] if len(sys.argv) > 1 else ""
     window = MainWindow(initial_path)
@@ -0,0 +1,156 @@
+import logging
+import os
+import sqlite3
+import threading
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from .loader import parse_object
+from .search import FilterParser
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    img_path TEXT,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS objects (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    xmin INTEGER NOT NULL,
+    ymin INTEGER NOT NULL,
+    xmax INTEGER NOT NULL,
+    ymax INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_file ON objects(file_id);
+CREATE INDEX IF NOT EXISTS objects_name ON objects(name, xmin);
+"""
+
+
+def find_jpeg(xml_file: Path):
+    if (jpeg_file := xml_file.with_suffix(".jpeg")).is_file():
+        return jpeg_file
+    if (jpeg_file := xml_file.parents[1] / "img" / f"{xml_file.stem}.jpeg").is_file():
+        return jpeg_file
+    if (jpeg_file := xml_file.with_suffix(".jpg")).is_file():
+        return jpeg_file
+    logger.error(f"Cannot find jpeg for {xml_file}")
+    return None
+
+
+class Catalog:
+    """
+    SQLite catalog of every parsed object (path, mtime, name, bbox). A file
+    is only parsed again when its mtime or size changed, and FilterParser
+    queries run as SQL without loading any lens.
+    """
+
+    def __init__(self, path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def lookup(self, xml_path):
+        "stored records of xml_path, None when it is new or changed on disk"
+        st = Path(xml_path).stat()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT id, mtime, size FROM files WHERE path = ?", (_key(xml_path),)
+            ).fetchone()
+            if row is None or (row[1], row[2]) != (st.st_mtime_ns, st.st_size):
+                return None
+            return self.conn.execute(
+                "SELECT name, xmin, ymin, xmax, ymax FROM objects"
+                " WHERE file_id = ? ORDER BY idx",
+                (row[0],),
+            ).fetchall()
+
+    def store(self, xml_path, img_path, records):
+        "replace the records of xml_path, call commit() once a batch is stored"
+        st = Path(xml_path).stat()
+        with self._lock:
+            self.conn.execute("DELETE FROM files WHERE path = ?", (_key(xml_path),))
+            file_id = self.conn.execute(
+                "INSERT INTO files (path, img_path, mtime, size) VALUES (?, ?, ?, ?)",
+                (
+                    _key(xml_path),
+                    _key(img_path) if img_path else None,
+                    st.st_mtime_ns,
+                    st.st_size,
+                ),
+            ).lastrowid
+            self.conn.executemany(
+                "INSERT INTO objects VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(file_id, i, *r) for i, r in enumerate(records)],
+            )
+
+    def prune(self, root, xml_paths):
+        "forget files under root that are not in xml_paths any more"
+        keep = set(map(_key, xml_paths))
+        with self._lock:
+            known = self.conn.execute(
+                "SELECT path FROM files WHERE path LIKE ? ESCAPE '\\'",
+                (_like_prefix(root),),
+            ).fetchall()
+            gone = [(p,) for p, in known if p not in keep]
+            self.conn.executemany("DELETE FROM files WHERE path = ?", gone)
+
+    def commit(self):
+        with self._lock:
+            self.conn.commit()
+
+    def scan(self, root):
+        "bring the catalog up to date with the xml files under root, return them"
+        xml_files = [x for x in Path(root).glob("**/*.xml") if x.is_file()]
+        parsed = 0
+        for xml_file in xml_files:
+            if self.lookup(xml_file) is not None:
+                continue
+            objects = ET.parse(str(xml_file)).getroot().iter("object")
+            self.store(xml_file, find_jpeg(xml_file), [parse_object(o) for o in objects])
+            parsed += 1
+        self.prune(root, xml_files)
+        self.commit()
+        logger.info(f"catalog scan: {len(xml_files)} files, {parsed} parsed")
+        return xml_files
+
+    def search(self, filter_str, root=None, profiles=None):
+        "(xml_path, idx, name, xmin, ymin, xmax, ymax) rows matching filter_str"
+        where, params = FilterParser(profiles).to_sql(filter_str)
+        sql = (
+            "SELECT f.path, o.idx, o.name, o.xmin, o.ymin, o.xmax, o.ymax"
+            " FROM objects o JOIN files f ON o.file_id = f.id"
+            f" WHERE ({where})"
+        )
+        if root is not None:
+            sql += " AND f.path LIKE ? ESCAPE '\\'"
+            params = [*params, _like_prefix(root)]
+        sql += " ORDER BY o.name, o.xmax - o.xmin, o.ymax - o.ymin"
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+def _key(path) -> str:
+    return str(Path(path).absolute())
+
+
+def _like_prefix(root) -> str:
+    prefix = os.path.join(_key(root), "")
+    for c in "\\%_":
+        prefix = prefix.replace(c, "\\" + c)
+    return prefix + "%"
@@ -0,0 +1,152 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .catalog import Catalog
+from .config import cache_dir, root_config
+from .region import RegionProfiles
+from .rule import Ruleset, classify_lenses
+from .table import DefectTable
+
+CHUNK_SIZE = 256
+ERROR = "error"
+# rulesets and region profile of a classify worker process, set once by
+# _init_rules
+_rules = None
+_profile = None
+
+
+def search(args):
+    catalog = Catalog(args.catalog or cache_dir() / "catalog.sqlite")
+    catalog.scan(args.dir)
+    rows = catalog.search(args.query, args.dir, RegionProfiles.from_config())
+    for path, idx, name, xmin, ymin, xmax, ymax in rows:
+        print(f"{path}\t{idx}\t{name}\t{xmin},{ymin},{xmax},{ymax}")
+    catalog.close()
+
+
+def _init_rules(rule_text, un_rule_text, profile):
+    global _rules, _profile
+    _rules = (Ruleset(rule_text), Ruleset(un_rule_text) if un_rule_text else None)
+    _profile = profile
+
+
+def classify_files(xml_paths):
+    """
+    verdict records of a chunk of xml files, run in a worker process. A
+    file that cannot be parsed gets an ERROR record instead of ending the
+    batch.
+    """
+    from .defect import Lens
+
+    table = DefectTable()
+    # region terms (@A..@D) read the labels, as in the GUI
+    table.label_regions(_profile)
+    lenses, errors = [], {}
+    for p in xml_paths:
+        try:
+            # only the xml is read, lazy_image lenses never touch their image
+            lenses.append(Lens(Path(p), None, table, lazy_image=True))
+        # AttributeError and TypeError: an <object> missing its <bndbox> or
+        # <name>, or with empty coordinates, see parse_object
+        except (ET.ParseError, OSError, ValueError, AttributeError, TypeError) as e:
+            errors[str(p)] = {"file": str(p), "verdict": ERROR, "error": str(e), "failed": []}
+    records = {
+        str(lens.xml_path): {
+            "file": str(lens.xml_path),
+            "verdict": verdict,
+            "failed": [
+                {"name": d.name, "bbox": [d.xmin, d.ymin, d.xmax, d.ymax], "message": msg}
+                for d, msg in failed
+            ],
+        }
+        for lens, verdict, failed in classify_lenses(lenses, *_rules)
+    }
+    records.update(errors)
+    return [records[str(p)] for p in xml_paths]
+
+
+def _write_csv(out, records):
+    writer = csv.writer(out)
+    writer.writerow(["file", "verdict", "failed", "details"])
+    for r in records:
+        details = r.get("error") or "; ".join(
+            f"{f['name']} {','.join(map(str, f['bbox']))} {f['message']}" for f in r["failed"]
+        )
+        writer.writerow([r["file"], r["verdict"], len(r["failed"]), details])
+
+
+def _write_jsonl(out, records):
+    for r in records:
+        out.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+
+def classify(args):
+    rule_text = Path(args.rules).read_text(encoding="utf-8")
+    un_rule_text = Path(args.uncertain).read_text(encoding="utf-8") if args.uncertain else ""
+    # compile here first, so a bad rule fails before any worker starts
+    Ruleset(rule_text)
+    if un_rule_text:
+        Ruleset(un_rule_text)
+    # resolved from the config here, worker processes do not read it
+    profile = RegionProfiles.from_config().default
+    xml_files = sorted(str(x) for x in Path(args.dir).glob("**/*.xml") if x.is_file())
+    chunks = [xml_files[i : i + CHUNK_SIZE] for i in range(0, len(xml_files), CHUNK_SIZE)]
+    fmt = args.format or ("csv" if args.output and args.output.endswith(".csv") else "jsonl")
+    write = _write_csv if fmt == "csv" else _write_jsonl
+    out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+    try:
+        if args.jobs == 1:
+            _init_rules(rule_text, un_rule_text, profile)
+            write(out, (r for chunk in chunks for r in classify_files(chunk)))
+            return
+        with ProcessPoolExecutor(
+            max_workers=args.jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_rules,
+            initargs=(rule_text, un_rule_text, profile),
+        ) as pool:
+            # map keeps the file order while workers run ahead
+            write(out, (r for records in pool.map(classify_files, chunks) for r in records))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+COMMANDS = {
+    "search": search,
+    "classify": classify,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="lens_editor")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("search", help="query the annotation catalog without the GUI")
+    p.add_argument("dir")
+    p.add_argument("query", help="search bar syntax, e.g. 'name=0101-B w>5'")
+    p.add_argument("--catalog", help="sqlite file, defaults to the config cache dir")
+
+    p = sub.add_parser("classify", help="sort lenses into 不合格/不确定/合格 by rules")
+    p.add_argument("dir")
+    p.add_argument("--rules", required=True, help="ruleset file, one rule per line")
+    p.add_argument("--uncertain", help="uncertain ruleset, for lenses passing --rules")
+    p.add_argument("--format", choices=["jsonl", "csv"], help="defaults by --output suffix")
+    p.add_argument("-o", "--output", help="defaults to stdout")
+    p.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes")
+
+    args = parser.parse_args(argv)
+    root_config("~/.lens_editor")
+    try:
+        COMMANDS[args.command](args)
+    except ValueError as e:
+        parser.exit(1, f"lens_editor: {e}\n")
+    except BrokenPipeError:
+        sys.exit(0)
@@ -1,7 +1,13 @@
+import atexit
+import io
+import locale
 import logging
+import threading
 from configparser import ConfigParser, NoOptionError, NoSectionError
 from pathlib import Path
 
+from .writer import write_atomic
+
 logger = logging.getLogger(__name__)
 
 
@@ -15,11 +21,21 @@ class Singleton(type):
 
 
 class Config(metaclass=Singleton):
-    def __init__(self, path) -> None:
+    """
+    INI backed settings. set() only updates memory and arms a save `delay`
+    seconds later, so a burst of changes (a rule typed key by key) is one
+    write and a crash loses at most the last window. flush() at exit.
+    """
+
+    def __init__(self, path, delay=1.0) -> None:
         super().__init__()
         self.path = path
+        self.delay = delay
         self.parser = ConfigParser()
+        self._lock = threading.RLock()
+        self._timer = None
         self.load()
+        atexit.register(self.flush)
 
     def load(self):
         if self.path.exists():
@@ -27,27 +43,52 @@ class Config(metaclass=Singleton):
             logger.debug(f"Loading config file from {self.path}")
 
     def save(self):
-        with open(self.path, "w") as file:
-            logger.debug(f"Writing default config file to{self.path}")
+        "write the file now"
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            file = io.StringIO()
             self.parser.write(file)
+            logger.debug(f"Writing config file to {self.path}")
+            write_atomic(self.path, file.getvalue().encode(locale.getpreferredencoding(False)))
         logger.debug("config saved")
 
+    def save_later(self):
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.save)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        "write pending changes now"
+        with self._lock:
+            if self._timer is not None:
+                self.save()
+
     def set(self, section, option, value):
-        try:
-            self.parser.set(section, option, value)
-        except NoSectionError as e:
-            logger.debug(e)
-            self.parser.add_section(section)
-            self.parser.set(section, option, value)
-        finally:
-            self.save()
+        with self._lock:
+            try:
+                self.parser.set(section, option, value)
+            except NoSectionError as e:
+                logger.debug(e)
+                self.parser.add_section(section)
+                self.parser.set(section, option, value)
+            finally:
+                self.save_later()
 
     def get(self, section, option, **kwargs):
-        return self.parser.get(section, option, **kwargs)
+        with self._lock:
+            return self.parser.get(section, option, **kwargs)
+
+    def items(self, section):
+        with self._lock:
+            return self.parser.items(section)
 
     def setup(self, section, option, default: str) -> str:
         try:
-            return self.parser.get(section, option)
+            return self.get(section, option)
         except NoSectionError as e:
             logger.debug(e)
             self.set(section, option, default)
@@ -57,8 +98,17 @@ class Config(metaclass=Singleton):
             self.set(section, option, default)
             return default
 
+    def setup_bool(self, section, option, default: bool) -> bool:
+        value = self.setup(section, option, "yes" if default else "no")
+        return self.parser.BOOLEAN_STATES.get(value.lower(), default)
+
 
 def root_config(path):
     cfg_path = Path(path).expanduser()
     Config._instance = None
     Config._instance = Config.__call__(cfg_path)
+
+
+def cache_dir() -> Path:
+    "directory for caches next to the config file, e.g. ~/.lens_editor_cache"
+    return Path(f"{Config().path}_cache")
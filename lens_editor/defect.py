@@ -1,3 +1,5 @@
+import os
+import threading
 import xml.etree.ElementTree as ET
 from pathlib import Path
 
@@ -12,7 +14,16 @@ from PySide6.QtWidgets import (QGraphicsItem, QGraphicsItemGroup,
                                QGraphicsView, QGridLayout, QLabel, QPushButton,QGraphicsTextItem,
                                QToolTip, QWidget)
 
-from .minimap import Minimap, numpy2pixmap
+from . import perf
+from .cache import LRUCache
+from .loader import THUMB_WIDTH, make_thumbnail, parse_object
+from .minimap import FRAME_WIDTH, Minimap, numpy2pixmap, scale_frame
+from .pyramid import TiledImageItem, pyramid_for
+from .region import REGIONS
+from .spatial import ChannelIndex
+from .table import DefectTable
+from .thumbstore import ThumbnailStore
+from .writer import xml_writer
 from .message_tip import TipUi
 
 import logging
@@ -22,76 +33,281 @@ logging.basicConfig(level=level, format="%(levelname)s:%(message)s")
 logger = logging.getLogger(__name__)
 
 
+# crops are copied out of the lens image so a cached crop never pins a frame
+crop_cache = LRUCache(64 * 1024 * 1024)
+# decoded frames of lenses loaded with lazy_image
+image_cache = LRUCache(256 * 1024 * 1024)
+thumb_cache = LRUCache(128 * 1024 * 1024)
+# (frame scaled to a minimap width, scale) per lens
+scaled_cache = LRUCache(32 * 1024 * 1024, sizeof=lambda v: v[0].nbytes)
+
+_REDUCED = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
 
 class Lens:
-    def __init__(self, xml_path: Path, img_path: Path):
+    def __init__(
+        self, xml_path: Path, img_path: Path, table=None, lazy_image=False, records=None
+    ):
         self.xml_path = xml_path
         self.img_path = img_path
-        self.defects = self.load_defects()
+        self.table = table if table is not None else DefectTable()
+        self.lazy_image = lazy_image
+        self._tree = None
+        self._img_mtime = None
+        # held while the tree changes or is serialized by the xml writer
+        self.lock = threading.RLock()
+        # bumped whenever a defect changes, rule results cache against it
+        self.version = 0
+        self.defects = self.load_defects(records)
         self.modified = False
         self.leftandright()
 
-    def load_defects(self):
-        self.tree = ET.parse(str(self.xml_path))
-        self.img = cv2.imread(str(self.img_path))
-        root = self.tree.getroot()
-        return [Defect(self, obj) for obj in root.iter("object")]
+    def load_defects(self, records=None):
+        "records are (name, xmin, ymin, xmax, ymax) parsed elsewhere, e.g. by a ProcessLoader"
+        if records is None:
+            records = map(parse_object, self.elements)
+        self._img = None if self.lazy_image else cv2.imread(str(self.img_path))
+        self.rows = self.table.extend(self, records)
+        return [Defect(self.table, row) for row in self.rows]
+
+    def _parse_tree(self):
+        with perf.span("xml.parse"):
+            self._tree = ET.parse(str(self.xml_path))
+        self._elements = list(self._tree.getroot().iter("object"))
+
+    @property
+    def tree(self) -> ET.ElementTree:
+        "parsed on first use when the records came from elsewhere"
+        if self._tree is None:
+            self._parse_tree()
+        return self._tree
+
+    @property
+    def elements(self):
+        if self._tree is None:
+            self._parse_tree()
+        return self._elements
+
+    @property
+    def img_mtime(self) -> int:
+        if self._img_mtime is None:
+            try:
+                self._img_mtime = os.stat(self.img_path).st_mtime_ns
+            except (OSError, TypeError):
+                self._img_mtime = 0
+        return self._img_mtime
+
+    def set_thumbnails(self, thumbnails):
+        "seed thumb_cache and the thumbnail store with thumbnails cut by a loader"
+        store = ThumbnailStore._instance
+        for d, thumb in zip(self.defects, thumbnails):
+            key = d.cache_key()
+            thumb_cache.put(key, thumb)
+            if store is not None:
+                store.put(ThumbnailStore.key(key[0], self.img_mtime, key[1:], THUMB_WIDTH), thumb)
+
+    @property
+    def img(self):
+        "full resolution image, decoded on demand for lazy_image lenses"
+        if self._img is not None:
+            return self._img
+        return self.reduced_img(1)
+
+    def reduced_img(self, factor: int):
+        "image decoded at 1/factor resolution (1, 2, 4 or 8)"
+        if factor == 1 and self._img is not None:
+            return self._img
+        if factor not in _REDUCED:
+            raise ValueError(f"unsupported reduction factor {factor}")
+        key = (str(self.img_path), factor)
+        if (img := image_cache.get(key)) is None:
+            flags = _REDUCED[factor]
+            with perf.span("image.decode", factor=factor):
+                img = image_cache.put(key, cv2.imread(str(self.img_path), flags))
+        return img
+
+    def scaled_img(self, width: int):
+        """
+        (image resized to width, scale from frame coordinates), resized
+        from the smallest reduced decode still at least width px wide
+        """
+        key = (str(self.img_path), width)
+        if (scaled := scaled_cache.get(key)) is not None:
+            return scaled
+        factor = 1
+        # a frame already decoded in full costs only the resize
+        if self._img is None and (str(self.img_path), 1) not in image_cache:
+            factor = next((f for f in (8, 4, 2) if FRAME_WIDTH // f >= width), 1)
+        img = self.reduced_img(factor)
+        scaled = scale_frame(img, width)
+        return scaled_cache.put(key, (scaled, width / (img.shape[1] * factor)))
+
+    def records(self):
+        "(name, xmin, ymin, xmax, ymax) of every defect, as parse_object returns"
+        return [(d.name, d.xmin, d.ymin, d.xmax, d.ymax) for d in self.defects]
 
     def set_modified(self, state: bool):
         self.modified = state
+        self.version += 1
+        self.table.touch()
 
     def leftandright(self):
         self.left = [d for d in self.defects if d.x < 1200]
         self.right = [d for d in self.defects if d.x >= 1200]
+        self.left_index = ChannelIndex(self.left)
+        self.right_index = ChannelIndex(self.right)
 
     def save(self):
         if self.modified:
-            self.tree.write(str(self.xml_path))
-            self.modified = False
+            xml_writer.write(self)
+            self.set_modified(False)
 
 
 class Defect:
-    def __init__(self, lens: Lens, obj: ET.Element):
-        self.lens = lens
-        self._obj = obj
-        self._parse_obj(obj)
-        self._crop(lens.img)
-        self.mark = False
+    "view over one row of a DefectTable"
+
+    __slots__ = ("table", "row")
+
+    def __init__(self, table: DefectTable, row: int):
+        self.table = table
+        self.row = row
 
     def __repr__(self) -> str:
         return f"{self.name}: {self.xmin}, {self.ymin}, {self.xmax}, {self.ymax}"
 
     @property
-    def name(self):
-        pass
+    def lens(self) -> Lens:
+        return self.table.lenses[self.table.lens_id[self.row]]
 
-    @name.getter
+    @property
+    def _obj(self) -> ET.Element:
+        lens = self.lens
+        return lens.elements[self.row - lens.rows.start]
+
+    @property
     def name(self):
-        return self._name
+        return self.table.names[self.table.name_id[self.row]]
 
     @name.setter
     def name(self, new_name):
-        name = self._obj.find("name")
-        name.text = new_name
+        with self.lens.lock:
+            self._obj.find("name").text = new_name
         self.lens.set_modified(True)
-        self._name = new_name
+        self.table.set("name_id", self.row, self.table.intern(new_name))
+        self.lens.leftandright()
+
+    @property
+    def xmin(self):
+        return self.table.xmin[self.row]
+
+    def _set(self, key, value):
+        self.table.set(key, self.row, value)
+        self.lens.version += 1
+
+    @xmin.setter
+    def xmin(self, value):
+        self._set("xmin", value)
+
+    @property
+    def ymin(self):
+        return self.table.ymin[self.row]
+
+    @ymin.setter
+    def ymin(self, value):
+        self._set("ymin", value)
+
+    @property
+    def xmax(self):
+        return self.table.xmax[self.row]
+
+    @xmax.setter
+    def xmax(self, value):
+        self._set("xmax", value)
+
+    @property
+    def ymax(self):
+        return self.table.ymax[self.row]
+
+    @ymax.setter
+    def ymax(self, value):
+        self._set("ymax", value)
+
+    @property
+    def width(self):
+        return self.table.xmax[self.row] - self.table.xmin[self.row]
+
+    @property
+    def height(self):
+        return self.table.ymax[self.row] - self.table.ymin[self.row]
+
+    x, y, x_, y_ = xmin, ymin, xmax, ymax
+    w, h = width, height
+
+    @property
+    def region_id(self) -> int:
+        return self.table.region_id[self.row]
 
-    def _parse_obj(self, obj):
-        self._name = obj.find("name").text
-        self.xmin = self.x = int(obj.find("bndbox/xmin").text)
-        self.ymin = self.y = int(obj.find("bndbox/ymin").text)
-        self.xmax = self.x_ = int(obj.find("bndbox/xmax").text)
-        self.ymax = self.y_ = int(obj.find("bndbox/ymax").text)
-        self.width = self.w = self.xmax - self.xmin
-        self.height = self.h = self.ymax - self.ymin
+    @property
+    def region(self) -> str:
+        "region letter in the table's profile, empty outside every region"
+        code = self.table.region_id[self.row]
+        return REGIONS[code] if code >= 0 else ""
+
+    @property
+    def mark(self) -> bool:
+        return bool(self.table.mark[self.row])
+
+    @mark.setter
+    def mark(self, state: bool):
+        self.table.set("mark", self.row, state)
+
+    def cache_key(self):
+        return (str(self.lens.img_path), self.xmin, self.ymin, self.xmax, self.ymax)
+
+    @property
+    def image(self):
+        "crop of the lens image, cut on first access and kept in crop_cache"
+        key = self.cache_key()
+        if (crop := crop_cache.get(key)) is None:
+            crop = crop_cache.put(key, self._crop(self.lens.img))
+            perf.observe("crop.bytes", crop.nbytes)
+        return crop
+
+    @property
+    def thumbnail(self):
+        "crop scaled to THUMB_WIDTH, as shown by DefectItem"
+        key = self.cache_key()
+        if (thumb := thumb_cache.get(key)) is not None:
+            return thumb
+        # the persistent store saves decoding the frame across sessions
+        if (store := ThumbnailStore._instance) is not None:
+            store_key = ThumbnailStore.key(
+                key[0], self.lens.img_mtime, key[1:], THUMB_WIDTH
+            )
+            if (thumb := store.get(store_key)) is None:
+                thumb = make_thumbnail(self.image)
+                store.put(store_key, thumb)
+        else:
+            thumb = make_thumbnail(self.image)
+        return thumb_cache.put(key, thumb)
 
     def _crop(self, orig_img):
-        self.image = orig_img[self.ymin : self.ymax, self.xmin : self.xmax].copy()
+        return orig_img[self.ymin : self.ymax, self.xmin : self.xmax].copy()
 
     def remove(self):
-        self.lens.set_modified(True)
-        self.lens.tree.getroot().remove(self._obj)
-        self.lens.tree.write(self.lens.xml_path)
+        lens = self.lens
+        with lens.lock:
+            lens.tree.getroot().remove(self._obj)
+        # rules and the channel lookups only see the defects still in the file
+        lens.defects = [d for d in lens.defects if d.row != self.row]
+        lens.leftandright()
+        lens.set_modified(True)
+        xml_writer.schedule(lens)
 
     def mark_toggle(self) -> bool:
         "return current mark state"
@@ -99,11 +315,10 @@ class Defect:
         return self.mark
 
 
-class DefectEdit(QWidget, Lens, Defect):
+class DefectEdit(QWidget):
     def __init__(self, defect, parent=None) -> None:
         super().__init__(parent)
         self.defect = defect
-        self.defects = Lens.load_defects
         layout = QGridLayout()
         self.setLayout(layout)
         self.test_button = QPushButton("EDIT", self)
@@ -145,31 +360,47 @@ class DefectEdit(QWidget, Lens, Defect):
         
 
     def _minimap(self) -> QPixmap:
-        minimap = Minimap(self.defect, self.defects, self.width())
-        return minimap.draw(self.defect, self.defects)
+        return Minimap(self.defect.lens, self.width()).draw(self.defect)
 
     def edit(self):
         self.Ss = complex(self.defect)
         self.Ss.show()
 
 
-class complex(QGraphicsView,DefectEdit):
+class complex(QGraphicsView):
     def __init__(self, defect, parent=None):
-        super(complex, self).__init__(parent)
+        super().__init__(parent)
         self.scene1 = QGraphicsScene()
-        self.item = QGraphicsPixmapItem()
+        self.setScene(self.scene1)
+        self.item = None
+        self.rect_item = None
+        self.rect_item1 = None
+        self.resize(1300, 1400)
+        self.isImgLabelArea = bool(True)
+        self.set_defect(defect)
+
+    def set_defect(self, defect):
+        "show defect, the frame stays in place when it is on the same lens"
         self.defect = defect
         self.ll = True
         self.x_xmax = 0
         self.y_ymax = 0
         self.x_xmin = 0
         self.y_ymin = 0
-        self.resize(1300, 1400)
         self.singleOffset = QPoint(0, 0)
         self.isLeftPressed = bool(False)  # 图片被点住(鼠标左键)标志位
-        self.isImgLabelArea = bool(True)
+        for item in (self.rect_item, self.rect_item1):
+            if item is not None:
+                self.scene1.removeItem(item)
         self.edit1()
 
+    def step(self, offset):
+        "move to the next or previous defect of the lens"
+        defects = self.defect.lens.defects
+        if self.defect in defects:
+            i = (defects.index(self.defect) + offset) % len(defects)
+            self.set_defect(defects[i])
+
     def edit1(self):
         self.rectitemsize_y = self.defect.xmax - self.defect.xmin
         self.rectitemsize_x = self.defect.ymax - self.defect.ymin
@@ -177,14 +408,14 @@ class complex(QGraphicsView,DefectEdit):
         self.rect_key_y = 0
         self.rect_key_x = 0
         self.rect_key = QPoint(0, 0)
-        d_img = self.defect.image
-        d_w, d_h = d_img.shape[:2]
-        r_w = 100
-        r_h = int(r_w * d_w / d_h)
-        self.pixmap1 = numpy2pixmap(self.defect.lens.img.copy())
-        self.item.setPixmap(self.pixmap1)
-        self.scene1.addItem(self.item)
-        self.setScene(self.scene1)
+        # tiles of the shared pyramid, only those in view are converted
+        self.pyramid = pyramid_for(self.defect.lens)
+        if self.item is None:
+            self.item = TiledImageItem(self.pyramid)
+            self.scene1.addItem(self.item)
+        elif self.item.pyramid is not self.pyramid:
+            self.item.set_pyramid(self.pyramid)
+        self.item.setPos(0, 0)
         self.fitInView(self.defect.xmax - 18, self.defect.ymin - 18, 80, 80)
         self.rect_item = QtWidgets.QGraphicsRectItem()
         self.rect_item1 = QtWidgets.QGraphicsRectItem()            #左右通道的对应框
@@ -214,15 +445,11 @@ class complex(QGraphicsView,DefectEdit):
         self.scene1.addItem(self.rect_item1)
 
     def color_rect(self,rect_item):
-        rect = QtCore.QRect(self.defect.xmin + self.rect_key_x,
-                            self.defect.ymin + self.rect_key_y,
-                            self.defect.xmax - self.defect.xmin,
-                            self.defect.ymax - self.defect.ymin,) # 指定区域
-    
-        image = self.pixmap1.toImage()
-        color = QtGui.QColor(image.pixel(rect.x(), rect.y())) # 获取像素颜色
-        print(color.red(), color.green(), color.blue()) # 打印
-        return 255-color.red(),255-color.green(), 255-color.blue()
+        # inverse of the pixel at the top left corner of the box
+        r, g, b = self.pyramid.pixel(
+            self.defect.xmin + self.rect_key_x, self.defect.ymin + self.rect_key_y
+        )
+        return 255 - r, 255 - g, 255 - b
         
 
     def xymapping(self, x, y) -> bool:
@@ -344,6 +571,9 @@ class complex(QGraphicsView,DefectEdit):
         
         if QKeyEvent.key() == Qt.Key_Escape:
            self.close()
+
+        if QKeyEvent.key() in (Qt.Key_PageDown, Qt.Key_PageUp):
+            return self.step(1 if QKeyEvent.key() == Qt.Key_PageDown else -1)
         
         if self.ll == True:
             if QKeyEvent.key() == Qt.Key_Up:
@@ -374,28 +604,32 @@ class complex(QGraphicsView,DefectEdit):
 
 
     def keyPressEvent2(self, QKeyEvent):
+        with self.defect.lens.lock:
+            xmin = self.defect._obj.find("bndbox/xmin")
+            xmin.text = f"{self.defect.xmin+self.x_xmin}"
 
-        xmin = self.defect._obj.find("bndbox/xmin")
-        xmin.text = f"{self.defect.xmin+self.x_xmin}"
-
-        xmax = self.defect._obj.find("bndbox/xmax")
-        xmax.text = f"{self.defect.xmax+self.x_xmax}"
+            xmax = self.defect._obj.find("bndbox/xmax")
+            xmax.text = f"{self.defect.xmax+self.x_xmax}"
 
-        ymin = self.defect._obj.find("bndbox/ymin")
-        ymin.text = f"{self.defect.ymin+self.y_ymin}"
+            ymin = self.defect._obj.find("bndbox/ymin")
+            ymin.text = f"{self.defect.ymin+self.y_ymin}"
 
-        ymax = self.defect._obj.find("bndbox/ymax")
-        ymax.text = f"{self.defect.ymax+self.y_ymax}"
+            ymax = self.defect._obj.find("bndbox/ymax")
+            ymax.text = f"{self.defect.ymax+self.y_ymax}"
 
-        self.defect.lens.tree.write(str(self.defect.lens.xml_path))
+        xml_writer.schedule(self.defect.lens)
         logger.info("Successful")
         self.tip = TipUi()
         self.tip.show()
 
     def keyPressEvent3(self, QKeyEvent):
-        xml_file = f"{self.defect.lens.xml_path}"
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
+        # append to the lens tree, re-reading the file would drop unsaved edits
+        with self.defect.lens.lock:
+            self._add_object(self.defect.lens.tree.getroot())
+        xml_writer.schedule(self.defect.lens)
+        logger.info("Successful")
+
+    def _add_object(self, root):
         sub1 = ET.SubElement(root, "object")
         SubElement_country0 = ET.SubElement(sub1, "name")
         SubElement_country0.text = "1111"
@@ -418,9 +652,6 @@ class complex(QGraphicsView,DefectEdit):
         SubElement_country0_yea.text = f"{self.ymax}"
         self.prettyXml(root, "    ", "\n")
 
-        tree.write(xml_file)
-        logger.info("Successful")
-
     def prettyXml(self, element, indent, newline, level=0):
         if element:
             if element.text == None or element.text.isspace():
@@ -508,19 +739,26 @@ class DefectItem(QGraphicsItemGroup):
         super().__init__(parent)
         self.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
         self.setFlag(QGraphicsItem.ItemIsSelectable)
-        self.defect: Defect = defect
-        self.label = QGraphicsSimpleTextItem(defect.name)
+        self.label = QGraphicsSimpleTextItem()
         self.img = QGraphicsPixmapItem()
-        self.img.setPixmap(
-            numpy2pixmap(defect.image).scaledToWidth(50, Qt.SmoothTransformation)
-        )
         self.addToGroup(self.label)
         self.label.setY(-13)
         self.label.setX(12)
         self.addToGroup(self.img)
-        self._rect = self.childrenBoundingRect()
         self._label_color = QColor("black")
+        self.set_defect(defect, msg)
+
+    def set_defect(self, defect: Defect, msg="", selected=False) -> None:
+        "show another defect, so a virtual grid can recycle the item"
+        self.prepareGeometryChange()
+        self.defect: Defect = defect
         self.msg = msg
+        self.setSelected(selected)
+        self.label.setText(defect.name)
+        self.label.setBrush(self._brush())
+        self.img.setPixmap(numpy2pixmap(defect.thumbnail))
+        self._rect = self.childrenBoundingRect()
+        self.update()
 
     def paint(self, painter, option, widget=None):
         painter.drawRect(self._rect)
@@ -544,22 +782,26 @@ w: {self.defect.width}"""
     def mouseDoubleClickEvent(self, event) -> None:
         if event.button() == Qt.LeftButton:
             self.defect_edit = DefectEdit(self.defect)
-            DefectEdit(self.defect)
             self.defect_edit.show()
         if event.button() == Qt.RightButton:
             self.label.setBrush(QBrush(QColor("red")))
             self.defect_edit = DefectEdit(self.defect)
-            DefectEdit(self.defect)
             self.defect_edit.edit()
 
 
     def mark_toggle(self) -> bool:
-        if state := self.defect.mark_toggle():
-            self.label.setBrush(QBrush(QColor("green")))
-        else:
-            self.label.setBrush(self._label_color)
+        state = self.defect.mark_toggle()
+        self.label.setBrush(self._brush())
         return state
 
+    def _brush(self, selected=None) -> QBrush:
+        "green when selected or marked"
+        if selected is None:
+            selected = self.isSelected()
+        if selected or self.defect.mark:
+            return QBrush(QColor("green"))
+        return QBrush(self._label_color)
+
     def rename(self, name):
         self.defect.name = name
         self.label.setText(name)
@@ -569,8 +811,5 @@ w: {self.defect.width}"""
 
     def itemChange(self, change, value):
         if change == QGraphicsItem.ItemSelectedChange:
-            if value:
-                self.label.setBrush(QBrush(QColor("green")))
-            else:
-                self.label.setBrush(QBrush(QColor("black")))
+            self.label.setBrush(self._brush(bool(value)))
         return super().itemChange(change, value)
\ No newline at end of file
@@ -0,0 +1,124 @@
+import csv
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+from openpyxl import Workbook
+
+from . import perf
+from .rule import linewindow
+from .table import table_rows
+
+logger = logging.getLogger(__name__)
+
+COUNT_HEADER = ["编号", "类名", "宽度", "高度", "区域", "是否可收", "左通道对应"]
+LINE_SUFFIXES = "01234"
+PROGRESS_STEP = 256
+
+
+class XlsxSink:
+    "rows streamed through an openpyxl write-only workbook"
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet("sheet")
+
+    def append(self, row):
+        self.ws.append(row)
+
+    def close(self):
+        self.wb.save(self.path)
+
+
+class CsvSink:
+    def __init__(self, path) -> None:
+        self.path = path
+        # utf-8-sig so excel shows the chinese header
+        self.file = open(path, "w", newline="", encoding="utf-8-sig")
+        self.writer = csv.writer(self.file)
+
+    def append(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+def open_sink(path):
+    return CsvSink(path) if Path(path).suffix.lower() == ".csv" else XlsxSink(path)
+
+
+def receive_state(xml_path) -> str:
+    parts = str(xml_path).split("/")
+    for state in ("UNQ", "H1", "H2"):
+        if state in parts or state.lower() in parts:
+            return state
+    return ""
+
+
+def line_names(d) -> list:
+    "first left channel name per suffix whose bbox is on the line of d"
+    if d.name[:1] in ("0", "1"):
+        # the left channel point lookup of these was never written out
+        return []
+    boxes = d.lens.left_index.boxes(*linewindow(d.x, d.y, d.x_, d.y_))
+    names = []
+    for suffix in LINE_SUFFIXES:
+        for d_ in boxes:
+            if d_.name.endswith(suffix):
+                names.append(d_.name)
+                break
+    return names
+
+
+def select_names(defects, names):
+    "defects whose name is one of names, in order"
+    table, rows = table_rows(defects)
+    if table is None:
+        return [d for d in defects if d.name in names]
+    ids = [table.lookup(n) for n in names]
+    keep = np.isin(table.column("name_id", rows), ids)
+    return [defects[i] for i in np.flatnonzero(keep).tolist()]
+
+
+def count_row(d):
+    return [
+        d.lens.xml_path.stem,
+        d.name,
+        d.width,
+        d.height,
+        d.region or "D",
+        receive_state(d.lens.xml_path),
+        str(line_names(d)),
+    ]
+
+
+@perf.timed("export.count")
+def export_count(defects, names, path, progress=None, cancelled=None):
+    """
+    Write the count report of every defect named in names to path (xlsx,
+    or csv by suffix), streaming one row at a time. Returns the number of
+    rows, or None when cancelled() turned true, the partial file removed.
+    """
+    selected = select_names(defects, set(names))
+    sink = open_sink(path)
+    sink.append(COUNT_HEADER)
+    try:
+        for i, d in enumerate(selected):
+            if i % PROGRESS_STEP == 0:
+                if cancelled is not None and cancelled():
+                    break
+                if progress is not None:
+                    progress(i, len(selected))
+            sink.append(count_row(d))
+        else:
+            if progress is not None:
+                progress(len(selected), len(selected))
+            return len(selected)
+    finally:
+        sink.close()
+    os.remove(path)
+    logger.info(f"count export to {path} cancelled")
+    return None
@@ -0,0 +1,148 @@
+from typing import List
+
+import numpy as np
+from PySide6.QtCore import QEvent, QObject, QRectF, Qt
+
+from . import perf
+from .defect import Defect, DefectItem
+from .loader import THUMB_WIDTH
+from .table import table_rows
+
+CELL_WIDTH = 80
+MARGIN = 10
+SPACING = 25
+LABEL_HEIGHT = 13
+
+
+def thumb_heights(d_list: List[Defect]) -> np.ndarray:
+    "height of each thumbnail, from the bboxes alone (see make_thumbnail)"
+    table, rows = table_rows(d_list)
+    if table is not None:
+        w = table.column("width", rows)
+        h = table.column("height", rows)
+    else:
+        w = np.fromiter((d.width for d in d_list), int, len(d_list))
+        h = np.fromiter((d.height for d in d_list), int, len(d_list))
+    th = np.maximum(1, np.round(h * THUMB_WIDTH / np.maximum(w, 1)))
+    return np.where((w > 0) & (h > 0), th, 0).astype(np.int64)
+
+
+class VirtualGrid(QObject):
+    """
+    Grid of DefectItems where only the rows inside the viewport, plus
+    `prefetch` viewport heights above and below, exist as items. The scene
+    rect covers every row so the scroll bars keep the full size, and items
+    leaving the window are recycled for the rows coming in. The selection is
+    kept as indexes into d_list, so it survives recycling.
+    """
+
+    def __init__(self, view, scene, prefetch=1.0, parent=None) -> None:
+        super().__init__(parent)
+        self.view = view
+        self.scene = scene
+        self.prefetch = prefetch
+        self.d_list = []
+        self.items = {}
+        self.pool = []
+        self.active = False
+        self.selected = set()
+        # a plain click or rubber band starts a new selection
+        view.viewport().installEventFilter(self)
+        bar = view.verticalScrollBar()
+        bar.valueChanged.connect(self.update_visible)
+        bar.rangeChanged.connect(self.update_visible)
+
+    def set_defects(self, d_list: List[Defect], col_size: int) -> None:
+        self.d_list = d_list
+        self.col_size = max(1, col_size)
+        n_rows = -(-len(d_list) // self.col_size)
+        heights = np.zeros(n_rows * self.col_size, dtype=np.int64)
+        heights[: len(d_list)] = thumb_heights(d_list)
+        row_height = heights.reshape(n_rows, self.col_size).max(axis=1, initial=0)
+        # top of each row's label, the last entry is the bottom of the grid
+        self.row_top = np.concatenate(
+            ([MARGIN], MARGIN + np.cumsum(row_height + LABEL_HEIGHT + SPACING))
+        )
+        for item in self.items.values():
+            self._recycle(item)
+        self.items = {}
+        self.selected = set()
+        self.active = True
+        width = 2 * MARGIN + self.col_size * CELL_WIDTH
+        height = self.row_top[-1] + MARGIN
+        self.scene.setSceneRect(QRectF(0, 0, width, height))
+        self.view.verticalScrollBar().setValue(0)
+        self.update_visible()
+
+    def visible_range(self) -> range:
+        "indexes into d_list that should be materialized"
+        if not self.d_list:
+            return range(0)
+        rect = self.view.mapToScene(self.view.viewport().rect()).boundingRect()
+        margin = rect.height() * self.prefetch
+        first = np.searchsorted(self.row_top, rect.top() - margin, side="right") - 1
+        last = np.searchsorted(self.row_top, rect.bottom() + margin, side="right")
+        first = max(0, int(first))
+        return range(first * self.col_size, min(len(self.d_list), int(last) * self.col_size))
+
+    def update_visible(self, *_) -> None:
+        if not self.active:
+            return
+        wanted = self.visible_range()
+        for i in [i for i in self.items if i not in wanted]:
+            self._recycle(self.items.pop(i), i)
+        for i in wanted:
+            if i in self.items:
+                continue
+            selected = i in self.selected
+            if self.pool:
+                item = self.pool.pop()
+                # hidden items cannot be selected
+                item.setVisible(True)
+                item.set_defect(self.d_list[i], selected=selected)
+            else:
+                item = DefectItem(self.d_list[i])
+                self.scene.addItem(item)
+                item.setSelected(selected)
+                perf.count("items.created")
+            r, c = divmod(i, self.col_size)
+            item.setPos(MARGIN + c * CELL_WIDTH, self.row_top[r] + LABEL_HEIGHT)
+            self.items[i] = item
+
+    def _recycle(self, item: DefectItem, i=None) -> None:
+        if i is not None:
+            self._keep_selection(i, item)
+        item.setSelected(False)
+        item.setVisible(False)
+        self.pool.append(item)
+
+    def _keep_selection(self, i: int, item: DefectItem) -> None:
+        if item.isSelected():
+            self.selected.add(i)
+        else:
+            self.selected.discard(i)
+
+    def eventFilter(self, obj, event) -> bool:
+        if (
+            event.type() == QEvent.MouseButtonPress
+            and not event.modifiers() & Qt.ControlModifier
+        ):
+            # rows scrolled out of view would stay selected otherwise, the
+            # items in view are read when recycled or by selection()
+            self.selected = set()
+        return False
+
+    def selection(self) -> list:
+        "(defect, item) for each selected row, item is None when not materialized"
+        for i, item in self.items.items():
+            self._keep_selection(i, item)
+        return [(self.d_list[i], self.items.get(i)) for i in sorted(self.selected)]
+
+    def reset(self) -> None:
+        "forget every item, call before the scene is cleared"
+        self.active = False
+        self.d_list = []
+        self.items = {}
+        self.pool = []
+        self.selected = set()
+        self.scene.setSceneRect(QRectF())
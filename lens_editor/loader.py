@@ -0,0 +1,105 @@
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+THUMB_WIDTH = 50
+
+
+def parse_object(obj: ET.Element):
+    "(name, xmin, ymin, xmax, ymax) of a VOC object element"
+    bndbox = obj.find("bndbox")
+    return (
+        obj.find("name").text,
+        int(bndbox.find("xmin").text),
+        int(bndbox.find("ymin").text),
+        int(bndbox.find("xmax").text),
+        int(bndbox.find("ymax").text),
+    )
+
+
+def make_thumbnail(img, width=THUMB_WIDTH):
+    "img scaled to width, keeping the aspect ratio"
+    h, w = img.shape[:2]
+    if h == 0 or w == 0:
+        return img
+    height = max(1, round(h * width / w))
+    interpolation = cv2.INTER_AREA if w > width else cv2.INTER_LINEAR
+    return cv2.resize(img, (width, height), interpolation=interpolation)
+
+
+def parse_lens(xml_path, img_path, thumb_width=THUMB_WIDTH):
+    """
+    Worker side of ProcessLoader: parse the xml and cut the thumbnails of
+    every object. Returns the names, an (n, 4) int32 bbox array and the
+    thumbnails packed in one shared memory block as (name, shapes).
+    """
+    objects = list(ET.parse(str(xml_path)).getroot().iter("object"))
+    records = [parse_object(obj) for obj in objects]
+    names = [r[0] for r in records]
+    boxes = np.array([r[1:] for r in records], dtype=np.int32).reshape(-1, 4)
+    if img_path is None or not records:
+        return names, boxes, None, []
+    img = cv2.imread(str(img_path))
+    if img is None:
+        return names, boxes, None, []
+    thumbs = [make_thumbnail(img[y : y_, x : x_]) for x, y, x_, y_ in boxes]
+    shapes = [t.shape for t in thumbs]
+    size = sum(t.nbytes for t in thumbs)
+    if size == 0:
+        return names, boxes, None, shapes
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    offset = 0
+    for t in thumbs:
+        shm.buf[offset : offset + t.nbytes] = t.tobytes()
+        offset += t.nbytes
+    shm.close()
+    return names, boxes, shm.name, shapes
+
+
+def unpack_thumbnails(shm_name, shapes):
+    "copy thumbnails out of the block written by parse_lens and free it"
+    if shm_name is None:
+        return [np.zeros(shape, dtype=np.uint8) for shape in shapes]
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        thumbs = []
+        offset = 0
+        for shape in shapes:
+            # copy right away, no view may outlive shm.close()
+            view = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+            thumbs.append(view.copy())
+            offset += view.nbytes
+            del view
+        return thumbs
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+class ProcessLoader:
+    """
+    Parse xml files and cut thumbnails in worker processes, out of reach of
+    the GIL. Results come back as compact records plus shared memory
+    thumbnails, never as pickled images.
+    """
+
+    def __init__(self, max_workers=None, thumb_width=THUMB_WIDTH):
+        self.thumb_width = thumb_width
+        # spawn, forking a process that runs Qt threads is not safe
+        self.pool = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def load(self, xml_path, img_path):
+        "(records, thumbnails) of one lens, blocks until a worker is done"
+        future = self.pool.submit(parse_lens, xml_path, img_path, self.thumb_width)
+        names, boxes, shm_name, shapes = future.result()
+        records = [(n, *map(int, b)) for n, b in zip(names, boxes)]
+        return records, unpack_thumbnails(shm_name, shapes)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
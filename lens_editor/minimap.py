@@ -20,83 +20,90 @@ def numpy2pixmap(np_img):
     return QPixmap(qimg)
 
 
+# width of a lens frame, the left and right channel images side by side
+FRAME_WIDTH = 2400
+SPLIT = FRAME_WIDTH // 2
+TOOLTIP_WIDTH = 100
+TOOLTIP_BORDER = 3
+TOOLTIP_COLOR = (0, 190, 246)
+
+
+def scale_frame(img, width):
+    "img resized to width px, keeping the aspect ratio"
+    h, w = img.shape[:2]
+    height = max(1, round(h * width / w))
+    interpolation = cv2.INTER_AREA if w > width else cv2.INTER_LINEAR
+    return cv2.resize(img, (width, height), interpolation=interpolation)
+
+
+def paste(dst, img, x, y):
+    "copy img into dst with its top left corner at x, y, clipped to dst"
+    h, w = img.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, dst.shape[1]), min(y + h, dst.shape[0])
+    if x0 < x1 and y0 < y1:
+        dst[y0:y1, x0:x1] = img[y0 - y : y1 - y, x0 - x : x1 - x]
+
+
+def tooltip_origin(d, r_w, r_h):
+    "top left corner of the crop shown next to d, in frame coordinates"
+    x_t = d.xmax + 50
+    y_t = d.ymin - 50
+    if x_t >= SPLIT and y_t <= SPLIT:
+        return d.xmax - 150, d.ymin + 40
+    if x_t < SPLIT and y_t < SPLIT:
+        return d.xmax + 50, d.ymin + 20
+    if x_t < SPLIT and y_t > SPLIT:
+        return d.xmax + 10, d.ymin - 10 - r_h
+    if x_t >= SPLIT and y_t >= SPLIT:
+        return d.xmax - (2 * r_w), d.ymin - r_h - 30
+    return None
+
+
 class Minimap:
-    def __init__(self, defect, defects, width, show_all=False):
-        self.defect = defect
-        self.defects = defects
-        self.width = width
-        self.background: np.adarry = self.defect.lens.img.copy()
-        if not show_all:
-            self.draw(self.defect, self.defects)
-            return
-        self.draw_all(self.defects)
-
-    def draw_all(self, defects):
-        self.defects = defects
-        for d in self.defects:
-            self.draw(d)
-
-    def draw(self, defect, defects):
-        self.defects = defects
-        self.defect = defect
-        thick = 3
-        color = (0, 190, 246)
-        d_img = self.defect.image
-        d_w, d_h = d_img.shape[:2]
-        r_w = 100
-        r_h = int(r_w * d_w / d_h)
-        detail_img = cv2.resize(d_img, (r_w, r_h))
-        tooltip = cv2.copyMakeBorder(
-            detail_img,
-            thick,
-            thick,
-            thick,
-            thick,
-            cv2.BORDER_CONSTANT | cv2.BORDER_ISOLATED,
-            value=color,
-        )
-        x_t = self.defect.xmax + 50
-        y_t = self.defect.ymin - 50
-        x = self.defect.xmax
-        y = self.defect.ymin
-        cv2.circle(
-            self.background, (defect.xmin, defect.ymin), 20, (255, 0, 255)
-        )  # x,y用来画圈，x_t,y_t,用来画缩略图
-        cv2.circle(self.background, (x, y), 25, 255, 0, 0, 3)
-        if x_t >= 1200 and y_t <= 1200:
-            x_t = self.defect.xmax - 150
-            y_t = self.defect.ymin + 40
-            self.background[
-                y_t : y_t + tooltip.shape[0],
-                x_t : x_t + tooltip.shape[1],
-            ] = tooltip
-        elif x_t < 1200 and y_t < 1200:
-            x_t = self.defect.xmax + 50
-            y_t = self.defect.ymin + 20
-            self.background[
-                y_t : y_t + tooltip.shape[0],
-                x_t : x_t + tooltip.shape[1],
-            ] = tooltip
-        elif x_t < 1200 and y_t > 1200:
-            x_t = self.defect.xmax + 10
-            y_t = self.defect.ymin - 10 - r_h
-            self.background[
-                y_t : y_t + tooltip.shape[0],
-                x_t : x_t + tooltip.shape[1],
-            ] = tooltip
-        elif x_t >= 1200 and y_t >= 1200:
-            x_t = self.defect.xmax - (2 * r_w)
-            y_t = self.defect.ymin - r_h - 30
-            self.background[
-                y_t : y_t + tooltip.shape[0],
-                x_t : x_t + tooltip.shape[1],
-            ] = tooltip
-
-        return numpy2pixmap(self.background).scaledToWidth(
-            self.width, Qt.SmoothTransformation
-        )
-
-    def get_pixmap(self) -> QPixmap:
-        return numpy2pixmap(self.background).scaledToWidth(
-            self.width, Qt.SmoothTransformation
-        )
+    """
+    Overview of a lens frame at `width` px with defects circled and their
+    crops shown next to them. Overlays are drawn in scaled coordinates on
+    a copy of the downscaled frame the lens caches, so the full resolution
+    frame is neither copied nor rescaled.
+    """
+
+    def __init__(self, lens, width):
+        self.base, self.scale = lens.scaled_img(width)
+
+    def draw(self, defect) -> QPixmap:
+        return self.draw_all([defect])
+
+    def draw_all(self, defects) -> QPixmap:
+        "every defect on one copy of the frame"
+        canvas = self.base.copy()
+        for d in defects:
+            self._overlay(canvas, d)
+        return numpy2pixmap(canvas)
+
+    def _at(self, v) -> int:
+        return round(v * self.scale)
+
+    def _overlay(self, canvas, d):
+        s = self.scale
+        thumb = d.thumbnail
+        if thumb.size:
+            # fit in a TOOLTIP_WIDTH square, thin defects stay readable
+            h, w = thumb.shape[:2]
+            r_w = min(TOOLTIP_WIDTH, int(TOOLTIP_WIDTH * w / h))
+            r_h = min(TOOLTIP_WIDTH, int(TOOLTIP_WIDTH * h / w))
+            if (origin := tooltip_origin(d, r_w, r_h)) is not None:
+                size = (max(1, self._at(r_w)), max(1, self._at(r_h)))
+                border = max(1, self._at(TOOLTIP_BORDER))
+                tooltip = cv2.copyMakeBorder(
+                    cv2.resize(thumb, size),
+                    border,
+                    border,
+                    border,
+                    border,
+                    cv2.BORDER_CONSTANT | cv2.BORDER_ISOLATED,
+                    value=TOOLTIP_COLOR,
+                )
+                paste(canvas, tooltip, self._at(origin[0]), self._at(origin[1]))
+        cv2.circle(canvas, (self._at(d.xmin), self._at(d.ymin)), max(2, round(20 * s)), (255, 0, 255))
+        cv2.circle(canvas, (self._at(d.xmax), self._at(d.ymin)), max(2, round(25 * s)), (255, 0, 0))
@@ -0,0 +1,253 @@
+"""
+Timing instrumentation for the hot paths: named spans, counters and
+histograms, off by default. While disabled span() hands out one shared
+no-op object and count()/observe() return at once, so instrumented code
+pays a global lookup and a call. enable() starts recording; report()
+summarizes and export_trace() writes a Chrome trace (chrome://tracing,
+ui.perfetto.dev) of the last MAX_EVENTS spans and counter changes.
+"""
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+MAX_EVENTS = 200_000
+
+_recorder = None
+
+
+class Stats:
+    "count, total, min and max of the values of one span or histogram"
+
+    __slots__ = ("count", "total", "min", "max", "last", "buckets")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.last = None
+        # power of two upper bound -> count, for percentiles of histograms
+        self.buckets = {}
+
+    def add(self, value) -> None:
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.last = value
+        bound = 2 ** math.ceil(math.log2(value)) if value > 0 else 0
+        self.buckets[bound] = self.buckets.get(bound, 0) + 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q) -> float:
+        "upper bound of the bucket holding the q quantile"
+        seen, rank = 0, q * self.count
+        for bound in sorted(self.buckets):
+            seen += self.buckets[bound]
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Recorder:
+    def __init__(self, max_events=MAX_EVENTS) -> None:
+        self.origin = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+        self.histograms = {}
+        self.events = deque(maxlen=max_events)
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, end, args=None) -> None:
+        thread = threading.current_thread()
+        with self._lock:
+            if (stats := self.spans.get(name)) is None:
+                stats = self.spans[name] = Stats()
+            stats.add(end - start)
+            self.threads.setdefault(thread.ident, thread.name)
+            self.events.append(("X", name, thread.ident, start, end - start, args))
+
+    def count(self, name, n) -> None:
+        with self._lock:
+            value = self.counters[name] = self.counters.get(name, 0) + n
+            self.events.append(("C", name, 0, time.perf_counter(), value, None))
+
+    def observe(self, name, value) -> None:
+        with self._lock:
+            if (stats := self.histograms.get(name)) is None:
+                stats = self.histograms[name] = Stats()
+            stats.add(value)
+
+
+class Span:
+    "times a with block, or start() to stop() across callbacks"
+
+    __slots__ = ("recorder", "name", "args", "t0")
+
+    def __init__(self, recorder, name, args) -> None:
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+        self.t0 = None
+
+    def start(self) -> "Span":
+        self.t0 = time.perf_counter()
+        return self
+
+    def stop(self) -> None:
+        if self.t0 is not None:
+            self.recorder.add_span(self.name, self.t0, time.perf_counter(), self.args)
+            self.t0 = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_SPAN = NullSpan()
+
+
+def enable(max_events=MAX_EVENTS) -> None:
+    "start recording, keeping what was recorded if already enabled"
+    global _recorder
+    if _recorder is None:
+        _recorder = Recorder(max_events)
+
+
+def disable() -> None:
+    global _recorder
+    _recorder = None
+
+
+def enabled() -> bool:
+    return _recorder is not None
+
+
+def span(name, **args):
+    if (recorder := _recorder) is None:
+        return _NULL_SPAN
+    return Span(recorder, name, args or None)
+
+
+def timed(name):
+    "decorator timing every call as a span"
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if (recorder := _recorder) is None:
+                return fn(*args, **kwargs)
+            with Span(recorder, name, None):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, n=1) -> None:
+    if (recorder := _recorder) is not None:
+        recorder.count(name, n)
+
+
+def observe(name, value) -> None:
+    "add value to the histogram name"
+    if (recorder := _recorder) is not None:
+        recorder.observe(name, value)
+
+
+def last(name):
+    "seconds of the latest name span, None when not recorded"
+    if _recorder is None or (stats := _recorder.spans.get(name)) is None:
+        return None
+    return stats.last
+
+
+def status(names) -> str:
+    "latest duration of each recorded span in names, for the status bar"
+    parts = []
+    for name in names:
+        if (seconds := last(name)) is not None:
+            parts.append(f"{name} {_ms(seconds)}")
+    return " | ".join(parts)
+
+
+def _ms(seconds) -> str:
+    return f"{seconds * 1000:.1f}ms"
+
+
+def report() -> str:
+    "text table of every span, counter and histogram"
+    if (recorder := _recorder) is None:
+        return "instrumentation is disabled"
+    with recorder._lock:
+        spans = sorted(recorder.spans.items(), key=lambda kv: -kv[1].total)
+        counters = sorted(recorder.counters.items())
+        histograms = sorted(recorder.histograms.items())
+    lines = [f"{'span':<24}{'count':>8}{'total':>12}{'mean':>12}{'max':>12}"]
+    for name, s in spans:
+        lines.append(
+            f"{name:<24}{s.count:>8}{_ms(s.total):>12}{_ms(s.mean):>12}{_ms(s.max):>12}"
+        )
+    if counters:
+        lines += ["", f"{'counter':<24}{'value':>8}"]
+        lines += [f"{name:<24}{value:>8}" for name, value in counters]
+    if histograms:
+        lines += ["", f"{'histogram':<24}{'count':>8}{'mean':>12}{'p50':>12}{'p95':>12}{'max':>12}"]
+        for name, s in histograms:
+            values = (s.mean, s.percentile(0.5), s.percentile(0.95), s.max)
+            lines.append(f"{name:<24}{s.count:>8}" + "".join(f"{v:>12.0f}" for v in values))
+    return "\n".join(lines)
+
+
+def export_trace(path) -> int:
+    "write the recorded events as Chrome trace json, returns the event count"
+    if (recorder := _recorder) is None:
+        raise ValueError("instrumentation is disabled")
+    with recorder._lock:
+        events = list(recorder.events)
+        threads = dict(recorder.threads)
+    pid = os.getpid()
+    origin = recorder.origin
+    trace = [
+        {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+        for tid, name in threads.items()
+    ]
+    for ph, name, tid, t, value, args in events:
+        event = {"name": name, "ph": ph, "pid": pid, "tid": tid, "ts": (t - origin) * 1e6}
+        if ph == "X":
+            event["dur"] = value * 1e6
+            if args:
+                event["args"] = args
+        else:
+            event["args"] = {name: value}
+        trace.append(event)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+    return len(events)
@@ -0,0 +1,109 @@
+import math
+
+import cv2
+from PySide6.QtCore import QRectF
+from PySide6.QtGui import QPainter
+from PySide6.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+
+from .cache import LRUCache
+from .minimap import numpy2pixmap
+
+TILE = 256
+LEVELS = 4
+
+
+class ImagePyramid:
+    """
+    Full resolution frame of a lens and its 1/2, 1/4 and 1/8 reductions.
+    Tiles are converted to pixmaps on demand and kept in tile_cache,
+    shared by every view of the lens.
+    """
+
+    def __init__(self, lens) -> None:
+        self.key = str(lens.img_path)
+        self.levels = [lens.img]
+        self.height, self.width = self.levels[0].shape[:2]
+        for _ in range(LEVELS - 1):
+            prev = self.levels[-1]
+            size = ((prev.shape[1] + 1) // 2, (prev.shape[0] + 1) // 2)
+            self.levels.append(cv2.resize(prev, size, interpolation=cv2.INTER_AREA))
+        self.nbytes = sum(level.nbytes for level in self.levels)
+
+    def level_for(self, lod: float) -> int:
+        "coarsest level with at least one pixel per screen pixel at scale lod"
+        if lod >= 1:
+            return 0
+        return min(LEVELS - 1, int(math.log2(1 / lod)))
+
+    def tile(self, n: int, tx: int, ty: int):
+        "QPixmap of tile tx, ty of level n"
+        key = (self.key, n, tx, ty)
+        if (pixmap := tile_cache.get(key)) is None:
+            img = self.levels[n][ty * TILE : (ty + 1) * TILE, tx * TILE : (tx + 1) * TILE]
+            pixmap = tile_cache.put(key, numpy2pixmap(img))
+        return pixmap
+
+    def pixel(self, x: int, y: int):
+        "(r, g, b) at x, y of the full resolution frame, clamped to the frame"
+        x = min(max(int(x), 0), self.width - 1)
+        y = min(max(int(y), 0), self.height - 1)
+        px = self.levels[0][y, x]
+        if px.ndim == 0:
+            return int(px), int(px), int(px)
+        b, g, r = (int(v) for v in px[:3])
+        return r, g, b
+
+
+def pixmap_bytes(pixmap) -> int:
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+# bounded by bytes, stepping through many lenses keeps only the recent ones
+pyramid_cache = LRUCache(128 * 1024 * 1024, sizeof=lambda p: p.nbytes)
+tile_cache = LRUCache(64 * 1024 * 1024, sizeof=pixmap_bytes)
+
+
+def pyramid_for(lens) -> ImagePyramid:
+    "the pyramid of lens, shared by every editor window"
+    key = str(lens.img_path)
+    if (pyramid := pyramid_cache.get(key)) is None:
+        pyramid = pyramid_cache.put(key, ImagePyramid(lens))
+    return pyramid
+
+
+class TiledImageItem(QGraphicsItem):
+    "draws the tiles of a pyramid under the exposed rect, at the level of the zoom"
+
+    def __init__(self, pyramid: ImagePyramid, parent=None) -> None:
+        super().__init__(parent)
+        self.pyramid = pyramid
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+
+    def set_pyramid(self, pyramid: ImagePyramid) -> None:
+        self.prepareGeometryChange()
+        self.pyramid = pyramid
+        self.update()
+
+    def boundingRect(self) -> QRectF:
+        return QRectF(0, 0, self.pyramid.width, self.pyramid.height)
+
+    def paint(self, painter, option, widget=None) -> None:
+        p = self.pyramid
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        n = p.level_for(lod)
+        step = TILE << n
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        if exposed.isEmpty():
+            return
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, n > 0)
+        tx0, ty0 = int(exposed.left()) // step, int(exposed.top()) // step
+        tx1, ty1 = int(math.ceil(exposed.right())) // step, int(math.ceil(exposed.bottom())) // step
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                if tx * step >= p.width or ty * step >= p.height:
+                    continue
+                pixmap = p.tile(n, tx, ty)
+                target = QRectF(
+                    tx * step, ty * step, pixmap.width() << n, pixmap.height() << n
+                )
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
@@ -0,0 +1,286 @@
+"""
+Search bar query language, compiled once into a tree of nodes that
+evaluate to boolean masks over a DefectIndex or to SQL for the Catalog.
+
+    query   := or_expr
+    or_expr := and_expr ("or" and_expr)*
+    and_expr:= unary (["and"] unary)*       terms side by side are and-ed
+    unary   := "not" unary | "(" or_expr ")" | term
+    term    := [PROFILE]A..D                region, like 72B
+             | name=GLOB[-REGION]           name, * ? [] globs
+             | fn[=]TEXT | fn:TEXT          xml path contains TEXT
+             | mark | -mark | mod | -mod
+             | x|y|w|h OP VALUE             OP one of < <= > >= = == !=
+             | VALUE OP x|y|w|h [OP VALUE]  ranges like 1329<x<=1710
+
+VALUE is a constant expression like 7*1.57 (see fold_constant).
+"""
+import re
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from .region import region_code
+from .rule import fold_constant
+
+ATTRS = ("x", "y", "w", "h")
+# catalog expressions for the x/y/w/h terms
+SQL_COLUMNS = {
+    "x": "o.xmin",
+    "y": "o.ymin",
+    "w": "(o.xmax - o.xmin)",
+    "h": "(o.ymax - o.ymin)",
+}
+_FLIP = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "==": "==", "!=": "!="}
+_TOKEN = re.compile(r"\s*(?:(\()|(\))|(<=|>=|==|!=|<|>|=)|([^\s()<>=!]+))")
+_REGION = re.compile(r"(\d+)?([ABCD])")
+
+
+def tokenize(text: str):
+    "list of (kind, text), kind one of ( ) op word"
+    tokens, pos = [], 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _TOKEN.match(text, pos)
+        if m is None:
+            raise ValueError(f"unexpected {text[pos:]!r} in query")
+        kind = ("(", ")", "op", "word")[m.lastindex - 1]
+        tokens.append((kind, m.group(m.lastindex)))
+        pos = m.end()
+    return tokens
+
+
+class Node(ABC):
+    @abstractmethod
+    def mask(self, index) -> np.ndarray:
+        pass
+
+    @abstractmethod
+    def sql(self):
+        "(where clause, params)"
+        pass
+
+
+class And(Node):
+    def __init__(self, items):
+        self.items = items
+
+    def mask(self, index):
+        result = self.items[0].mask(index)
+        for item in self.items[1:]:
+            result &= item.mask(index)
+        return result
+
+    def sql(self):
+        parts = [item.sql() for item in self.items]
+        return "(" + " AND ".join(w for w, _ in parts) + ")", sum((p for _, p in parts), [])
+
+
+class Or(And):
+    def mask(self, index):
+        result = self.items[0].mask(index)
+        for item in self.items[1:]:
+            result |= item.mask(index)
+        return result
+
+    def sql(self):
+        parts = [item.sql() for item in self.items]
+        return "(" + " OR ".join(w for w, _ in parts) + ")", sum((p for _, p in parts), [])
+
+
+class Not(Node):
+    def __init__(self, item):
+        self.item = item
+
+    def mask(self, index):
+        return ~self.item.mask(index)
+
+    def sql(self):
+        where, params = self.item.sql()
+        return f"NOT {where}", params
+
+
+class Compare(Node):
+    def __init__(self, attr, op, value):
+        self.attr = attr
+        self.op = "==" if op == "=" else op
+        self.value = value
+
+    def mask(self, index):
+        return index.compare(self.attr, self.op, self.value)
+
+    def sql(self):
+        return f"{SQL_COLUMNS[self.attr]} {self.op} ?", [self.value]
+
+
+class Region(Node):
+    "a region of a RegionProfile"
+
+    def __init__(self, profile, letter):
+        self.profile = profile
+        self.letter = letter
+
+    def mask(self, index):
+        return index.region(self.profile, self.letter)
+
+    def sql(self):
+        bounds = self.profile.bounds(self.letter)
+        if not bounds:
+            return "0", []
+        pairs = zip(bounds[::2], bounds[1::2])
+        return "(" + " OR ".join("(o.xmin > ? AND o.xmin < ?)" for _ in pairs) + ")", bounds
+
+
+class Name(Node):
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def mask(self, index):
+        return index.name(self.pattern)
+
+    def sql(self):
+        if any(c in self.pattern for c in "*?["):
+            return "o.name GLOB ?", [self.pattern]
+        return "o.name = ?", [self.pattern]
+
+
+class File(Node):
+    def __init__(self, text):
+        self.text = text
+
+    def mask(self, index):
+        return index.lens_where(lambda l: self.text in str(l.xml_path))
+
+    def sql(self):
+        return "instr(f.path, ?) > 0", [self.text]
+
+
+class Mark(Node):
+    def mask(self, index):
+        return index.mark()
+
+    def sql(self):
+        raise ValueError("mark is not stored in the catalog")
+
+
+class Modified(Node):
+    def mask(self, index):
+        return index.lens_where(lambda l: l.modified)
+
+    def sql(self):
+        raise ValueError("mod is not stored in the catalog")
+
+
+class All(Node):
+    def mask(self, index):
+        return np.ones(len(index), dtype=bool)
+
+    def sql(self):
+        return "1", []
+
+
+class Parser:
+    """
+    Recursive descent over the tokens of one query, `profiles` is the
+    RegionProfiles that region terms refer to.
+    """
+
+    def __init__(self, text, profiles):
+        self.tokens = tokenize(text)
+        self.pos = 0
+        self.profiles = profiles
+
+    def parse(self) -> Node:
+        if not self.tokens:
+            return All()
+        node = self.or_expr()
+        if self.pos < len(self.tokens):
+            raise ValueError(f"unexpected {self.tokens[self.pos][1]!r} in query")
+        return node
+
+    def peek(self, offset=0):
+        pos = self.pos + offset
+        return self.tokens[pos] if pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None):
+        token = self.peek()
+        if token[0] is None or (kind is not None and token[0] != kind):
+            raise ValueError(f"expected {kind or 'a term'} at the end of the query")
+        self.pos += 1
+        return token[1]
+
+    def or_expr(self):
+        items = [self.and_expr()]
+        while self.peek() == ("word", "or"):
+            self.pos += 1
+            items.append(self.and_expr())
+        return items[0] if len(items) == 1 else Or(items)
+
+    def and_expr(self):
+        items = [self.unary()]
+        while self.peek()[0] in ("word", "(") and self.peek()[1] != "or":
+            if self.peek() == ("word", "and"):
+                self.pos += 1
+            items.append(self.unary())
+        return items[0] if len(items) == 1 else And(items)
+
+    def unary(self):
+        if self.peek() == ("word", "not"):
+            self.pos += 1
+            return Not(self.unary())
+        if self.peek()[0] == "(":
+            self.pos += 1
+            node = self.or_expr()
+            self.take(")")
+            return node
+        return self.term()
+
+    def term(self):
+        word = self.take("word")
+        kind, op = self.peek()
+        if word in ATTRS and kind == "op":
+            self.pos += 1
+            return Compare(word, op, fold_constant(self.take("word")))
+        # before ranges, name=w and fn=x are not comparisons
+        if word == "name":
+            if self.take("op") != "=":
+                raise ValueError("name only takes =")
+            return self.name(self.take("word"))
+        if word == "fn":
+            if kind == "op":
+                self.pos += 1
+            return File(self.take("word"))
+        if kind == "op" and self.peek(1) in [("word", a) for a in ATTRS]:
+            return self.range(word)
+        if word in ("mark", "-mark"):
+            return Mark() if word == "mark" else Not(Mark())
+        if word in ("mod", "-mod"):
+            return Modified() if word == "mod" else Not(Modified())
+        if word.startswith("fn:"):
+            # the older fn:TEXT spelling, ':' is part of the word
+            return File(word[3:])
+        if m := _REGION.fullmatch(word):
+            return Region(self.profiles.get(m.group(1)), m.group(2))
+        raise ValueError(f"unknown query term {word!r}")
+
+    def range(self, low):
+        "`1329<x<=1710` or `5<w`, the constant on the left"
+        op = self.take("op")
+        attr = self.take("word")
+        node = Compare(attr, _FLIP["==" if op == "=" else op], fold_constant(low))
+        if self.peek()[0] == "op":
+            op = self.take("op")
+            node = And([node, Compare(attr, op, fold_constant(self.take("word")))])
+        return node
+
+    def name(self, value):
+        name, sep, region = value.partition("-")
+        node = Name(name)
+        if sep:
+            region_code(region)
+            node = And([node, Region(self.profiles.default, region)])
+        return node
+
+
+def compile_query(text: str, profiles) -> Node:
+    return Parser(text, profiles).parse()
@@ -0,0 +1,98 @@
+from bisect import bisect_right
+
+import numpy as np
+
+from .config import Config
+
+REGIONS = "ABCD"
+# open x intervals of each region, per lens size
+DEFAULT_PROFILES = {
+    "70": "A=120-535,1330-1710 B=536-815,1711-1960 C=816-1060,1961-2185 D=0-119,1061-1329,2186-2400",
+    "72": "A=120-535,1330-1710 B=536-815,1711-1960 C=816-1085,1961-2215 D=0-119,1086-1329,2216-2400",
+    "75": "A=120-535,1330-1710 B=536-815,1711-1960 C=816-1135,1961-2240 D=0-119,1136-1329,2241-2400",
+}
+
+
+def region_code(letter) -> int:
+    if len(letter) != 1 or letter not in REGIONS:
+        raise ValueError(f"unknown region {letter!r}")
+    return REGIONS.index(letter)
+
+
+class RegionProfile:
+    """
+    Region boundaries of one lens size, every region a list of open x
+    intervals (low, high). They compile into one sorted edge array, so a
+    whole x column is labelled by a single np.searchsorted; integer x is
+    inside (low, high) when low + 1 <= x < high.
+    """
+
+    def __init__(self, name, intervals) -> None:
+        self.name = name
+        self.intervals = intervals
+        segments = sorted(
+            (low + 1, high, region_code(letter))
+            for letter, pairs in intervals.items()
+            for low, high in pairs
+            if low + 1 < high
+        )
+        edges, codes = [], [-1]
+        for start, end, code in segments:
+            if edges and start < edges[-1]:
+                raise ValueError(f"overlapping regions in profile {name}")
+            edges += [start, end]
+            codes += [code, -1]
+        self._edges = edges
+        self.edges = np.array(edges, dtype=np.int64)
+        self.codes = np.array(codes, dtype=np.int8)
+
+    @classmethod
+    def parse(cls, name, spec: str):
+        "`A=120-535,1330-1710 B=...` -> RegionProfile"
+        intervals = {}
+        try:
+            for part in spec.split():
+                letter, _, ranges = part.partition("=")
+                intervals[letter] = [
+                    tuple(int(v) for v in r.split("-")) for r in ranges.split(",")
+                ]
+        except ValueError:
+            raise ValueError(f"invalid region profile {name}: {spec!r}") from None
+        return cls(name, intervals)
+
+    def bounds(self, letter) -> list:
+        "flat [low, high, ...] of a region"
+        region_code(letter)
+        return [v for pair in self.intervals.get(letter, []) for v in pair]
+
+    def label(self, x) -> np.ndarray:
+        "region code of every x, -1 outside all regions"
+        return self.codes[np.searchsorted(self.edges, x, side="right")]
+
+    def code(self, x) -> int:
+        return int(self.codes[bisect_right(self._edges, x)])
+
+
+class RegionProfiles:
+    "the known profiles by name, `default` labels the loaded defects"
+
+    def __init__(self, specs=None, default="72") -> None:
+        specs = DEFAULT_PROFILES if specs is None else specs
+        self.profiles = {name: RegionProfile.parse(name, s) for name, s in specs.items()}
+        self.default = self.get(default)
+
+    @classmethod
+    def from_config(cls):
+        cfg = Config()
+        for name, spec in DEFAULT_PROFILES.items():
+            cfg.setup("regions", name, spec)
+        default = cfg.setup("regions", "default", "72")
+        specs = {k: v for k, v in cfg.items("regions") if k != "default"}
+        return cls(specs, default)
+
+    def get(self, name=None) -> RegionProfile:
+        if name is None:
+            return self.default
+        if name not in self.profiles:
+            raise ValueError(f"unknown region profile {name!r}")
+        return self.profiles[name]
@@ -1,11 +1,23 @@
+import ast
+import csv
+import operator
+import weakref
 from abc import ABC, abstractmethod
 from collections import defaultdict
+from itertools import chain
+from time import perf_counter
+
+import numpy as np
+
+from .region import region_code
+from .spatial import channel_index
+from .table import table_rows
 
 
 # Chain of Responsibility
 class Handler(ABC):
     @abstractmethod
-    def handle(self, defect):
+    def handle(self, defect, memo=None):
         pass
 
     @abstractmethod
@@ -20,150 +32,264 @@ class AbstractHandler(Handler):
         self._next_handler = handler
         return handler
 
-    def handle(self, defect):
+    def handle(self, defect, memo=None):
         if self._next_handler:
-            return self._next_handler.handle(defect)
+            return self._next_handler.handle(defect, memo)
         return None
 
 
-def xymapping(x, y) -> bool:
+def xywindow(x, y):
+    "window (xmin, xmax, ymin, ymax) in the other channel for point (x, y)"
     # 第一象限 > 第三
     if x >= 1200 and y <= 1200:
-        xmin = x - 1275
-        xmax = x - 1025
-        ymin = 925 + y
-        ymax = 1175 + y
-        return lambda x, y: (x <= xmax and x >= xmin) and (y >= ymin and y <= ymax)
+        return x - 1275, x - 1025, 925 + y, 1175 + y
     # 第四象限
     if x >= 1200 and y > 1200:
-        xmin = x - 1275
-        xmax = x - 1025
-        ymax = y - 1035
-        ymin = y - 1285
-        return lambda x, y: (x <= xmax and x >= xmin) and (y >= ymin and y <= ymax)
+        return x - 1275, x - 1025, y - 1285, y - 1035
     # 第二象限
     if x < 1200 and y <= 1200:
-        xmin = x + 1025
-        xmax = x + 1275
-        ymin = y + 1035
-        ymax = y + 1285
-        return lambda x, y: (x <= xmax and x >= xmin) and (y >= ymin and y <= ymax)
+        return x + 1025, x + 1275, y + 1035, y + 1285
     # 第三象限
     if x < 1200 and y > 1200:
-        xmin = x + 1025
-        xmax = x + 1275
-        ymin = y - 1175
-        ymax = y - 925
-        return lambda x, y: (x <= xmax and x >= xmin) and (y >= ymin and y <= ymax)
+        return x + 1025, x + 1275, y - 1175, y - 925
 
 
-def linemapping(xmin, ymin, xmax, ymax):
+def linewindow(xmin, ymin, xmax, ymax):
+    "window (xmin, xmax, ymin, ymax) in the other channel for a bbox"
     # 第一象限 > 第三
     if xmax >= 1200 and ymax <= 1200:
-        xmin = xmin - 1275
-        xmax = xmax - 1025
-        ymin = 925 + ymin
-        ymax = 1175 + ymax
-        return lambda x, y, x_, y_: (x_ <= xmax and x >= xmin) and (
-            y >= ymin and y_ <= ymax
-        )
+        return xmin - 1275, xmax - 1025, 925 + ymin, 1175 + ymax
     # 第四象限
     if xmax >= 1200 and ymax > 1200:
-        xmin = xmin - 1275
-        xmax = xmax - 1025
-        ymax = ymax - 1035
-        ymin = ymin - 1285
-        return lambda x, y, x_, y_: (x_ <= xmax and x >= xmin) and (
-            y >= ymin and y_ <= ymax
-        )
+        return xmin - 1275, xmax - 1025, ymin - 1285, ymax - 1035
     # 第二象限
     if xmax < 1200 and ymax <= 1200:
-        xmin = xmin + 1025
-        xmax = xmax + 1275
-        ymin = ymin + 1035
-        ymax = ymax + 1285
-        return lambda x, y, x_, y_: (x_ <= xmax and x >= xmin) and (
-            y >= ymin and y_ <= ymax
-        )
+        return xmin + 1025, xmax + 1275, ymin + 1035, ymax + 1285
     # 第三象限
     if xmax < 1200 and ymax > 1200:
-        xmin = xmin + 1025
-        xmax = xmax + 1275
-        ymin = ymin - 1175
-        ymax = ymax - 925
-        return lambda x, y, x_, y_,: (x_ <= xmax and x >= xmin) and (
-            y >= ymin and y_ <= ymax
-        )
+        return xmin + 1025, xmax + 1275, ymin - 1175, ymax - 925
+
+
+def xymapping(x, y) -> bool:
+    if (window := xywindow(x, y)) is None:
+        return None
+    xmin, xmax, ymin, ymax = window
+    return lambda x, y: (x <= xmax and x >= xmin) and (y >= ymin and y <= ymax)
+
+
+def linemapping(xmin, ymin, xmax, ymax):
+    if (window := linewindow(xmin, ymin, xmax, ymax)) is None:
+        return None
+    xmin, xmax, ymin, ymax = window
+    return lambda x, y, x_, y_: (x_ <= xmax and x >= xmin) and (
+        y >= ymin and y_ <= ymax
+    )
 
 
 # Parser
-def sexp_parser(sexp):
+OPERATORS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+_ARITH = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
+
+
+def _fold(node):
+    if isinstance(node, ast.Expression):
+        return _fold(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _fold(node.operand)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp) and type(node.op) in _ARITH:
+        return _ARITH[type(node.op)](_fold(node.left), _fold(node.right))
+    raise ValueError(f"unsupported expression: {ast.dump(node)}")
+
+
+def fold_constant(expr):
+    "evaluate a threshold like `7*1.57` once, without eval"
+    try:
+        return _fold(ast.parse(expr.strip(), mode="eval"))
+    except SyntaxError as e:
+        raise ValueError(f"invalid threshold: {expr!r}") from e
+
+
+def split_comparison(sexp):
+    "`w>=7*1.57` -> ('w', '>=', 10.99)"
+    for op in OPERATORS:
+        attr, sep, rest = sexp.partition(op)
+        if sep and attr and attr[-1] not in "<>=!":
+            return attr, op, fold_constant(rest)
+    raise ValueError(f"invalid comparison: {sexp!r}")
+
+
+def scalar_term(sexp):
+    "(attr, op, value) of a term comparing one column, None for the others"
     if sexp[0] in "xyhw":
-        return lambda d: eval(f"d.{sexp}")
+        return split_comparison(sexp)
+    if sexp[0] == "@":
+        # region of the defect, precomputed by the table's region profile
+        return "region_id", "==", region_code(sexp[1:])
+    return None
+
+
+def sexp_parser(sexp):
+    if (term := scalar_term(sexp)) is not None:
+        attr, op, value = term
+        get, cmp = operator.attrgetter(attr), OPERATORS[op]
+        return lambda d: cmp(get(d), value)
     if sexp[0] == "-":
+        suffix = sexp[1:]
 
         def left_check(d):
-            fn = xymapping(d.x, d.y)
-            return any(
-                [fn(d_.x, d_.y) for d_ in d.lens.left if d_.name.endswith(sexp[1:])]
-            )
+            index = channel_index(d.lens, "left").endswith(suffix)
+            return index.any_point(*xywindow(d.x, d.y))
 
         return left_check
     if sexp[0] == "+":
+        suffix = sexp[1:]
 
         def right_check(d):
-            fn = xymapping(d.x, d.y)
-            return any(
-                [fn(d_.x, d_.y) for d_ in d.lens.right if d_.name.endswith(sexp[1:])]
-            )
+            index = channel_index(d.lens, "right").endswith(suffix)
+            return index.any_point(*xywindow(d.x, d.y))
 
         return right_check
 
     if sexp[0] == "W":
+        threshold = fold_constant(sexp[2:])
 
         def left_widht(d):
-            fn = xymapping(d.x, d.y)
-            mappings = [d_.width for d_ in d.lens.left if fn(d_.x, d_.y)]
-            for w in mappings:
-                if w > eval(sexp[2:]):
-                    return True
-            return False
+            index = channel_index(d.lens, "left")
+            return any(d_.width > threshold for d_ in index.points(*xywindow(d.x, d.y)))
 
         return left_widht
 
     if sexp[0] == "H":
+        threshold = fold_constant(sexp[2:])
 
         def left_height(d):
-            fn = xymapping(d.x, d.y)
-            mappings = [d_.height for d_ in d.lens.left if fn(d_.x, d_.y)]
-            for h in mappings:
-                if h > eval(sexp[2:]):
-                    return True
-            return False
+            index = channel_index(d.lens, "left")
+            return any(d_.height > threshold for d_ in index.points(*xywindow(d.x, d.y)))
 
         return left_height
 
     if sexp[0] == "L":
+        suffix = sexp[1:]
 
         def line_check(d):
-            fn = linemapping(d.x, d.y, d.x_, d.y_)
-            mappings = [d_.name for d_ in d.lens.left if fn(d_.x, d_.y, d_.x_, d_.y_)]
-            for name in mappings:
-                if name.endswith(sexp[1:]):
-                    return True
-            return False
+            index = channel_index(d.lens, "left").endswith(suffix)
+            return index.any_box(*linewindow(d.x, d.y, d.x_, d.y_))
 
         return line_check
 
+    raise ValueError(f"unknown rule term: {sexp!r}")
+
+
+# rough cost of a term relative to a column comparison, the correspondence
+# terms look up the other channel's index
+TERM_COSTS = {"-": 20, "+": 20, "L": 30, "W": 40, "H": 40}
+
+
+class Predicate:
+    """
+    One rule term, shared by every line of a Ruleset using the same text.
+    Counts its calls and passes, so lines can try the terms most likely
+    to reject a defect per unit of cost first.
+    """
+
+    __slots__ = ("sexp", "term", "kind", "cost", "fn", "calls", "passes")
+
+    def __init__(self, sexp) -> None:
+        self.sexp = sexp
+        self.term = scalar_term(sexp)
+        # "scalar" for column and region terms, else the leading -, +, W, H or L
+        self.kind = "scalar" if self.term is not None else sexp[0]
+        self.cost = 1 if self.term is not None else TERM_COSTS.get(sexp[0], 20)
+        self.fn = sexp_parser(sexp)
+        self.calls = 0
+        self.passes = 0
 
-def line_parser(line):
+    def __call__(self, defect) -> bool:
+        result = bool(self.fn(defect))
+        self.calls += 1
+        self.passes += result
+        return result
+
+    def rank(self) -> float:
+        "expected cost per rejected defect, lower runs first"
+        pass_rate = (self.passes + 1) / (self.calls + 2)
+        return self.cost / max(1 - pass_rate, 1e-3)
+
+
+def line_parser(line, predicates=None):
+    """
+    (key, handler) of a rule line. predicates interns terms by text, so
+    lines parsed with the same dict share their Predicates.
+    """
     key, *sexps = line.split()
+    if predicates is None:
+        predicates = {}
+    terms = []
+    for s in sexps:
+        if (p := predicates.get(s)) is None:
+            p = predicates[s] = Predicate(s)
+        terms.append(p)
+    message = f"{sexps}"
 
     class LineHandler(AbstractHandler):
-        def handle(self, defect):
-            if all(map(lambda f: f(defect), map(sexp_parser, sexps))):
-                return f"{sexps}"
-            return super().handle(defect)
+        # LineStats while a RuleProfile is attached
+        stats = None
+
+        def __init__(self):
+            self.message = message
+            # in evaluation order, see reorder()
+            self.predicates = list(terms)
+            # scalar terms as (attr, op, value) and the remaining predicates,
+            # used by Ruleset.evaluate_batch to build masks over columns
+            self.scalars = [p.term for p in terms if p.term is not None]
+            self.others = [p for p in terms if p.term is None]
+
+        def reorder(self):
+            self.predicates.sort(key=Predicate.rank)
+            self.others.sort(key=Predicate.rank)
+
+        def handle(self, defect, memo=None):
+            # memo holds the results of terms already tried by earlier lines
+            if memo is None:
+                memo = {}
+            # timed only while a RuleProfile is attached
+            if (stats := self.stats) is not None:
+                start = perf_counter()
+                stats.evaluated += 1
+            for predicate in self.predicates:
+                if (result := memo.get(predicate)) is None:
+                    t = perf_counter() if stats is not None else None
+                    result = memo[predicate] = predicate(defect)
+                    if t is not None:
+                        stats.add(predicate.kind, 1, perf_counter() - t)
+                if not result:
+                    if stats is not None:
+                        stats.seconds += perf_counter() - start
+                    return super().handle(defect, memo)
+            if stats is not None:
+                stats.matched += 1
+                stats.seconds += perf_counter() - start
+            return message
+
+        def profile(self, stats):
+            "record into stats from now on"
+            self.stats = stats
 
     return key, LineHandler()
 
@@ -172,6 +298,7 @@ class DefaultFactory:
     def __init__(self):
         self.head = AbstractHandler()
         self.next = None
+        self.handlers = []
 
     def add(self, handler):
         if self.next:
@@ -179,20 +306,351 @@ class DefaultFactory:
         else:
             self.head.set_next(handler)
         self.next = handler
+        self.handlers.append(handler)
 
     def handle(self, defect):
-        return self.head.handle(defect)
+        return self.head.handle(defect, {})
+
+    def reorder(self):
+        for handler in self.handlers:
+            handler.reorder()
 
 
 class Ruleset:
+    # defects evaluated one by one between reorderings of the terms
+    REORDER_EVERY = 1024
+
     def __init__(self, rule_text):
         self.rules = defaultdict(DefaultFactory)
+        # rule lines of every name, whitespace normalized, in order
+        self.lines = defaultdict(list)
+        self.predicates = {}
+        self._calls = 0
         self._parse(rule_text)
 
     def _parse(self, rule_text):
         for line in [l for l in rule_text.splitlines() if l.strip()]:
-            key, handler = line_parser(line)
+            key, handler = line_parser(line, self.predicates)
             self.rules[key].add(handler)
+            self.lines[key].append(" ".join(line.split()))
+
+    def rule_key(self, name) -> tuple:
+        "what the result of a defect named name depends on in this ruleset"
+        return tuple(self.lines.get(name, ()))
 
     def __call__(self, defect):
+        self._calls += 1
+        if self._calls % self.REORDER_EVERY == 0:
+            self.reorder()
         return self.rules[defect.name].handle(defect)
+
+    def reorder(self):
+        "order the terms of every line by measured pass rate and cost"
+        for factory in self.rules.values():
+            factory.reorder()
+
+    def evaluate_batch(self, defects):
+        """
+        Evaluate every defect at once, same results as calling the ruleset
+        on each defect. Defects are grouped by name, scalar terms become
+        boolean masks over x/y/w/h and region columns (read from the
+        DefectTable when the defects are table views), and only the rows
+        still alive after them run the left/right correspondence predicates,
+        cheapest per rejection first. Masks and correspondence results are
+        shared by all lines of a name.
+        """
+        results = [None] * len(defects)
+        groups = defaultdict(list)
+        for i, d in enumerate(defects):
+            groups[d.name].append(i)
+        for name, rows in groups.items():
+            factory = self.rules.get(name)
+            if factory is None:
+                continue
+            group = [defects[i] for i in rows]
+            table, group_rows = table_rows(group)
+            columns, masks, known = {}, {}, {}
+            pending = np.ones(len(group), dtype=bool)
+            for handler in factory.handlers:
+                if (stats := handler.stats) is not None:
+                    start = perf_counter()
+                    stats.evaluated += int(pending.sum())
+                mask = pending.copy()
+                for term in handler.scalars:
+                    if (term_mask := masks.get(term)) is None:
+                        if stats is not None:
+                            stats.calls["scalar"] += len(group)
+                        attr, op, value = term
+                        if attr not in columns and table is not None:
+                            columns[attr] = table.column(attr, group_rows)
+                        elif attr not in columns:
+                            columns[attr] = np.fromiter(
+                                (getattr(d, attr) for d in group), float, len(group)
+                            )
+                        term_mask = masks[term] = OPERATORS[op](columns[attr], value)
+                    mask &= term_mask
+                if stats is not None:
+                    stats.times["scalar"] += perf_counter() - start
+                handler.reorder()
+                for p in handler.others:
+                    alive = np.flatnonzero(mask)
+                    if not len(alive):
+                        break
+                    # 1 passed, 0 failed, -1 not evaluated yet for this name
+                    if (state := known.get(p)) is None:
+                        state = known[p] = np.full(len(group), -1, dtype=np.int8)
+                    todo = alive[state[alive] < 0]
+                    t = perf_counter() if stats is not None else None
+                    for j in todo:
+                        state[j] = p(group[j])
+                    if t is not None:
+                        stats.add(p.kind, len(todo), perf_counter() - t)
+                    mask[alive] = state[alive] == 1
+                matched = np.flatnonzero(mask)
+                for j in matched:
+                    results[rows[j]] = handler.message
+                if stats is not None:
+                    stats.matched += len(matched)
+                    stats.seconds += perf_counter() - start
+                pending &= ~mask
+                if not pending.any():
+                    break
+        return results
+
+
+TERM_KINDS = ("scalar", "-", "+", "W", "H", "L")
+
+
+class LineStats:
+    "evaluations, matches and time of one rule line, the time also per term kind"
+
+    __slots__ = ("label", "name", "index", "line", "evaluated", "matched", "seconds", "calls", "times")
+
+    def __init__(self, label, name, index, line) -> None:
+        self.label = label
+        self.name = name
+        self.index = index
+        self.line = line
+        self.evaluated = 0
+        self.matched = 0
+        self.seconds = 0.0
+        self.calls = dict.fromkeys(TERM_KINDS, 0)
+        self.times = dict.fromkeys(TERM_KINDS, 0.0)
+
+    def add(self, kind, calls, seconds) -> None:
+        self.calls[kind] += calls
+        self.times[kind] += seconds
+
+
+class RuleProfile:
+    """
+    Opt-in profile of rule runs: per line evaluation and match counts and
+    time, split by term kind. attach() gives the lines of a ruleset their
+    LineStats, lines without one skip the timing.
+    """
+
+    HEADER = (
+        ["ruleset", "name", "line", "rule", "evaluated", "matched", "ms"]
+        + [f"{kind} {unit}" for kind in TERM_KINDS for unit in ("calls", "ms")]
+    )
+
+    def __init__(self) -> None:
+        self.lines = []
+
+    def attach(self, ruleset, label="rule"):
+        for name, factory in ruleset.rules.items():
+            for i, (handler, line) in enumerate(zip(factory.handlers, ruleset.lines[name]), 1):
+                stats = LineStats(label, name, i, line)
+                handler.profile(stats)
+                self.lines.append(stats)
+        return ruleset
+
+    def rows(self):
+        "one row per line matching HEADER, slowest first"
+        rows = []
+        for s in sorted(self.lines, key=lambda s: -s.seconds):
+            row = [s.label, s.name, s.index, s.line, s.evaluated, s.matched, round(s.seconds * 1000, 3)]
+            for kind in TERM_KINDS:
+                row += [s.calls[kind], round(s.times[kind] * 1000, 3)]
+            rows.append(row)
+        return rows
+
+    def to_csv(self, path) -> int:
+        "write rows() as csv, returns the number of lines"
+        rows = self.rows()
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.HEADER)
+            writer.writerows(rows)
+        return len(rows)
+
+
+class LensResult:
+    __slots__ = ("version", "generation", "messages", "failed", "names")
+
+    def __init__(self, lens, generation) -> None:
+        self.version = lens.version
+        self.generation = generation
+        self.messages = [None] * len(lens.defects)
+        self.failed = []
+        self.names = None
+
+    def positions(self, lens) -> dict:
+        "name -> positions in lens.defects, built when rules first change"
+        if self.names is None:
+            self.names = defaultdict(list)
+            for i, d in enumerate(lens.defects):
+                self.names[d.name].append(i)
+        return self.names
+
+
+class RuleCache:
+    """
+    Rule messages of one ruleset slot (the rules, or the uncertain rules)
+    per lens, kept between runs. A lens is evaluated again when its
+    version changed since, and otherwise only its defects whose names
+    got different rule lines. When only later lines of a name changed,
+    defects matched by an unchanged earlier line keep their message and
+    the rest run just the changed lines. Lenses are held weakly, a
+    closed batch drops its results.
+    """
+
+    def __init__(self) -> None:
+        self.generation = 0
+        self.rule_keys = {}
+        # name -> generation its rule lines last changed in, and how many
+        # of its leading lines that change kept
+        self.changed = {}
+        self.prefix = {}
+        # (generation, _suffix result), parsed once for every chunk of a run
+        self._suffix_of = None
+        self._lenses = weakref.WeakKeyDictionary()
+
+    def update_rules(self, ruleset) -> None:
+        keys = {name: ruleset.rule_key(name) for name in ruleset.lines}
+        names = keys.keys() | self.rule_keys.keys()
+        names = {n for n in names if keys.get(n) != self.rule_keys.get(n)}
+        if names:
+            self.generation += 1
+        for n in names:
+            old, new = self.rule_keys.get(n, ()), keys.get(n, ())
+            self.changed[n] = self.generation
+            self.prefix[n] = next(
+                (i for i, (a, b) in enumerate(zip(old, new)) if a != b), min(len(old), len(new))
+            )
+        self.rule_keys = keys
+
+    def _suffix(self, ruleset, names):
+        "(ruleset of the changed lines of names, {name: messages of its kept lines})"
+        if self._suffix_of is not None and self._suffix_of[0] == self.generation:
+            return self._suffix_of[1]
+        text = "\n".join(chain(*[ruleset.lines[n][self.prefix[n] :] for n in names]))
+        # per name, another name may keep a line of the same text
+        kept = {
+            n: {h.message for h in ruleset.rules[n].handlers[: self.prefix[n]]} for n in names
+        }
+        self._suffix_of = (self.generation, (Ruleset(text), kept))
+        return self._suffix_of[1]
+
+    def failures(self, ruleset, lenses):
+        "[(defect, message), ...] of every lens, evaluating only what is stale"
+        self.update_rules(ruleset)
+        todo, slots, touched = [], [], {}
+        # defects behind by the last change only, of names that kept lines
+        partial, partial_slots = [], []
+        kept_names = {
+            n for n, g in self.changed.items() if g == self.generation and self.prefix[n]
+        }
+        suffix, kept = self._suffix(ruleset, kept_names) if kept_names else (None, {})
+        entries = []
+        for lens in lenses:
+            entry = self._lenses.get(lens)
+            if entry is None or entry.version != lens.version:
+                entry = self._lenses[lens] = LensResult(lens, self.generation)
+                todo += lens.defects
+                slots += [(entry, i, lens) for i in range(len(lens.defects))]
+                touched[entry] = lens
+            elif entry.generation != self.generation:
+                one_behind = entry.generation == self.generation - 1
+                for name, positions in entry.positions(lens).items():
+                    if self.changed.get(name, 0) <= entry.generation:
+                        continue
+                    if one_behind and name in kept_names:
+                        for i in positions:
+                            if entry.messages[i] not in kept[name]:
+                                partial.append(lens.defects[i])
+                                partial_slots.append((entry, i, lens))
+                        continue
+                    for i in positions:
+                        todo.append(lens.defects[i])
+                        slots.append((entry, i, lens))
+                entry.generation = self.generation
+            entries.append(entry)
+        results = chain(
+            zip(slots, ruleset.evaluate_batch(todo)),
+            zip(partial_slots, suffix.evaluate_batch(partial) if partial else ()),
+        )
+        for (entry, i, lens), msg in results:
+            if entry.messages[i] != msg:
+                entry.messages[i] = msg
+                touched[entry] = lens
+        for entry, lens in touched.items():
+            entry.failed = [
+                (d, msg) for d, msg in zip(lens.defects, entry.messages) if msg is not None
+            ]
+        return [entry.failed for entry in entries]
+
+
+def failures(ruleset, lenses, cache=None):
+    "[(defect, message), ...] of every lens, from cache when given"
+    if cache is not None:
+        return cache.failures(ruleset, lenses)
+    msgs = iter(ruleset.evaluate_batch(list(chain(*[l.defects for l in lenses]))))
+    return [[(d, msg) for d in l.defects if (msg := next(msgs)) is not None] for l in lenses]
+
+
+FAIL, UNCERTAIN, PASS = "不合格", "不确定", "合格"
+# lenses per chunk of classify_chunks, small enough for a window to show
+# results early
+CHUNK_LENSES = 64
+
+
+def classify_lenses(lenses, ruleset, un_ruleset=None, cache=None, un_cache=None):
+    """
+    [(lens, verdict, [(defect, message), ...])] in lens order: FAIL with the
+    defects failing ruleset, else UNCERTAIN with those failing un_ruleset,
+    else PASS. Each ruleset runs once over all the lenses it applies to;
+    with RuleCaches, only over what changed since the last call.
+    """
+    results, good = [], []
+    for l, failed in zip(lenses, failures(ruleset, lenses, cache)):
+        if not failed:
+            good.append(len(results))
+        results.append((l, FAIL if failed else PASS, failed))
+    if un_ruleset is None or not good:
+        return results
+    good_lenses = [results[i][0] for i in good]
+    for i, un_failed in zip(good, failures(un_ruleset, good_lenses, un_cache)):
+        if un_failed:
+            results[i] = (results[i][0], UNCERTAIN, un_failed)
+    return results
+
+
+def classify_chunks(
+    lenses, ruleset, un_ruleset=None, cache=None, un_cache=None,
+    chunk_size=CHUNK_LENSES, emit=None, cancelled=None,
+):
+    """
+    classify_lenses over chunk_size lenses at a time, handing each chunk's
+    results to emit(done, total, results). Returns the number of lenses,
+    or None when cancelled() turned true between chunks.
+    """
+    total = len(lenses)
+    for start in range(0, total, chunk_size):
+        if cancelled is not None and cancelled():
+            return None
+        chunk = lenses[start : start + chunk_size]
+        results = classify_lenses(chunk, ruleset, un_ruleset, cache, un_cache)
+        if emit is not None:
+            emit(start + len(chunk), total, results)
+    return total
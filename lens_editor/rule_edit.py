@@ -1,15 +1,23 @@
 import shutil
+import threading
+import time
+from collections import deque
+from functools import partial
 from pathlib import Path
 
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer
 from PySide6.QtWidgets import (QFileDialog, QGraphicsLinearLayout,
                                QGraphicsSimpleTextItem, QGraphicsWidget,
-                               QHBoxLayout, QPushButton, QTextEdit,
+                               QHBoxLayout, QProgressBar, QPushButton,
+                               QTableWidget, QTableWidgetItem, QTextEdit,
                                QVBoxLayout, QWidget)
 
+from . import perf
 from .config import Config
 from .defect import DefectItem, DefectLayoutItem
-from .rule import Ruleset
+from .rule import (FAIL, PASS, UNCERTAIN, RuleCache, RuleProfile, Ruleset,
+                   classify_chunks)
+from .thread import Worker
 
 import logging
 import sys
@@ -20,6 +28,33 @@ level = logging.ERROR if sys.argv[-1] != "-d" else logging.INFO
 logging.basicConfig(level=level, format="%(levelname)s:%(message)s")
 logger = logging.getLogger(__name__)
 
+# one Run evaluates at a time, the rule caches are not thread safe
+RUN_LOCK = threading.Lock()
+# seconds of widget building per event loop turn
+BUILD_BUDGET = 0.03
+
+
+def run_rules(lenses, ruleset, un_ruleset, cache, un_cache, emit, cancelled):
+    """
+    classify_chunks on a pool thread, once a cancelled Run let go of the
+    caches. The thumbnails of the lenses to show are cut here too, so the
+    window only wraps them in items.
+    """
+
+    def emit_shown(done, total, results):
+        for _, verdict, failed in results:
+            if verdict == PASS:
+                continue
+            if cancelled():
+                return
+            for d, _ in failed:
+                d.thumbnail
+        emit(done, total, results)
+
+    with RUN_LOCK, perf.span("rule.classify"):
+        return classify_chunks(
+            lenses, ruleset, un_ruleset, cache, un_cache, emit=emit_shown, cancelled=cancelled
+        )
 
 
 class FilePathItem(QGraphicsSimpleTextItem):
@@ -86,6 +121,21 @@ class RuleEditWindow(QWidget):
         self.add_btn = QPushButton("Uncretain")
         self.add_btn.clicked.connect(self.add_uncretain)
         btn_layout.addWidget(self.add_btn)
+        self.profile_btn = QPushButton("Profile")
+        self.profile_btn.setCheckable(True)
+        btn_layout.addWidget(self.profile_btn)
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_rule)
+        btn_layout.addWidget(self.cancel_btn)
+        self.progress = QProgressBar()
+        self.progress.setVisible(False)
+        layout.addWidget(self.progress)
+        self.job = None
+        self.pending = deque()
+        self.build_timer = QTimer(self)
+        self.build_timer.setInterval(0)
+        self.build_timer.timeout.connect(self.build_widgets)
         self.cfg = Config()
         self.init_rule_text()
 
@@ -252,43 +302,118 @@ class RuleEditWindow(QWidget):
                 i.updateGeometry()
 
     def run_rule(self):
+        # clear_scene below cancels the previous Run
+        un_ruleset = None
         if hasattr(self.main_window, "un_rule_set_str"):
             self.main_window.un_rule_set_str = self.uncretain.un_text_edit.toPlainText()
             un_ruleset = Ruleset(self.main_window.un_rule_set_str)
         self.main_window.rule_set_str = self.text_edit.toPlainText()
         ruleset = Ruleset(self.main_window.rule_set_str)
-        self.main_window.scene.clear()
+        self.run_span = perf.span("rule.run").start()
+        self.main_window.clear_scene()
         g_layout = QGraphicsLinearLayout(Qt.Vertical)
         g_widget = QGraphicsWidget()
         g_widget.setLayout(g_layout)
-        a = 0
-        good = []
-        li = []
-        helist = []
-        for l in self.main_window.lens:
-            failed = [(d, msg) for d in l.defects if (msg := ruleset(d)) is not None]
-            if failed:
-                g_layout.addItem(LensWidget(l.xml_path, failed, Qt.red))
-                li.append(int(l.xml_path.stem))
-                a += 1
-            else:
-                good.append(l)
-        logger.info(f"不合格=={a}")
-        logger.info(sorted(li))
-        b = 0
-        for g in good:
-            un_failed = [
-                (d, msg) for d in g.defects if (msg := un_ruleset(d)) is not None
-            ]
-            if un_failed:
-                g_layout.addItem(LensWidget(g.xml_path, un_failed, Qt.green))
-                b += 1
-            else:
-                helist.append(int(g.xml_path.stem))
-        logger.info(f"不确定=={b}")
-        logger.info(f"合格=={len(helist)}")
-        logger.info(sorted(helist))
+        # failed lenses above the uncertain ones, each growing as chunks arrive
+        self.verdict_layouts = {}
+        for verdict, color in ((FAIL, Qt.red), (UNCERTAIN, Qt.green)):
+            v_layout = QGraphicsLinearLayout(Qt.Vertical)
+            g_layout.addItem(v_layout)
+            self.verdict_layouts[verdict] = (v_layout, color)
         self.main_window.scene.addItem(g_widget)
+        if not hasattr(self.main_window, "rule_caches"):
+            self.main_window.rule_caches = (RuleCache(), RuleCache())
+        caches = self.main_window.rule_caches
+        self.profile = None
+        if self.profile_btn.isChecked():
+            # every defect evaluated, cached results would hide lines
+            self.profile = RuleProfile()
+            self.profile.attach(ruleset, "rule")
+            if un_ruleset is not None:
+                self.profile.attach(un_ruleset, "uncertain")
+            caches = (None, None)
+        lenses = list(self.main_window.lens)
+        self.job = job = Worker(run_rules, lenses, ruleset, un_ruleset, *caches)
+        job.kwargs.update(emit=job.signals.chunk.emit, cancelled=job.is_cancelled)
+        job.signals.chunk.connect(partial(self.rule_chunk, job))
+        job.signals.error.connect(partial(self.rule_error, job))
+        job.signals.finished.connect(partial(self.rule_finished, job))
+        self.main_window.rule_job = job
+        self.worker_done = False
+        self.pending.clear()
+        self.results = []
+        self.progress.setRange(0, max(len(lenses), 1))
+        self.progress.setValue(0)
+        self.progress.setVisible(True)
+        self.cancel_btn.setEnabled(True)
+        self.main_window.thread_pool.start(job)
+
+    def cancel_rule(self):
+        if (job := self.main_window.rule_job) is not None:
+            job.cancel()
+
+    def _live(self, job) -> bool:
+        "job is this window's Run, still shown and not cancelled"
+        return job is self.job and job is self.main_window.rule_job and not job.is_cancelled()
+
+    def rule_chunk(self, job, done, total, results):
+        if not self._live(job):
+            return
+        self.pending.extend(results)
+        self.build_timer.start()
+
+    def build_widgets(self):
+        "add pending LensWidgets for BUILD_BUDGET seconds, then let the window repaint"
+        if not self._live(self.job):
+            self.pending.clear()
+        deadline = time.perf_counter() + BUILD_BUDGET
+        while self.pending and time.perf_counter() < deadline:
+            result = self.pending.popleft()
+            self.results.append(result)
+            l, verdict, failed = result
+            if verdict in self.verdict_layouts:
+                v_layout, color = self.verdict_layouts[verdict]
+                v_layout.addItem(LensWidget(l.xml_path, failed, color))
+        self.progress.setValue(len(self.results))
+        if not self.pending:
+            self.build_timer.stop()
+            if self.worker_done:
+                self.finish_run()
+
+    def rule_error(self, job, e):
+        if job is self.job:
+            self.main_window.status_bar.showMessage(f"Rule run failed: {e[1]}")
+
+    def rule_finished(self, job):
+        if job is not self.job:
+            return
+        self.worker_done = True
+        if not self.pending or not self._live(job):
+            self.pending.clear()
+            self.build_timer.stop()
+            self.finish_run()
+
+    def finish_run(self):
+        job = self.job
+        self.progress.setVisible(False)
+        self.cancel_btn.setEnabled(False)
+        if job is not self.main_window.rule_job:
+            # superseded, the scene was cleared under it
+            return
+        self.main_window.rule_job = None
+        if job.is_cancelled():
+            self.main_window.status_bar.showMessage(
+                f"Rule run cancelled after {len(self.results)} lenses"
+            )
+        for verdict in (FAIL, UNCERTAIN, PASS):
+            stems = sorted(int(l.xml_path.stem) for l, v, _ in self.results if v == verdict)
+            logger.info(f"{verdict}=={len(stems)}")
+            logger.info(stems)
+        self.run_span.stop()
+        self.main_window.show_timings()
+        if self.profile is not None:
+            self.profile_window = RuleProfileWindow(self.profile)
+            self.profile_window.show()
 
     def export_btn_clicked(self):
         path: str = QFileDialog.getExistingDirectory(self, "getExistingDirectory")
@@ -305,6 +430,37 @@ class RuleEditWindow(QWidget):
             shutil.copy(i, dir)
 
 
+class RuleProfileWindow(QWidget):
+    def __init__(self, profile, parent=None) -> None:
+        super().__init__(parent)
+        self.profile = profile
+        self.setWindowTitle("Rule profile")
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+        rows = profile.rows()
+        self.table = QTableWidget(len(rows), len(profile.HEADER))
+        self.table.setHorizontalHeaderLabels(profile.HEADER)
+        for r, row in enumerate(rows):
+            for c, value in enumerate(row):
+                item = QTableWidgetItem()
+                item.setData(Qt.DisplayRole, value)
+                self.table.setItem(r, c, item)
+        self.table.setSortingEnabled(True)
+        self.table.resizeColumnsToContents()
+        layout.addWidget(self.table)
+        self.export_btn = QPushButton("Export CSV")
+        self.export_btn.clicked.connect(self.export_csv)
+        layout.addWidget(self.export_btn)
+        self.resize(1000, 600)
+
+    def export_csv(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export profile", "rule_profile.csv", "CSV (*.csv)")
+        if not path:
+            return
+        n = self.profile.to_csv(path)
+        logger.info(f"exported {n} rule lines to {path}")
+
+
 class UncertainEditWindow(QWidget):
     def __init__(self, main_window, cfg, parent=None) -> None:
         super().__init__(parent)
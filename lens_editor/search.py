@@ -1,109 +1,194 @@
+import logging
+from collections import OrderedDict
+from fnmatch import fnmatchcase
 from typing import List
 
+import numpy as np
+
 from .defect import Defect
+from .query import compile_query
+from .region import RegionProfiles, region_code
+from .table import table_rows
+
+logger = logging.getLogger(__name__)
+
+
+class DefectIndex:
+    """
+    Indexes over one defect list for FilterParser: the positions of every
+    name, the x/y/w/h values sorted once for range terms, the region
+    labels of the table, and marks and modified flags read as bitsets.
+    Lookups return boolean masks over d_list, so a query is a handful of
+    mask operations.
+    """
+
+    def __init__(self, d_list: List[Defect]) -> None:
+        self.d_list = d_list
+        self.table, self.rows = table_rows(d_list)
+        if self.table is not None:
+            self.version = self.table.version
+            self.names = self.table.names
+            self.lenses = self.table.lenses
+            self.lens_id = self.table.column("lens_id", self.rows)
+            self._regions = {}
+            if self.table.profile is not None:
+                self._regions[self.table.profile] = self.table.column("region_id", self.rows)
+            name_id = self.table.column("name_id", self.rows)
+        else:
+            # plain objects, only for lists not backed by a DefectTable
+            self.version = None
+            self.names, name_id = _factorize([d.name for d in d_list])
+            self.lenses, self.lens_id = _factorize([d.lens for d in d_list], id)
+            self._regions = {}
+        order = np.argsort(name_id, kind="stable")
+        ids, starts = np.unique(name_id[order], return_index=True)
+        self._names = dict(zip(ids.tolist(), np.split(order, starts[1:])))
+        self._sorted = {}
+        for key in "xywh":
+            values = self._column(key)
+            order = np.argsort(values, kind="stable")
+            self._sorted[key] = (values[order], order)
+
+    def __len__(self):
+        return len(self.d_list)
+
+    def _column(self, key) -> np.ndarray:
+        if self.table is not None:
+            return self.table.column(key, self.rows)
+        return np.fromiter((getattr(d, key) for d in self.d_list), float, len(self))
+
+    def valid_for(self, d_list) -> bool:
+        return (
+            d_list is self.d_list
+            and self.table is not None
+            and self.table.version == self.version
+        )
+
+    def scatter(self, *parts) -> np.ndarray:
+        "mask of the positions in parts"
+        mask = np.zeros(len(self), dtype=bool)
+        for p in parts:
+            mask[p] = True
+        return mask
+
+    def name(self, pattern) -> np.ndarray:
+        "defects whose name matches pattern, a glob or a plain name"
+        ids = [i for i, n in enumerate(self.names) if fnmatchcase(n, pattern)]
+        return self.scatter(*(self._names[i] for i in ids if i in self._names))
+
+    def compare(self, key, op, value) -> np.ndarray:
+        values, order = self._sorted[key]
+        lo = np.searchsorted(values, value, side="left")
+        hi = np.searchsorted(values, value, side="right")
+        if op == ">":
+            return self.scatter(order[hi:])
+        if op == ">=":
+            return self.scatter(order[lo:])
+        if op == "<":
+            return self.scatter(order[:lo])
+        if op == "<=":
+            return self.scatter(order[:hi])
+        if op == "==":
+            return self.scatter(order[lo:hi])
+        return self.scatter(order[:lo], order[hi:])
+
+    def region(self, profile, letter) -> np.ndarray:
+        "defects in a region, other profiles than the table's are labelled once"
+        if (labels := self._regions.get(profile)) is None:
+            labels = self._regions[profile] = profile.label(self._column("x"))
+        return labels == region_code(letter)
+
+    def mark(self) -> np.ndarray:
+        if self.table is not None:
+            return self.table.column("mark", self.rows)
+        return np.fromiter((d.mark for d in self.d_list), bool, len(self))
+
+    def lens_where(self, predicate) -> np.ndarray:
+        "defects whose lens satisfies predicate, checked once per lens"
+        lenses = np.fromiter(map(predicate, self.lenses), bool, len(self.lenses))
+        return lenses[self.lens_id]
+
+    def select(self, mask) -> List[Defect]:
+        return list(map(self.d_list.__getitem__, np.flatnonzero(mask).tolist()))
+
+
+def _factorize(values, key=lambda v: v):
+    "(distinct values, code of every value)"
+    uniques, codes, ids = [], np.empty(len(values), dtype=np.intp), {}
+    for i, v in enumerate(values):
+        if (code := ids.get(key(v))) is None:
+            code = ids[key(v)] = len(uniques)
+            uniques.append(v)
+        codes[i] = code
+    return uniques, codes
 
 
 class FilterParser:
-    def __init__(self):
-        pass
+    """
+    Compiles search bar queries (see query.py) and runs them on a
+    DefectIndex. Compiled queries are cached by text and results by text
+    and data version, so switching between quick search slots only builds
+    the result list.
+    """
+
+    CACHE_SIZE = 32
+
+    def __init__(self, profiles=None):
+        self.profiles = profiles if profiles is not None else RegionProfiles()
+        self.index = None
+        self._queries = OrderedDict()
+        self._results = OrderedDict()
+        # why the last parse() query did not compile, None if it did
+        self.error = None
+
+    def build_index(self, d_list: List[Defect]) -> None:
+        "index d_list so parse() answers from lookups instead of scans"
+        self.index = DefectIndex(d_list)
+        self._results.clear()
+
+    def _index_for(self, d_list):
+        if self.index is None or self.index.d_list is not d_list:
+            return DefectIndex(d_list)
+        if not self.index.valid_for(d_list):
+            self.build_index(d_list)
+        return self.index
+
+    def compile(self, filter_str: str):
+        if (node := self._queries.get(filter_str)) is None:
+            node = compile_query(filter_str, self.profiles)
+            _remember(self._queries, filter_str, node, self.CACHE_SIZE)
+        return node
 
     def parse(self, filter_str: str, d_list: List[Defect]) -> List[Defect]:
-        new_list = []
-        if filter_str == "":
+        "defects of d_list matching filter_str, none if it does not compile (see error)"
+        self.error = None
+        if filter_str.strip() == "":
             return d_list
-        if filter_str not in ["72","70","75"]:
-            self.area = self.some("72")
-        else:
-            self.area = self.some(filter_str[:2])
-
-            
-
-        if filter_str == "A" or filter_str[2] == "A":
-            for i in d_list:
-                if (i.x>self.area[0] and i.x<self.area[1]) or (i.x>self.area[2] and i.x<self.area[3]):
-                    new_list.append(i)
-            return new_list
-        elif filter_str == "B" or filter_str[2] == "B":
-            for i in d_list:
-                if (i.x>self.area[4] and i.x<self.area[5]) or (i.x>self.area[6] and i.x<self.area[7]):
-                    new_list.append(i)
-            return new_list
-        elif filter_str == "C" or filter_str[2] == "C":
-            for i in d_list:
-                if (i.x>self.area[8] and i.x<self.area[9]) or (i.x>self.area[10] and i.x<self.area[11]):
-                    new_list.append(i)
-            return new_list
-        elif filter_str == "D" or filter_str[2] == "D":
-            for i in d_list:
-                if (i.x>self.area[12] and i.x<self.area[13]) or (i.x>self.area[14] and i.x<self.area[15] or (i.x>self.area[16] and i.x<self.area[17])) :
-                    new_list.append(i)
-            return new_list
-        for f in filter_str.split(" "):
-            d_list = self._parse_filter(f, d_list)
-        return d_list
-
-    def some(self,mm):
-        if mm =="70":
-            return [120,535,1330,1710,536,815,1711,1960,816,1060,1961,2185,0,119,1061,1329,2186,2400]
-        elif mm == "72":
-            return [120,535,1330,1710,536,815,1711,1960,816,1085,1961,2215,0,119,1086,1329,2216,2400]
-        elif mm == "75":
-            return [120,535,1330,1710,536,815,1711,1960,816,1135,1961,2240,0,119,1136,1329,2241,2400]
-
-    def _parse_filter(self, filter_cmd: str, d_list: List[Defect]) -> List[Defect]:
-        new_list = []
-        if "name=" in filter_cmd:
-            defect = filter_cmd.split("name=")[1]
-            if "-" in defect:
-                defect_name = defect.split("-")[0]
-                defect_area = defect.split("-")[1]
-                Subdivision_area = self.qy_choice(defect_area)
-                if defect_area == "D":
-                    for i in d_list:
-                        if i.name == defect_name and ((i.x>Subdivision_area[0] and i.x<Subdivision_area[1]) or (i.x>Subdivision_area[2] and i.x<Subdivision_area[3]) or (i.x>Subdivision_area[4] and i.x<Subdivision_area[5]) ):
-                            new_list.append(i)
-                    return new_list
-                else:
-                    for i in d_list:
-                        if i.name == defect_name and ((i.x>Subdivision_area[0] and i.x<Subdivision_area[1]) or (i.x>Subdivision_area[2] and i.x<Subdivision_area[3])):
-                            new_list.append(i)
-                    return new_list
-
-            else:
-                defect_name = defect
-                for i in d_list:
-                    if i.name == defect_name:
-                        new_list.append(i)
-                return new_list
-            
-        if filter_cmd.startswith("-mark"):
-            return list(filter(lambda d: not d.mark, d_list))
-        if filter_cmd.startswith("mark"):
-            return list(filter(lambda d: d.mark, d_list))
-        if filter_cmd.startswith("mod"):
-            return list(filter(lambda d: d.lens.modified, d_list))
-        if filter_cmd.startswith("-mod"):
-            return list(filter(lambda d: not d.lens.modified, d_list))
-        if filter_cmd.startswith("fn"):
-            xml = filter_cmd[3:]
-            return list(filter(lambda d: xml in str(d.lens.xml_path), d_list))
-        # if filter_cmd.startswith("name="):
-        #     names = filter_cmd[5:].split("+")
-        #     return list(filter(lambda d: d.name in names, d_list))
-        if (f := filter_cmd[0]) in "xyhw" and filter_cmd[1] in "=<>":
-            f_func = eval(f"lambda d: d.{f} {filter_cmd[1]} {filter_cmd[2:]}")
-            return list(filter(f_func, d_list))
-        return d_list
-
-    def qy_choice(self,area):
-        if area == "A":
-            return self.area[0:4]
-        elif area =="B":
-            return self.area[4:8]
-        elif area=="C":
-            return self.area[8:12]
-        elif area == "D":
-            return self.area[12:]
+        try:
+            node = self.compile(filter_str)
+        except ValueError as e:
+            logger.error(e)
+            self.error = str(e)
+            return []
+        index = self._index_for(d_list)
+        if index is not self.index:
+            return index.select(node.mask(index))
+        key = (filter_str, index.version, index.table.state_version)
+        if (mask := self._results.get(key)) is None:
+            mask = _remember(self._results, key, node.mask(index), self.CACHE_SIZE)
+        return index.select(mask)
+
+    def to_sql(self, filter_str: str):
+        "WHERE clause and parameters keeping what parse() keeps, for Catalog.search"
+        return self.compile(filter_str).sql()
+
+
+def _remember(cache: OrderedDict, key, value, size):
+    cache[key] = value
+    if len(cache) > size:
+        cache.popitem(last=False)
+    return value
+
 
 class QuickSearchSlot:
     def __init__(self):
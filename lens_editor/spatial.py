@@ -0,0 +1,72 @@
+from bisect import bisect_left, bisect_right
+
+
+class ChannelIndex:
+    """
+    Sorted-x bucket over the defects of one channel, so the left/right
+    correspondence window only visits defects whose x falls inside it.
+    Query results keep the original channel order.
+    """
+
+    def __init__(self, defects):
+        self.defects = list(defects)
+        order = sorted(range(len(self.defects)), key=lambda i: self.defects[i].x)
+        self._order = order
+        self._xs = [self.defects[i].x for i in order]
+        self._slack = None
+        self._suffixes = {}
+
+    def __len__(self):
+        return len(self.defects)
+
+    def endswith(self, suffix):
+        "sub-index of the defects whose name ends with suffix"
+        if not suffix:
+            return self
+        if (index := self._suffixes.get(suffix)) is None:
+            index = ChannelIndex(d for d in self.defects if d.name.endswith(suffix))
+            self._suffixes[suffix] = index
+        return index
+
+    def _candidates(self, xmin, xmax):
+        lo = bisect_left(self._xs, xmin)
+        hi = bisect_right(self._xs, xmax)
+        return self._order[lo:hi]
+
+    def points(self, xmin, xmax, ymin, ymax):
+        "defects whose (x, y) lies inside the window, as xymapping"
+        found = [
+            i
+            for i in self._candidates(xmin, xmax)
+            if ymin <= self.defects[i].y <= ymax
+        ]
+        return [self.defects[i] for i in sorted(found)]
+
+    def boxes(self, xmin, xmax, ymin, ymax):
+        "defects whose bbox lies inside the window, as linemapping"
+        if self._slack is None:
+            # x <= x_ for any sane bbox, widen the x range if some are inverted
+            self._slack = max([d.x - d.x_ for d in self.defects] + [0])
+        found = []
+        for i in self._candidates(xmin, xmax + self._slack):
+            d = self.defects[i]
+            if d.x_ <= xmax and d.y >= ymin and d.y_ <= ymax:
+                found.append(i)
+        return [self.defects[i] for i in sorted(found)]
+
+    def any_point(self, xmin, xmax, ymin, ymax):
+        for i in self._candidates(xmin, xmax):
+            if ymin <= self.defects[i].y <= ymax:
+                return True
+        return False
+
+    def any_box(self, xmin, xmax, ymin, ymax):
+        return len(self.boxes(xmin, xmax, ymin, ymax)) > 0
+
+
+def channel_index(lens, side):
+    "index built by Lens.leftandright, or a throwaway one for lens-like objects"
+    index = getattr(lens, f"{side}_index", None)
+    if index is None:
+        index = ChannelIndex(getattr(lens, side))
+    return index
@@ -0,0 +1,134 @@
+import threading
+from array import array
+
+import numpy as np
+
+# column aliases used by Defect, the rules and the filters
+_ALIASES = {
+    "x": "xmin",
+    "y": "ymin",
+    "x_": "xmax",
+    "y_": "ymax",
+    "w": "width",
+    "h": "height",
+}
+
+
+class DefectTable:
+    """
+    Columnar storage for every defect of a batch. Bounding boxes, interned
+    name ids and lens ids live in contiguous int32 arrays and marks in a
+    byte map, one row per defect; `Defect` is a view over a row. Once a
+    region profile is set, region_id holds the region of every row.
+    `version` counts changes to rows, boxes and names, so indexes built on
+    the columns know when they are stale. `state_version` counts mark and
+    lens modified flag changes, which indexes read live.
+    """
+
+    def __init__(self):
+        self.xmin = array("i")
+        self.ymin = array("i")
+        self.xmax = array("i")
+        self.ymax = array("i")
+        self.name_id = array("i")
+        self.lens_id = array("i")
+        self.mark = bytearray()
+        self.region_id = array("b")
+        self.profile = None
+        self.names = []
+        self.lenses = []
+        self._name_ids = {}
+        self._lock = threading.Lock()
+        self.version = 0
+        self.state_version = 0
+
+    def __len__(self):
+        return len(self.xmin)
+
+    def intern(self, name) -> int:
+        if (name_id := self._name_ids.get(name)) is None:
+            name_id = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def lookup(self, name) -> int:
+        "name id, -1 for a name not in the table"
+        return self._name_ids.get(name, -1)
+
+    def extend(self, lens, records) -> range:
+        "append (name, xmin, ymin, xmax, ymax) records of one lens, return its rows"
+        with self._lock:
+            lens_id = len(self.lenses)
+            self.lenses.append(lens)
+            start = len(self)
+            for name, xmin, ymin, xmax, ymax in records:
+                self.xmin.append(xmin)
+                self.ymin.append(ymin)
+                self.xmax.append(xmax)
+                self.ymax.append(ymax)
+                self.name_id.append(self.intern(name))
+                self.lens_id.append(lens_id)
+                self.mark.append(0)
+                self.region_id.append(self.profile.code(xmin) if self.profile else -1)
+            self.version += 1
+            return range(start, len(self))
+
+    def set(self, key, row, value) -> None:
+        with self._lock:
+            getattr(self, key)[row] = value
+            if key == "xmin" and self.profile is not None:
+                self.region_id[row] = self.profile.code(value)
+            if key != "mark":
+                self.version += 1
+            else:
+                self.state_version += 1
+
+    def touch(self) -> None:
+        "note a state change outside the columns, like a lens modified flag"
+        with self._lock:
+            self.state_version += 1
+
+    def label_regions(self, profile) -> None:
+        "label every row, and the rows added later, with a RegionProfile"
+        with self._lock:
+            self.profile = profile
+            xmin = np.frombuffer(self.xmin, dtype=np.int32)
+            self.region_id = array("b", profile.label(xmin).tobytes())
+            self.version += 1
+
+    def column(self, key, rows=None) -> np.ndarray:
+        "numpy copy of a column (or an alias like x, w, height), optionally gathered at rows"
+        key = _ALIASES.get(key, key)
+        if key == "width":
+            return self.column("xmax", rows) - self.column("xmin", rows)
+        if key == "height":
+            return self.column("ymax", rows) - self.column("ymin", rows)
+        with self._lock:
+            if key == "mark":
+                values = np.frombuffer(self.mark, dtype=np.uint8).view(bool)
+            else:
+                values = getattr(self, key)
+                values = np.frombuffer(values, dtype=values.typecode)
+            # never hand out views, the arrays must stay resizable
+            return values.copy() if rows is None else values[rows]
+
+    def name_rank(self) -> np.ndarray:
+        "position of every name id in sorted name order"
+        rank = np.empty(len(self.names), dtype=np.int32)
+        rank[sorted(range(len(self.names)), key=self.names.__getitem__)] = np.arange(
+            len(self.names)
+        )
+        return rank
+
+
+def table_rows(defects):
+    "(table, rows) when all defects are views over one DefectTable, else (None, None)"
+    table = getattr(defects[0], "table", None) if defects else None
+    if not isinstance(table, DefectTable):
+        return None, None
+    rows = np.empty(len(defects), dtype=np.intp)
+    for i, d in enumerate(defects):
+        if d.table is not table:
+            return None, None
+        rows[i] = d.row
+    return table, rows
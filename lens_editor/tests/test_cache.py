@@ -0,0 +1,54 @@
+import numpy as np
+from pytest import fixture
+
+from ..cache import LRUCache
+from ..thumbstore import ThumbnailStore, root_thumbnails
+
+
+def test_lru_evicts_least_recent():
+    cache = LRUCache(300)
+    for key in "abc":
+        cache.put(key, np.zeros(100, dtype=np.uint8))
+    cache.get("a")
+    cache.put("d", np.zeros(100, dtype=np.uint8))
+    assert "b" not in cache
+    assert all(k in cache for k in "acd")
+    assert cache.nbytes == 300
+
+
+def test_lru_skips_oversized():
+    cache = LRUCache(10)
+    value = cache.put("a", np.zeros(11, dtype=np.uint8))
+    assert value.size == 11
+    assert len(cache) == 0
+
+
+@fixture
+def store(tmp_path):
+    root_thumbnails(tmp_path / "cache", 4000)
+    yield ThumbnailStore._instance
+    ThumbnailStore._instance = None
+
+
+def test_thumbnail_store_roundtrip(store, tmp_path):
+    thumb = np.random.RandomState(0).randint(0, 255, (20, 50, 3), dtype=np.uint8)
+    key = ThumbnailStore.key("a.jpeg", 1, (0, 0, 10, 4), 50)
+    store.put(key, thumb)
+    assert (store.get(key) == thumb).all()
+    assert store.get(ThumbnailStore.key("a.jpeg", 2, (0, 0, 10, 4), 50)) is None
+    # a reopened folder hands the same thumbnails again, the pack must not grow
+    nbytes = store.nbytes
+    store.put(key, thumb)
+    assert store.nbytes == nbytes
+    store.flush()
+    root_thumbnails(tmp_path / "cache", 4000)
+    assert (ThumbnailStore._instance.get(key) == thumb).all()
+
+
+def test_thumbnail_store_compacts(store):
+    rnd = np.random.RandomState(0)
+    for i in range(30):
+        store.put(str(i), rnd.randint(0, 255, (8, 10, 3), dtype=np.uint8))
+    assert store.nbytes <= 4000
+    assert "29" in store.index and "0" not in store.index
+    assert store.get("29").shape == (8, 10, 3)
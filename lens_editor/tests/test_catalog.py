@@ -0,0 +1,57 @@
+import os
+
+import pytest
+from pytest import fixture
+
+from ..catalog import Catalog
+
+XML = "<annotation>{}</annotation>"
+OBJ = (
+    "<object><name>{}</name><bndbox><xmin>{}</xmin><ymin>{}</ymin>"
+    "<xmax>{}</xmax><ymax>{}</ymax></bndbox></object>"
+)
+
+
+def write(path, *objects):
+    path.write_text(XML.format("".join(OBJ.format(*o) for o in objects)))
+
+
+@fixture
+def archive(tmp_path):
+    root = tmp_path / "xml"
+    root.mkdir()
+    write(root / "1.xml", ("0101", 1400, 10, 1410, 30), ("0002", 100, 10, 120, 12))
+    write(root / "2.xml", ("0101", 1800, 10, 1830, 20))
+    return root
+
+
+def test_lookup_only_unchanged(archive, tmp_path):
+    catalog = Catalog(tmp_path / "catalog.sqlite")
+    catalog.scan(archive)
+    assert catalog.lookup(archive / "2.xml") == [("0101", 1800, 10, 1830, 20)]
+    write(archive / "2.xml", ("0102", 1, 2, 3, 4), ("0102", 1, 2, 3, 5))
+    os.utime(archive / "2.xml", ns=(0, 1))
+    assert catalog.lookup(archive / "2.xml") is None
+    catalog.scan(archive)
+    assert len(catalog.lookup(archive / "2.xml")) == 2
+
+
+def test_prune(archive, tmp_path):
+    catalog = Catalog(tmp_path / "catalog.sqlite")
+    catalog.scan(archive)
+    (archive / "1.xml").unlink()
+    catalog.scan(archive)
+    assert [r[0] for r in catalog.search("", archive)] == [str(archive / "2.xml")]
+
+
+def test_search(archive, tmp_path):
+    catalog = Catalog(tmp_path / "catalog.sqlite")
+    catalog.scan(archive)
+    names = lambda q: [(r[2], r[3]) for r in catalog.search(q, archive)]
+    assert names("name=0101") == [("0101", 1400), ("0101", 1800)]
+    assert names("name=0101-B") == [("0101", 1800)]
+    assert names("A") == [("0101", 1400)]
+    assert names("w>15 fn=2.xml") == [("0101", 1800)]
+    assert names("fn=1.xml h<=2") == [("0002", 100)]
+    with pytest.raises(ValueError):
+        catalog.search("mark")
@@ -0,0 +1,75 @@
+import csv
+import json
+
+from pytest import fixture
+
+from ..cli import main
+from ..config import Config
+from .test_catalog import write
+
+
+@fixture(autouse=True)
+def home(tmp_path, monkeypatch):
+    "main() roots the config at ~/.lens_editor, keep it out of the real home"
+    monkeypatch.setenv("HOME", str(tmp_path))
+    yield tmp_path
+    # write the debounced save before tmp_path goes away
+    Config().flush()
+    Config._instance = None
+
+
+def test_classify(tmp_path, capsys):
+    root = tmp_path / "xml"
+    root.mkdir()
+    write(root / "1.xml", ("0101", 1400, 10, 1410, 30), ("0002", 100, 10, 120, 12))
+    write(root / "2.xml", ("0002", 100, 10, 130, 12))
+    write(root / "3.xml", ("0002", 100, 10, 105, 12))
+    rules, uncertain = tmp_path / "rules.txt", tmp_path / "uncertain.txt"
+    rules.write_text("0101 x>1200\n", encoding="utf-8")
+    uncertain.write_text("0002 w>10\n", encoding="utf-8")
+
+    main(["classify", str(root), "--rules", str(rules), "--uncertain", str(uncertain), "-j", "1"])
+    records = [json.loads(l) for l in capsys.readouterr().out.splitlines()]
+    assert [(r["file"][-5:], r["verdict"]) for r in records] == [
+        ("1.xml", "不合格"),
+        ("2.xml", "不确定"),
+        ("3.xml", "合格"),
+    ]
+    assert records[0]["failed"] == [
+        {"name": "0101", "bbox": [1400, 10, 1410, 30], "message": "['x>1200']"}
+    ]
+
+    out = tmp_path / "out.csv"
+    main(["classify", str(root), "--rules", str(rules), "-o", str(out), "-j", "1"])
+    with open(out, encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["file", "verdict", "failed", "details"]
+    assert [r[1:3] for r in rows[1:]] == [["不合格", "1"], ["合格", "0"], ["合格", "0"]]
+
+
+def test_classify_regions_and_errors(tmp_path, capsys):
+    root = tmp_path / "xml"
+    root.mkdir()
+    write(root / "1.xml", ("0101", 1400, 10, 1410, 30))
+    (root / "2.xml").write_text("<annotation><object>", encoding="utf-8")
+    write(root / "3.xml", ("0002", 100, 10, 105, 12))
+    # well-formed, but no <bndbox> or no coordinate text
+    (root / "4.xml").write_text("<annotation><object><name>0101</name></object></annotation>")
+    write(root / "5.xml", ("0002", "", 10, 105, 12))
+    write(root / "6.xml", ("0002", 100, 10, 105, 12))
+    rules = tmp_path / "rules.txt"
+    rules.write_text("0101 @A\n", encoding="utf-8")
+
+    for jobs in ("1", "2"):
+        main(["classify", str(root), "--rules", str(rules), "-j", jobs])
+        records = [json.loads(l) for l in capsys.readouterr().out.splitlines()]
+        assert [(r["file"][-5:], r["verdict"]) for r in records] == [
+            ("1.xml", "不合格"),
+            ("2.xml", "error"),
+            ("3.xml", "合格"),
+            ("4.xml", "error"),
+            ("5.xml", "error"),
+            ("6.xml", "合格"),
+        ]
+        assert records[0]["failed"][0]["message"] == "['@A']"
+        assert all(records[i]["error"] for i in (1, 3, 4))
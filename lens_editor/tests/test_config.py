@@ -0,0 +1,48 @@
+import time
+from configparser import ConfigParser
+
+from pytest import fixture
+
+from ..config import Config
+
+
+@fixture
+def config(tmp_path):
+    def make(delay):
+        Config._instance = None
+        return Config(tmp_path / "cfg", delay=delay)
+
+    yield make
+    Config._instance = None
+
+
+def read(path):
+    parser = ConfigParser()
+    parser.read(path)
+    return parser
+
+
+def test_set_is_debounced(config, tmp_path, monkeypatch):
+    path = tmp_path / "cfg"
+    cfg = config(60)
+    saves = []
+    real_save = cfg.save
+    monkeypatch.setattr(cfg, "save", lambda: (saves.append(1), real_save()))
+    for i in range(50):
+        cfg.set("rule", "default", "x" * i)
+    assert not path.exists()
+    cfg.flush()
+    assert len(saves) == 1
+    assert read(path).get("rule", "default") == "x" * 49
+    cfg.flush()
+    assert len(saves) == 1
+
+
+def test_timer_saves(config, tmp_path):
+    path = tmp_path / "cfg"
+    cfg = config(0.01)
+    assert cfg.setup("load", "backend", "thread") == "thread"
+    deadline = time.monotonic() + 5
+    while not path.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert read(path).get("load", "backend") == "thread"
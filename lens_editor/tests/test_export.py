@@ -0,0 +1,50 @@
+import csv
+from pathlib import Path
+from types import SimpleNamespace
+
+import openpyxl
+
+from ..export import COUNT_HEADER, LINE_SUFFIXES, export_count, line_names
+from ..rule import linewindow
+from ..spatial import ChannelIndex
+from .test_search import make_defects
+
+
+def test_line_names_match_per_suffix_lookup():
+    left = [
+        SimpleNamespace(name=n, x=x, y=y, x_=x + 5, y_=y + 5, width=5, height=5)
+        for n, x, y in [("0101", 100, 130), ("0203", 104, 150), ("0001", 108, 300), ("0204", 2, 2)]
+    ]
+    index = ChannelIndex(left)
+    d = SimpleNamespace(name="2103", x=1300, y=-800, x_=1320, y_=-600,
+                        lens=SimpleNamespace(left_index=index))
+    expected = []
+    for suffix in LINE_SUFFIXES:
+        found = index.endswith(suffix).boxes(*linewindow(d.x, d.y, d.x_, d.y_))
+        if found:
+            expected.append(found[0].name)
+    assert line_names(d) == expected == ["0101", "0203"]
+
+
+def test_export_count(tmp_path):
+    defects = make_defects()
+    for d in defects:
+        d.lens.left_index = ChannelIndex([])
+    path = tmp_path / "count.xlsx"
+    assert export_count(defects, ["0101", "0002"], path) == len(
+        [d for d in defects if d.name != "0102"]
+    )
+    rows = list(openpyxl.load_workbook(path).worksheets[0].values)
+    assert list(rows[0]) == COUNT_HEADER
+    assert [r[1] for r in rows[1:]] == [d.name for d in defects if d.name != "0102"]
+
+    path = tmp_path / "count.csv"
+    assert export_count(defects, ["0102"], path) is not None
+    with open(path, encoding="utf-8-sig") as f:
+        assert next(csv.reader(f)) == COUNT_HEADER
+
+
+def test_export_count_cancel(tmp_path):
+    path = tmp_path / "count.csv"
+    assert export_count(make_defects(), ["0101"], path, cancelled=lambda: True) is None
+    assert not Path(path).exists()
@@ -0,0 +1,69 @@
+import os
+
+import cv2
+import numpy as np
+from pytest import fixture
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from PySide6.QtCore import QPoint, Qt
+from PySide6.QtTest import QTest
+from PySide6.QtWidgets import QApplication, QGraphicsScene, QGraphicsView
+
+from ..defect import Lens, xml_writer
+from ..grid import VirtualGrid
+from ..table import DefectTable
+
+BOX = "<object><name>{:04d}</name><bndbox><xmin>{}</xmin><ymin>100</ymin><xmax>{}</xmax><ymax>110</ymax></bndbox></object>"
+
+
+@fixture
+def lens(tmp_path):
+    objects = "".join(BOX.format(i, 20 * i, 20 * i + 10) for i in range(60))
+    xml_path = tmp_path / "1.xml"
+    xml_path.write_text(f"<annotation>{objects}</annotation>")
+    img_path = tmp_path / "1.jpeg"
+    cv2.imwrite(str(img_path), np.zeros((200, 1300, 3), dtype=np.uint8))
+    yield Lens(xml_path, img_path, DefectTable())
+    xml_writer.flush()
+
+
+def test_selection_survives_recycling(lens):
+    QApplication.instance() or QApplication([])
+    scene = QGraphicsScene()
+    view = QGraphicsView(scene)
+    view.resize(200, 200)
+    grid = VirtualGrid(view, scene, prefetch=0)
+    d_list = list(lens.defects)
+    grid.set_defects(d_list, 1)
+    lens.defects[1].mark = True
+    grid.items[0].setSelected(True)
+    grid.items[1].setSelected(True)
+
+    bar = view.verticalScrollBar()
+    bar.setValue(bar.maximum())
+    assert 0 not in grid.items and 1 not in grid.items
+    assert grid.selected == {0, 1}
+    # the recycled items now show other rows, unselected
+    assert not any(item.isSelected() for item in grid.items.values())
+
+    bar.setValue(0)
+    assert grid.items[0].isSelected() and grid.items[1].isSelected()
+    assert not grid.items[2].isSelected()
+    grid.items[1].setSelected(False)
+    # still marked
+    assert grid.items[1].label.brush().color().name() == "#008000"
+    assert [d for d, _ in grid.selection()] == [d_list[0]]
+
+    grid.items[1].setSelected(True)
+    bar.setValue(bar.maximum())
+    # a plain click beside the grid starts a new selection
+    QTest.mouseClick(view.viewport(), Qt.LeftButton, Qt.NoModifier, QPoint(150, 100))
+    assert grid.selection() == []
+
+    bar.setValue(0)
+    grid.items[0].setSelected(True)
+    grid.items[1].setSelected(True)
+    bar.setValue(bar.maximum())
+    for d, _ in grid.selection():
+        d.remove()
+    assert [d.name for d in lens.defects] == [d.name for d in d_list[2:]]
@@ -0,0 +1,52 @@
+import json
+
+from pytest import fixture, raises
+
+from .. import perf
+
+
+@fixture
+def recording():
+    perf.enable()
+    yield
+    perf.disable()
+
+
+def test_disabled_records_nothing():
+    assert not perf.enabled()
+    with perf.span("a") as s:
+        perf.count("c")
+        perf.observe("h", 3)
+    assert s is perf.span("b")
+    assert perf.last("a") is None
+    with raises(ValueError):
+        perf.export_trace("unused.json")
+
+
+def test_spans_counters_histograms(recording, tmp_path):
+    @perf.timed("outer")
+    def work():
+        with perf.span("inner", n=2):
+            perf.count("items", 2)
+        perf.count("items")
+        for v in (1, 2, 3, 100):
+            perf.observe("bytes", v)
+        return "done"
+
+    assert work() == "done"
+    s = perf.span("manual").start()
+    s.stop()
+    assert perf.last("outer") >= perf.last("inner") >= 0
+    assert perf.status(["inner", "missing"]).startswith("inner ")
+    report = perf.report()
+    for name in ("outer", "inner", "manual", "items", "bytes"):
+        assert name in report
+
+    path = tmp_path / "trace.json"
+    assert perf.export_trace(path) == 5
+    events = json.loads(path.read_text())["traceEvents"]
+    spans = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert spans.keys() == {"outer", "inner", "manual"}
+    assert spans["inner"]["args"] == {"n": 2}
+    assert spans["outer"]["dur"] >= spans["inner"]["dur"]
+    assert [e["args"]["items"] for e in events if e["ph"] == "C"] == [2, 3]
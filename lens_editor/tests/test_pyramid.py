@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from ..pyramid import LEVELS, ImagePyramid, pyramid_cache, pyramid_for
+
+
+def make_lens(path="/data/1.jpeg"):
+    img = np.zeros((600, 500, 3), dtype=np.uint8)
+    img[10, 20] = (1, 2, 3)
+    return SimpleNamespace(img=img, img_path=path)
+
+
+def test_levels_and_pixel():
+    p = ImagePyramid(make_lens())
+    assert [level.shape[:2] for level in p.levels] == [(600, 500), (300, 250), (150, 125), (75, 63)]
+    assert p.nbytes == sum(level.nbytes for level in p.levels)
+    # bgr array, rgb pixel
+    assert p.pixel(20, 10) == (3, 2, 1)
+    assert p.pixel(-5, 10_000) == (0, 0, 0)
+    assert [p.level_for(lod) for lod in (4, 1, 0.6, 0.5, 0.2, 0.01)] == [0, 0, 0, 1, 2, LEVELS - 1]
+
+
+def test_pyramid_shared_per_lens():
+    pyramid_cache.clear()
+    lens = make_lens()
+    assert pyramid_for(lens) is pyramid_for(lens)
+    assert pyramid_for(make_lens("/data/2.jpeg")) is not pyramid_for(lens)
@@ -0,0 +1,41 @@
+import numpy as np
+from pytest import raises
+
+from ..region import DEFAULT_PROFILES, REGIONS, RegionProfile, RegionProfiles
+from ..table import DefectTable
+
+
+def expected_region(x, profile):
+    for letter, pairs in profile.intervals.items():
+        if any(low < x < high for low, high in pairs):
+            return REGIONS.index(letter)
+    return -1
+
+
+def test_label_matches_intervals():
+    for name in DEFAULT_PROFILES:
+        profile = RegionProfiles().get(name)
+        x = np.arange(-5, 2500)
+        expected = [expected_region(v, profile) for v in x]
+        assert profile.label(x).tolist() == expected
+        assert [profile.code(v) for v in x[::37].tolist()] == expected[::37]
+
+
+def test_parse_errors():
+    with raises(ValueError):
+        RegionProfile.parse("x", "A=1-10 B=5-20")
+    with raises(ValueError):
+        RegionProfile.parse("x", "A=1-ten")
+    with raises(ValueError):
+        RegionProfiles().get("99")
+
+
+def test_table_labels():
+    table = DefectTable()
+    profile = RegionProfiles().get("72")
+    table.extend(None, [("0101", 1400, 0, 1410, 10)])
+    table.label_regions(profile)
+    rows = table.extend(None, [("0101", 1800, 0, 1810, 10), ("0101", 535, 0, 540, 9)])
+    assert table.column("region_id").tolist() == [0, 1, -1]
+    table.set("xmin", rows[0], 2300)
+    assert table.column("region_id").tolist() == [0, 3, -1]
@@ -1,6 +1,20 @@
+import pytest
 from pytest import fixture
-from dataclasses import dataclass
-from ..rule import Ruleset, xymapping
+from dataclasses import dataclass, field
+from ..rule import (
+    FAIL,
+    PASS,
+    UNCERTAIN,
+    Ruleset,
+    RuleCache,
+    RuleProfile,
+    classify_chunks,
+    classify_lenses,
+    failures,
+    fold_constant,
+    split_comparison,
+    xymapping,
+)
 
 
 
@@ -17,7 +31,7 @@ class Defect:
     y: int = 0
     h: int = 0
     w: int = 0
-    lens: Lens = Lens()
+    lens: Lens = field(default_factory=Lens)
 
 
 def test_rule_x():
@@ -46,10 +60,13 @@ def test_rule_empty():
 
 def test_rule_left_contain():
     rule = Ruleset("1111 -01")
-    d = Defect("1111", x=9)
-    left = [Defect("0001", x=9,y=9,h=9,w=9)]
-    d.lens.left = left
-    assert rule(d) == "found ['0001'] in left"
+    lens = Lens()
+    # right channel (1400, 100) looks at x 125..375, y 1025..1275 on the left
+    d = Defect("1111", x=1400, y=100, lens=lens)
+    lens.left = [Defect("0001", x=200, y=1100, h=9, w=9)]
+    assert rule(d) == "['-01']"
+    lens.left = [Defect("0001", x=9, y=9, h=9, w=9)]
+    assert rule(d) is None
 
 def test_xymapping():
     x = 2400
@@ -58,3 +75,220 @@ def test_xymapping():
     y_ = 0
     fn = xymapping(x,y)
     assert fn(x_,y_) is False
+
+
+def test_fold_constant():
+    assert fold_constant("7*1.57") == 7 * 1.57
+    assert fold_constant("-3") == -3
+    with pytest.raises(ValueError):
+        fold_constant("__import__('os')")
+
+
+def test_split_comparison():
+    assert split_comparison("w>=7*1.57") == ("w", ">=", 7 * 1.57)
+    assert split_comparison("x<=1710") == ("x", "<=", 1710)
+    assert split_comparison("h<40") == ("h", "<", 40)
+
+
+def test_rule_compiled_matches_eval():
+    lines = ["1111 x>10 x<=20 w>7*1.57", "1111 x>10 w<=7*1.57 h==3"]
+    rule = Ruleset("\n".join(lines))
+    for x in (9, 10, 11, 20, 21):
+        for w in (10, 11, 12):
+            d = Defect("1111", x=x, w=w, h=3)
+            expected = None
+            for line in lines:
+                _, *sexps = line.split()
+                if all(eval(f"d.{s}", {"d": d}) for s in sexps):
+                    expected = f"{sexps}"
+                    break
+            assert rule(d) == expected
+
+
+def test_evaluate_batch_matches_call():
+    rule = Ruleset("1111 x>10 w>5\n1111 x>10\n2222 y<=5 h>1*2")
+    defects = [
+        Defect("1111", x=11, w=6),
+        Defect("1111", x=11, w=5),
+        Defect("1111", x=10),
+        Defect("2222", y=5, h=3),
+        Defect("2222", y=6, h=3),
+        Defect("3333", x=100),
+    ]
+    assert rule.evaluate_batch(defects) == [rule(d) for d in defects]
+
+
+def test_predicates_cheap_first_and_shared():
+    rule = Ruleset("1111 -01 x>10\n1111 -01 y>10")
+    first, second = rule.rules["1111"].handlers
+    assert first.others[0] is second.others[0] is rule.predicates["-01"]
+    calls = []
+
+    def left_contain(d):
+        calls.append(d)
+        return d.w > 0
+
+    rule.predicates["-01"].fn = left_contain
+    # x>10 rejects the first line before the lookup, the second line asks once
+    assert rule(Defect("1111", x=5, y=20)) is None
+    assert len(calls) == 1
+    # both lines need -01, it runs once for the defect
+    assert rule(Defect("1111", x=20, y=20)) is None
+    assert len(calls) == 2
+    assert rule(Defect("1111", x=20, w=1)) == "['-01', 'x>10']"
+
+    defects = [Defect("1111", x=20, y=20), Defect("1111", x=5, y=5, w=1)]
+    del calls[:]
+    assert rule.evaluate_batch(defects) == [None, None]
+    assert len(calls) == 1
+
+
+def test_rule_profile(tmp_path):
+    rule = Ruleset("1111 x>10 w>5\n1111 x>10\n2222 y<=5")
+    profile = RuleProfile()
+    profile.attach(rule)
+    defects = [Defect("1111", x=11, w=6), Defect("1111", x=11), Defect("1111", x=5)]
+    expected = ["['x>10', 'w>5']", "['x>10']", None]
+    assert rule.evaluate_batch(defects) == expected
+    assert [rule(d) for d in defects] == expected
+    first, second, other = sorted(profile.lines, key=lambda s: (s.name, s.index))
+    assert (first.evaluated, first.matched) == (6, 2)
+    assert (second.evaluated, second.matched) == (4, 2)
+    assert other.evaluated == 0
+    # the per defect path shares x>10 with the second line
+    assert first.calls["scalar"] == 3 * 2 + 3 + 2
+    assert second.calls["scalar"] == 0
+    assert all(s.calls["-"] == 0 for s in profile.lines)
+
+    path = tmp_path / "profile.csv"
+    assert profile.to_csv(path) == 3
+    header, *rows = path.read_text(encoding="utf-8").splitlines()
+    assert header.split(",") == RuleProfile.HEADER
+    assert any(r.startswith("rule,1111,1,1111 x>10 w>5,6,2,") for r in rows)
+
+
+def test_rule_region():
+    rule = Ruleset("1111 @B w>5")
+    defects = [Defect("1111", w=6), Defect("1111", w=6), Defect("1111", w=2)]
+    for d, region_id in zip(defects, [1, 0, 1]):
+        d.region_id = region_id
+    assert rule.evaluate_batch(defects) == [rule(d) for d in defects]
+    assert [m is not None for m in rule.evaluate_batch(defects)] == [True, False, False]
+    with pytest.raises(ValueError):
+        Ruleset("1111 @E")
+
+
+def test_classify_lenses():
+    bad, unsure, good = Lens(), Lens(), Lens()
+    bad.defects = [Defect("1111", x=11, lens=bad), Defect("2222", w=6, lens=bad)]
+    unsure.defects = [Defect("2222", w=6, lens=unsure)]
+    good.defects = [Defect("1111", x=1, lens=good)]
+    results = classify_lenses(
+        [bad, unsure, good], Ruleset("1111 x>10"), Ruleset("2222 w>5")
+    )
+    assert [(r[1], [d.name for d, _ in r[2]]) for r in results] == [
+        (FAIL, ["1111"]),
+        (UNCERTAIN, ["2222"]),
+        (PASS, []),
+    ]
+    assert [r[1] for r in classify_lenses([unsure], Ruleset("1111 x>10"))] == [PASS]
+
+
+def test_classify_chunks():
+    lenses = []
+    for x in (11, 1, 12, 2, 13):
+        lens = Lens()
+        lens.defects = [Defect("1111", x=x, lens=lens)]
+        lenses.append(lens)
+    ruleset = Ruleset("1111 x>10")
+    chunks = []
+    n = classify_chunks(lenses, ruleset, chunk_size=2, emit=lambda *c: chunks.append(c))
+    assert n == 5
+    assert [(done, total) for done, total, _ in chunks] == [(2, 5), (4, 5), (5, 5)]
+    streamed = [r for _, _, results in chunks for r in results]
+    assert streamed == classify_lenses(lenses, ruleset)
+
+    del chunks[:]
+    n = classify_chunks(
+        lenses, ruleset, chunk_size=2,
+        emit=lambda *c: chunks.append(c), cancelled=lambda: len(chunks) == 1,
+    )
+    assert n is None
+    assert len(chunks) == 1
+
+
+class CachedLens:
+    def __init__(self, *defects):
+        self.left = []
+        self.version = 0
+        self.defects = list(defects)
+        for d in self.defects:
+            d.lens = self
+
+
+def test_rule_cache(monkeypatch):
+    lenses = [
+        CachedLens(Defect("1111", x=x), Defect("2222", w=x // 2), Defect("3333"))
+        for x in range(0, 40, 5)
+    ]
+    cache, evaluated = RuleCache(), []
+    evaluate = Ruleset.evaluate_batch
+
+    def counting(self, defects):
+        evaluated.append(len(defects))
+        return evaluate(self, defects)
+
+    monkeypatch.setattr(Ruleset, "evaluate_batch", counting)
+
+    def check(rule_text, expected_count):
+        ruleset = Ruleset(rule_text)
+        expected = failures(ruleset, lenses)
+        evaluated.clear()
+        assert cache.failures(ruleset, lenses) == expected
+        assert sum(evaluated) == expected_count
+
+    check("1111 x>10\n2222 w>5", 24)
+    check("1111  x>10\n2222 w>5\n", 0)
+    # only the defects named 2222 have different rules
+    check("1111 x>10\n2222 w>7", 8)
+    check("1111 x>10\n2222 w>7\n3333 h>=0", 8)
+    lenses[0].defects[0].x = 50
+    lenses[0].version += 1
+    check("1111 x>10\n2222 w>7\n3333 h>=0", 3)
+    # lenses left out of a run catch up on the rules changed meanwhile
+    cache.failures(Ruleset("1111 x>20\n2222 w>7\n3333 h>=0"), lenses[:1])
+    check("1111 x>20\n2222 w>7\n3333 h>=0", 7)
+    # a line added after x>20 only runs on the 1111 defects x>20 left
+    check("1111 x>20\n1111 w>3\n2222 w>7\n3333 h>=0", 4)
+
+
+def test_rule_cache_kept_lines_per_name():
+    lenses = [CachedLens(Defect("0101", x=10, y=500), Defect("0102", x=10, w=1))]
+    cache = RuleCache()
+    before = Ruleset("0101 x>5\n0101 y>1000\n0102 w>100\n0102 x>5")
+    assert cache.failures(before, lenses) == failures(before, lenses)
+    # 0101 keeps x>5, the 0102 defect matched its own x>5 line, now changed
+    after = Ruleset("0101 x>5\n0101 y>2000\n0102 w>100\n0102 x>5000")
+    assert cache.failures(after, lenses) == failures(after, lenses)
+    assert [d.name for d, _ in cache.failures(after, lenses)[0]] == ["0101"]
+
+
+def test_rule_cache_parses_suffix_once(monkeypatch):
+    lenses = [CachedLens(Defect("1111", x=x)) for x in range(10)]
+    cache = RuleCache()
+    cache.failures(Ruleset("1111 x>5\n1111 x>1"), lenses)
+    suffixes = []
+    suffix = RuleCache._suffix
+
+    def spy(self, *args):
+        result = suffix(self, *args)
+        suffixes.append(result[0])
+        return result
+
+    monkeypatch.setattr(RuleCache, "_suffix", spy)
+    ruleset = Ruleset("1111 x>5\n1111 x>2")
+    # chunks of one run share the parsed suffix
+    for start in range(0, 10, 2):
+        cache.failures(ruleset, lenses[start : start + 2])
+    assert cache.failures(ruleset, lenses) == failures(ruleset, lenses)
+    assert len(suffixes) > 1 and all(r is suffixes[0] for r in suffixes)
@@ -0,0 +1,116 @@
+import random
+from pathlib import Path
+from types import SimpleNamespace
+
+from pytest import raises
+
+from ..defect import Defect
+from ..query import compile_query
+from ..region import RegionProfiles
+from ..search import FilterParser
+from ..table import DefectTable
+
+A72 = [120, 535, 1330, 1710]
+B72 = [536, 815, 1711, 1960]
+C70 = [816, 1060, 1961, 2185]
+
+
+def inside(x, bounds):
+    return any(lo < x < hi for lo, hi in zip(bounds[::2], bounds[1::2]))
+
+
+QUERIES = {
+    "A": lambda d: inside(d.x, A72),
+    "72B": lambda d: inside(d.x, B72),
+    "70C": lambda d: inside(d.x, C70),
+    "name=0101": lambda d: d.name == "0101",
+    "name=0101-B": lambda d: d.name == "0101" and inside(d.x, B72),
+    "name=9999": lambda d: False,
+    "name=01*": lambda d: d.name.startswith("01"),
+    "x>1200": lambda d: d.x > 1200,
+    "x>=1330 x<=1710": lambda d: 1330 <= d.x <= 1710,
+    "1329<x<=1710": lambda d: 1329 < d.x <= 1710,
+    "10 < w": lambda d: d.w > 10,
+    "w>=20 h<30": lambda d: d.w >= 20 and d.h < 30,
+    "w>=4*5": lambda d: d.w >= 20,
+    "y!=100 and h=5": lambda d: d.y != 100 and d.h == 5,
+    "x>1200 name=0101": lambda d: d.x > 1200 and d.name == "0101",
+    "name=0002 or (mark and not w>10)": lambda d: d.name == "0002" or (d.mark and not d.w > 10),
+    "mark": lambda d: d.mark,
+    "-mark": lambda d: not d.mark,
+    "mod": lambda d: d.lens.modified,
+    "-mod": lambda d: not d.lens.modified,
+    "fn=3.xml": lambda d: "3.xml" in str(d.lens.xml_path),
+    "fn 2.xml or fn 4.xml": lambda d: d.lens.xml_path.name in ("2.xml", "4.xml"),
+    "fn:3.xml": lambda d: "3.xml" in str(d.lens.xml_path),
+    # name and fn values that are also attribute names
+    "name=w": lambda d: False,
+    "fn=x": lambda d: True,
+    "fn=h": lambda d: False,
+    # invalid queries keep nothing
+    "unknown": lambda d: False,
+    "x>oops": lambda d: False,
+    "(mark": lambda d: False,
+}
+
+
+def make_defects(n_lens=6, per_lens=50):
+    rng = random.Random(0)
+    table = DefectTable()
+    defects = []
+    for i in range(n_lens):
+        lens = SimpleNamespace(
+            modified=i % 3 == 0, xml_path=Path(f"/data/{i}.xml"), version=0
+        )
+        records = []
+        for _ in range(per_lens):
+            x, y = rng.randrange(0, 2400), rng.randrange(0, 2400)
+            w, h = rng.randrange(0, 40), rng.randrange(0, 40)
+            records.append((rng.choice(["0101", "0102", "0002"]), x, y, x + w, y + h))
+        defects += [Defect(table, r) for r in table.extend(lens, records)]
+    for d in defects[::7]:
+        d.mark = True
+    return defects
+
+
+def test_queries():
+    defects = make_defects()
+    indexed = FilterParser()
+    indexed.build_index(defects)
+    for q, keep in QUERIES.items():
+        expected = [d for d in defects if keep(d)]
+        assert indexed.parse(q, defects) == expected, q
+        assert FilterParser().parse(q, list(defects)) == expected, q
+
+
+def test_invalid_query_error():
+    defects = make_defects()
+    parser = FilterParser()
+    assert parser.parse("x>oops", defects) == []
+    assert parser.error
+    parser.parse("x>4", defects)
+    assert parser.error is None
+
+
+def test_index_follows_edits():
+    defects = make_defects()
+    parser = FilterParser()
+    parser.build_index(defects)
+    d = defects[0]
+    assert d not in parser.parse("x>4000", defects)
+    d.xmin = 5000
+    assert d in parser.parse("x>4000", defects)
+    before = d in parser.parse("mark", defects)
+    d.mark = not d.mark
+    assert (d in parser.parse("mark", defects)) != before
+
+
+def test_to_sql():
+    sql = compile_query("name=01* or 1329<x<=1710", RegionProfiles()).sql()
+    assert sql == ("(o.name GLOB ? OR (o.xmin > ? AND o.xmin <= ?))", ["01*", 1329, 1710])
+    assert compile_query("name=x", RegionProfiles()).sql() == ("o.name = ?", ["x"])
+    assert compile_query("fn=h", RegionProfiles()).sql() == ("instr(f.path, ?) > 0", ["h"])
+    with raises(ValueError):
+        compile_query("mark", RegionProfiles()).sql()
+    with raises(ValueError):
+        compile_query("name=0101-Z", RegionProfiles())
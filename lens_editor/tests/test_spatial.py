@@ -0,0 +1,45 @@
+from dataclasses import dataclass
+
+from ..rule import linemapping, linewindow, xymapping, xywindow
+from ..spatial import ChannelIndex
+
+
+@dataclass
+class Defect:
+    name: str
+    x: int
+    y: int
+    x_: int
+    y_: int
+
+
+LEFT = [
+    Defect("0101", 100, 100, 110, 110),
+    Defect("0102", 105, 110, 120, 130),
+    Defect("0201", 1000, 900, 1010, 905),
+    Defect("0002", 104, 120, 106, 122),
+]
+
+
+def test_points_match_xymapping():
+    index = ChannelIndex(LEFT)
+    for x, y in [(1200 + 100, 100 - 925 - 10), (1300, 2300), (1100, 800)]:
+        fn = xymapping(x, y)
+        expected = [d for d in LEFT if fn(d.x, d.y)]
+        assert index.points(*xywindow(x, y)) == expected
+
+
+def test_boxes_match_linemapping():
+    index = ChannelIndex(LEFT)
+    box = (1230, 1250, 1240, 1260)
+    fn = linemapping(*box)
+    expected = [d for d in LEFT if fn(d.x, d.y, d.x_, d.y_)]
+    assert expected
+    assert index.boxes(*linewindow(*box)) == expected
+
+
+def test_endswith_keeps_order():
+    index = ChannelIndex(LEFT)
+    assert index.endswith("01").defects == [LEFT[0], LEFT[2]]
+    assert index.endswith("2").any_point(0, 2400, 0, 2400)
+    assert not index.endswith("9").any_point(0, 2400, 0, 2400)
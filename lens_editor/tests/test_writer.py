@@ -0,0 +1,57 @@
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+from .. import writer
+from ..writer import WriteBehind
+
+
+class FakeLens:
+    def __init__(self, path):
+        path.write_text("<annotation><object><name>0101</name></object></annotation>")
+        self.xml_path = path
+        self.tree = ET.parse(path)
+        self.lock = threading.RLock()
+
+
+def test_flush_coalesces(tmp_path, monkeypatch):
+    written = []
+    real_write = writer.write_atomic
+    monkeypatch.setattr(writer, "write_atomic", lambda p, d: (written.append(p), real_write(p, d)))
+    lens = FakeLens(tmp_path / "1.xml")
+    queue = WriteBehind(delay=60)
+    for name in ["0102", "0103", "0104"]:
+        lens.tree.getroot().find("object/name").text = name
+        queue.schedule(lens)
+    assert queue.pending() == 1
+    queue.flush()
+    assert written == [lens.xml_path]
+    assert ET.parse(lens.xml_path).getroot().find("object/name").text == "0104"
+    assert [p.name for p in tmp_path.iterdir()] == ["1.xml"]
+
+
+def test_background_write(tmp_path):
+    lens = FakeLens(tmp_path / "1.xml")
+    queue = WriteBehind(delay=0.01)
+    lens.tree.getroot().remove(lens.tree.getroot().find("object"))
+    queue.schedule(lens)
+    deadline = time.monotonic() + 5
+    while queue.pending() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert ET.parse(lens.xml_path).getroot().find("object") is None
+
+
+def test_failed_write_stays_queued(tmp_path, monkeypatch):
+    lens = FakeLens(tmp_path / "1.xml")
+    queue = WriteBehind(delay=60, retry=60)
+
+    def fail(path, data):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(writer, "write_atomic", fail)
+    queue.schedule(lens)
+    assert queue.flush() == [lens]
+    assert queue.pending() == 1
+    monkeypatch.undo()
+    assert queue.flush() == []
+    assert queue.pending() == 0
@@ -0,0 +1,134 @@
+import cv2
+import numpy as np
+from pytest import fixture, raises
+
+from ..defect import Lens, image_cache, thumb_cache
+from ..grid import thumb_heights
+from ..loader import ProcessLoader, make_thumbnail
+from ..minimap import Minimap, paste
+from ..table import DefectTable
+
+XML = """<annotation>
+<object><name>0101</name><bndbox><xmin>1400</xmin><ymin>100</ymin><xmax>1410</xmax><ymax>120</ymax></bndbox></object>
+<object><name>0002</name><bndbox><xmin>300</xmin><ymin>1100</ymin><xmax>305</xmax><ymax>1103</ymax></bndbox></object>
+<object><name>0101</name><bndbox><xmin>2000</xmin><ymin>2000</ymin><xmax>2030</xmax><ymax>2004</ymax></bndbox></object>
+</annotation>"""
+
+
+@fixture
+def lens_files(tmp_path):
+    xml_path = tmp_path / "1.xml"
+    xml_path.write_text(XML)
+    img_path = tmp_path / "1.jpeg"
+    cv2.imwrite(str(img_path), np.zeros((2400, 2400, 3), dtype=np.uint8))
+    return xml_path, img_path
+
+
+def test_lens_rows(lens_files):
+    table = DefectTable()
+    lens = Lens(*lens_files, table)
+    assert len(table) == 3
+    assert [d.name for d in lens.defects] == ["0101", "0002", "0101"]
+    d = lens.defects[2]
+    assert (d.x, d.y, d.x_, d.y_, d.w, d.h) == (2000, 2000, 2030, 2004, 30, 4)
+    assert d.lens is lens
+    assert d.image.shape == (4, 30, 3)
+    assert lens.left == [lens.defects[1]]
+
+
+def test_table_columns(lens_files):
+    table = DefectTable()
+    Lens(*lens_files, table)
+    Lens(*lens_files, table)
+    assert len(table) == 6
+    assert table.names == ["0101", "0002"]
+    assert table.column("w").tolist() == [10, 5, 30] * 2
+    assert table.column("lens_id", np.array([0, 3])).tolist() == [0, 1]
+    assert table.name_rank().tolist() == [1, 0]
+
+
+def test_rename_and_mark(lens_files):
+    lens = Lens(*lens_files)
+    d = lens.defects[0]
+    d.name = "0002"
+    assert lens.modified
+    assert lens.elements[0].find("name").text == "0002"
+    assert lens.table.column("name_id").tolist() == [1, 1, 0]
+    assert d.mark_toggle() and d.mark
+    assert lens.table.column("mark").tolist() == [True, False, False]
+
+
+def test_lens_version(lens_files, monkeypatch):
+    monkeypatch.setattr("lens_editor.defect.xml_writer.schedule", lambda lens: None)
+    lens = Lens(*lens_files)
+    d0, d1, d2 = lens.defects
+    versions = [lens.version]
+    d0.name = "0102"
+    d2.xmax += 1
+    versions.append(lens.version)
+    d2.mark = True
+    versions.append(lens.version)
+    d1.remove()
+    versions.append(lens.version)
+    assert versions[0] < versions[1] == versions[2] < versions[3]
+    assert lens.defects == [d0, d2] and lens.left == []
+
+
+def test_lazy_image(lens_files):
+    lens = Lens(*lens_files, lazy_image=True)
+    assert lens._img is None
+    assert lens.img.shape == (2400, 2400, 3)
+    assert lens.reduced_img(4).shape == (600, 600, 3)
+    with raises(ValueError):
+        lens.reduced_img(3)
+    assert lens.defects[0].image.shape == (20, 10, 3)
+
+
+def test_minimap_base(lens_files):
+    lens = Lens(*lens_files, lazy_image=True)
+    base, scale = lens.scaled_img(500)
+    assert base.shape == (500, 500, 3) and scale == 500 / 2400
+    # decoded at 1/4, the smallest reduction still wider than 500 px
+    assert (str(lens_files[1]), 4) in image_cache
+    assert (str(lens_files[1]), 1) not in image_cache
+    assert lens.scaled_img(500)[0] is base
+
+    minimap = Minimap(lens, 500)
+    canvas = minimap.base.copy()
+    for d in lens.defects:
+        minimap._overlay(canvas, d)
+    assert canvas.any() and not base.any()
+
+
+def test_paste_clips():
+    dst = np.zeros((10, 10), dtype=np.uint8)
+    paste(dst, np.ones((4, 4), dtype=np.uint8), 8, -2)
+    assert dst.sum() == 4 and dst[:2, 8:].all()
+    paste(dst, np.ones((4, 4), dtype=np.uint8), 20, 20)
+    assert dst.sum() == 4
+
+
+def test_process_loader(lens_files):
+    loader = ProcessLoader(max_workers=1)
+    try:
+        records, thumbnails = loader.load(*lens_files)
+    finally:
+        loader.shutdown()
+    assert records[0] == ("0101", 1400, 100, 1410, 120)
+    assert [t.shape for t in thumbnails] == [(100, 50, 3), (30, 50, 3), (7, 50, 3)]
+    lens = Lens(*lens_files, lazy_image=True, records=records)
+    lens.set_thumbnails(thumbnails)
+    assert lens._tree is None
+    assert thumb_cache.get(lens.defects[1].cache_key()) is thumbnails[1]
+    assert lens.elements[2].find("name").text == "0101"
+
+
+def test_make_thumbnail():
+    assert make_thumbnail(np.zeros((10, 100, 3), dtype=np.uint8)).shape == (5, 50, 3)
+    assert make_thumbnail(np.zeros((0, 4, 3), dtype=np.uint8)).shape == (0, 4, 3)
+
+
+def test_thumb_heights(lens_files):
+    lens = Lens(*lens_files, DefectTable())
+    heights = [make_thumbnail(d.image).shape[0] for d in lens.defects]
+    assert thumb_heights(lens.defects).tolist() == heights
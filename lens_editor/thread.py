@@ -1,3 +1,5 @@
+import sys
+
 from PySide6.QtCore import QObject, QRunnable, Signal
 
 
@@ -5,6 +7,9 @@ class WorkerSignals(QObject):
     finished = Signal()
     error = Signal(tuple)
     result = Signal(object)
+    progress = Signal(int, int)
+    # done, total and the results of one chunk, for jobs streaming results
+    chunk = Signal(int, int, object)
 
 
 class Worker(QRunnable):
@@ -14,12 +19,20 @@ class Worker(QRunnable):
         self.args = args
         self.kwargs = kwargs
         self.signals = WorkerSignals()
+        self._cancelled = False
+
+    def cancel(self):
+        "ask a job polling is_cancelled to stop"
+        self._cancelled = True
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled
 
     def run(self):
         try:
             result = self.fn(*self.args, **self.kwargs)
         except:
-            pass
+            self.signals.error.emit(sys.exc_info()[:2])
         else:
             self.signals.result.emit(result)
         finally:
@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .config import Singleton
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailStore(metaclass=Singleton):
+    """
+    Persistent thumbnail cache: PNG encoded thumbnails appended to one pack
+    file, with a json index of key -> (offset, length, last use). When the
+    pack grows past max_bytes it is compacted down to the most recently
+    used three quarters.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.pack_path = root / "thumbnails.pack"
+        self.index_path = root / "thumbnails.idx"
+        self._lock = threading.Lock()
+        self._clock = 0
+        self._dirty = False
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        self.index = {}
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.debug(e)
+        size = self.pack_path.stat().st_size if self.pack_path.exists() else 0
+        if any(off + length > size for off, length, _ in self.index.values()):
+            logger.error(f"thumbnail pack {self.pack_path} does not match its index")
+            self.index = {}
+            size = 0
+        self._clock = max([used for *_, used in self.index.values()] + [0])
+        self._writer = open(self.pack_path, "ab" if self.index else "wb")
+        self._reader = open(self.pack_path, "rb")
+        self.nbytes = size
+
+    @staticmethod
+    def key(img_path, mtime, bbox, width) -> str:
+        return f"{img_path}|{mtime}|{','.join(map(str, bbox))}|{width}"
+
+    def _touch(self, key) -> bool:
+        "mark key used, False when it is not stored"
+        with self._lock:
+            if (entry := self.index.get(key)) is None:
+                return False
+            self._clock += 1
+            entry[2] = self._clock
+            self._dirty = True
+            return True
+
+    def get(self, key):
+        with self._lock:
+            if (entry := self.index.get(key)) is None:
+                return None
+            offset, length, _ = entry
+            self._reader.seek(offset)
+            data = self._reader.read(length)
+            self._clock += 1
+            entry[2] = self._clock
+            self._dirty = True
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def put(self, key, thumb):
+        "append thumb under key, a key already stored is only marked used"
+        if thumb.size == 0 or self._touch(key):
+            return
+        ok, data = cv2.imencode(".png", thumb, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        if not ok:
+            return
+        with self._lock:
+            if key in self.index:
+                return
+            self._writer.write(data.tobytes())
+            self._writer.flush()
+            self._clock += 1
+            self.index[key] = [self.nbytes, len(data), self._clock]
+            self.nbytes += len(data)
+            self._dirty = True
+            if self.nbytes > self.max_bytes:
+                self._compact(self.max_bytes * 3 // 4)
+
+    def _compact(self, budget):
+        "rewrite the pack with the most recently used entries that fit budget"
+        keep, total = [], 0
+        for key, entry in sorted(self.index.items(), key=lambda kv: -kv[1][2]):
+            if total + entry[1] > budget:
+                break
+            keep.append((key, entry))
+            total += entry[1]
+        tmp_path = self.pack_path.with_suffix(".tmp")
+        index, offset = {}, 0
+        with open(tmp_path, "wb") as tmp:
+            for key, (off, length, used) in sorted(keep, key=lambda kv: kv[1][0]):
+                self._reader.seek(off)
+                tmp.write(self._reader.read(length))
+                index[key] = [offset, length, used]
+                offset += length
+        self._writer.close()
+        self._reader.close()
+        os.replace(tmp_path, self.pack_path)
+        self.index, self.nbytes = index, offset
+        self._writer = open(self.pack_path, "ab")
+        self._reader = open(self.pack_path, "rb")
+        self._save_index()
+        logger.info(f"thumbnail pack compacted to {len(index)} entries")
+
+    def _save_index(self):
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+
+def root_thumbnails(path, max_bytes):
+    root = Path(path).expanduser()
+    ThumbnailStore._instance = None
+    ThumbnailStore._instance = ThumbnailStore.__call__(root, max_bytes)
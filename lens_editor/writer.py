@@ -0,0 +1,121 @@
+import atexit
+import io
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def write_atomic(path, data: bytes) -> None:
+    "write to a temp file next to path and rename it over path"
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_lens(lens) -> None:
+    "serialize the tree under the lens lock, then write it atomically"
+    with lens.lock:
+        buf = io.BytesIO()
+        lens.tree.write(buf)
+        write_atomic(lens.xml_path, buf.getvalue())
+
+
+class WriteBehind:
+    """
+    Write-behind queue for lens xml files. schedule() marks a lens dirty
+    and a worker thread writes it `delay` seconds later, so a burst of
+    edits to one file costs one write. flush() writes everything pending
+    right away and waits for writes in progress. A lens that fails to
+    write stays queued and is tried again `retry` seconds later.
+    """
+
+    def __init__(self, delay=0.5, retry=5.0) -> None:
+        self.delay = delay
+        self.retry = retry
+        self._pending = {}
+        self._busy = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, lens) -> None:
+        with self._cond:
+            # keep the first due time, a steady stream of edits still lands
+            self._pending.setdefault(lens, time.monotonic() + self.delay)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending) + self._busy
+
+    def write(self, lens) -> None:
+        "write lens now, in the calling thread"
+        with self._cond:
+            self._pending.pop(lens, None)
+        write_lens(lens)
+
+    def flush(self) -> list:
+        "write everything pending now, returns the lenses that failed"
+        with self._cond:
+            ready = list(self._pending)
+            self._pending.clear()
+            self._busy += 1
+        try:
+            return self._write_all(ready)
+        finally:
+            with self._cond:
+                self._busy -= 1
+                self._cond.notify_all()
+                while self._busy:
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                now = time.monotonic()
+                due = min(self._pending.values())
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                ready = [lens for lens, t in self._pending.items() if t <= now]
+                for lens in ready:
+                    del self._pending[lens]
+                self._busy += 1
+            try:
+                self._write_all(ready)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+                    self._cond.notify_all()
+
+    def _write_all(self, lenses) -> list:
+        failed = []
+        for lens in lenses:
+            try:
+                write_lens(lens)
+            except Exception as e:
+                logger.error(f"cannot write {lens.xml_path}: {e}")
+                failed.append(lens)
+        if failed:
+            with self._cond:
+                due = time.monotonic() + self.retry
+                for lens in failed:
+                    self._pending.setdefault(lens, due)
+                self._cond.notify()
+        return failed
+
+
+xml_writer = WriteBehind()
+atexit.register(xml_writer.flush)